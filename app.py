@@ -1,23 +1,103 @@
 import pandas as pd
 import folium
 from folium.plugins import MarkerCluster, Fullscreen, MiniMap
-from folium.features import FeatureGroup
-from flask import Flask, render_template_string, request, jsonify, send_file
+from flask import Flask, render_template_string, request, jsonify, send_file, Response
 from datetime import datetime
 import random
 import os
 import io
-import math # Import the math module for distance calculations
+import json
+import hashlib
+import re
+import shutil
+import sys
+import tempfile
+import zipfile
+from functools import partial
+from xml.parsers.expat import ExpatError
+import click
+import numpy as np
+from distance import selection_route_totals
+from dataset_cache import content_hash, load_cached_dataset, save_cached_dataset
+from registry import DatasetRegistry, DATASET_MEMORY_BUDGET_MB
+from lru import SizedLRUCache
+from dataset import (
+    Dataset, PARSED_TIME_COL, PARSED_VISIT_TIME_COL, concat_chunks, format_datetimes, normalize_outlet_ids
+)
+from map_layers import (
+    VERIFICATION_COLORS, add_clustered_layers, add_compact_layers, add_route_layers, add_verification_layer,
+    outlet_points,
+)
+from outlet_master import load_outlet_master, outlet_master_version, update_outlet_master
+from staypoints import STAY_MIN_MINUTES, STAY_RADIUS_M, selection_stays
+from viewport import parse_bbox, parse_zoom, viewport_points
+from verification import (
+    GEOFENCE_RADIUS_M, load_outlet_locations, outlet_locations_version, save_outlet_locations,
+    verification_summary, verify_visits,
+)
+from xlsx_reader import XlsxReader
+from batch_export import BATCH_EXPORT_WORKERS, export_zip, get_progress
+from jobs import JobQueue
 
 app = Flask(__name__)
 
-app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 50)) * 1024 * 1024  # Default to 50 MB
-
-# Global variable to store DataFrame and detected columns
-# This avoids re-reading the file on every request.
-# In a production app, you might use a more robust caching mechanism or database.
-global_data = None
-global_columns = {}
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENGTH', 1024)) * 1024 * 1024  # Default to 1 GB
+
+# CSV uploads are read in chunks of this many rows, so peak memory stays
+# bounded by one raw chunk plus the already compacted rows
+CSV_CHUNK_ROWS = int(os.getenv('CSV_CHUNK_ROWS', 200000))
+
+# .xlsx uploads are streamed with XlsxReader, reading only the detected
+# columns (in chunks of CSV_CHUNK_ROWS rows); set to 0 to use pd.read_excel
+XLSX_STREAMING = os.getenv('XLSX_STREAMING', '1') not in ('0', 'false', 'False')
+
+# Uploads keep only the detected columns in memory; list other headers here
+# (comma-separated) to keep them too
+EXTRA_COLUMNS = [col.strip() for col in os.getenv('EXTRA_COLUMNS', '').split(',') if col.strip()]
+
+# Print the memory of each upload before and after compaction (measuring the
+# raw rows walks every string, so it is off by default)
+MEMORY_REPORT = os.getenv('MEMORY_REPORT', '').lower() in ('1', 'true', 'yes')
+
+# Registry of indexed datasets (with their detected columns), keyed by dataset ID.
+# This avoids re-reading the file on every request, and lets each upload be
+# addressed independently by the dataset_id returned from /upload_data.
+dataset_registry = DatasetRegistry(DATASET_MEMORY_BUDGET_MB * 1024 * 1024)
+
+# Background uploads and map renders (see jobs.py), polled at /api/jobs/<job_id>
+job_queue = JobQueue()
+
+# Rendered map HTML keyed by (dataset ID, dataset version, filters), so that
+# showing and then downloading a map, or flipping between employees, only
+# renders each map once. Bounded by MAP_CACHE_MB of HTML text.
+MAP_CACHE_MB = int(os.getenv('MAP_CACHE_MB', 256))
+map_cache = SizedLRUCache(MAP_CACHE_MB * 1024 * 1024, sizeof=lambda entry: len(entry[0]))
+
+# How markers are drawn: 'markers' builds one Folium object per marker;
+# 'compact' ships the points as columnar arrays and builds the markers in the
+# browser, which keeps large maps small and fast; 'clustered' also clusters
+# on the server, so the browser only ever draws what is in view. 'auto' picks
+# by the number of rows in the selection (see AUTO_RENDER_MODES). Requests may
+# pick a mode with render_mode; this is the default.
+RENDER_MODES = ('auto', 'markers', 'compact', 'clustered')
+MAP_RENDER_MODE = os.getenv('MAP_RENDER_MODE', 'auto')
+# (mode, largest selection it is used for) in order; larger selections are clustered
+AUTO_RENDER_MODES = (('markers', 1000), ('compact', 50000))
+
+# Server-side clustering: clusters are precomputed up to this zoom, from
+# which individual markers are drawn while at most CLUSTER_MAX_MARKERS are in view
+CLUSTER_STREET_ZOOM = int(os.getenv('CLUSTER_STREET_ZOOM', 15))
+CLUSTER_MAX_MARKERS = int(os.getenv('CLUSTER_MAX_MARKERS', 2000))
+
+# Routes are drawn as one polyline per employee and day. When set, every day
+# also gets its own LayerControl entry, so busy maps can show a few days at a time.
+ROUTE_DAY_LAYERS = os.getenv('ROUTE_DAY_LAYERS', '').lower() in ('1', 'true', 'yes')
+
+# Drawn routes are simplified (Ramer-Douglas-Peucker) to this many metres;
+# 0 ships every vertex. Distances always use the full-resolution track.
+# ROUTE_ZOOM_LEVELS adds coarser levels of detail that switch with the map zoom.
+ROUTE_SIMPLIFY_M = float(os.getenv('ROUTE_SIMPLIFY_M', 5))
+ROUTE_ZOOM_LEVELS = os.getenv('ROUTE_ZOOM_LEVELS', '').lower() in ('1', 'true', 'yes')
 
 # HTML template for the Flask application
 # This includes Tailwind CSS for styling and JavaScript for interactivity
@@ -30,6 +110,7 @@ HTML_TEMPLATE = """
     <title>Employee Route Map</title>
     <script src="https://cdn.tailwindcss.com"></script>
     <link rel="stylesheet" href="https://unpkg.com/leaflet@1.7.1/dist/leaflet.css" />
+    <script src="https://unpkg.com/leaflet@1.7.1/dist/leaflet.js"></script>
     <link rel="stylesheet" href="https://maxcdn.bootstrapcdn.com/font-awesome/4.7.0/css/font-awesome.min.css">
     <style>
         @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
@@ -257,6 +338,17 @@ HTML_TEMPLATE = """
                 <i class="fa fa-upload"></i> Upload File
                 <div id="loadingSpinnerUpload" class="loading-spinner ml-3"></div>
             </button>
+            <label class="inline-flex items-center text-gray-700 col-span-3 -mt-4">
+                <input type="checkbox" id="appendUploadToggle" class="mr-2">
+                Append to the current data (e.g. a new daily export) instead of replacing it
+            </label>
+            <div class="flex flex-col col-span-2">
+                <label for="outletLocationsUpload" class="text-gray-700 font-semibold mb-3 text-l">Outlet Locations (optional, for visit verification):</label>
+                <input type="file" id="outletLocationsUpload" accept=".csv, .xls, .xlsx" class="input-field file:mr-4 file:py-2 file:px-4 file:rounded-lg file:border-0 file:text-base file:font-semibold file:bg-blue-100 file:text-blue-700 hover:file:bg-blue-200 file:cursor-pointer">
+            </div>
+            <button id="uploadOutletLocationsBtn" class="btn-base btn-green btn-small md:col-span-1">
+                <i class="fa fa-map-pin"></i> Upload Outlet Locations
+            </button>
         </div>
 
         <hr class="my-6 border-gray-200">
@@ -280,6 +372,23 @@ HTML_TEMPLATE = """
                         <option value="">All Employees</option>
                     </select>
                 </div>
+                <div class="flex flex-col md:col-span-2 mb-6"> <label for="renderModeFilter" class="text-gray-700 font-semibold mb-3 text-l">Map Rendering:</label>
+                    <select id="renderModeFilter" class="input-field" disabled>
+                        <option value="">Automatic</option>
+                        <option value="markers">Detailed markers</option>
+                        <option value="compact">Compact (faster for large files)</option>
+                        <option value="clustered">Server-clustered (500k+ rows)</option>
+                        <option value="live">Live viewport (largest files)</option>
+                    </select>
+                    <label class="inline-flex items-center mt-3 text-gray-700">
+                        <input type="checkbox" id="routeDayLayersToggle" class="mr-2" disabled>
+                        Separate route layer per day
+                    </label>
+                    <label class="inline-flex items-center mt-3 text-gray-700">
+                        <input type="checkbox" id="verificationToggle" class="mr-2" disabled>
+                        Show visit verification (geofence)
+                    </label>
+                </div>
                 <div class="flex justify-center gap-4">
                     <button id="loadMapBtn" class="btn-base btn-blue btn-small">
                         <i class="fa fa-refresh"></i> Load Map
@@ -288,9 +397,18 @@ HTML_TEMPLATE = """
                     <button id="downloadMapBtn" class="btn-base btn-purple btn-small" disabled>
                         <i class="fa fa-download"></i> Download Map
                     </button>
+                    <button id="batchExportBtn" class="btn-base btn-purple btn-small" disabled>
+                        <i class="fa fa-file-archive-o"></i> Download All Maps (ZIP)
+                    </button>
+                    <button id="verificationReportBtn" class="btn-base btn-purple btn-small" disabled>
+                        <i class="fa fa-check-circle"></i> Verification Report
+                    </button>
                     <button id="resetFiltersBtn" class="btn-base btn-red btn-small" disabled>
                         <i class="fa fa-undo"></i> Reset Filters
                     </button>
+                    <button id="cancelJobBtn" class="btn-base btn-red btn-small hidden">
+                        <i class="fa fa-stop"></i> Cancel
+                    </button>
                 </div>
 
         <div id="mapContainer" class="map-container">
@@ -350,17 +468,29 @@ HTML_TEMPLATE = """
     <script>
         const fileUpload = document.getElementById('fileUpload');
         const uploadFileBtn = document.getElementById('uploadFileBtn');
+        const appendUploadToggle = document.getElementById('appendUploadToggle');
         const startDateFilter = document.getElementById('startDateFilter');
         const endDateFilter = document.getElementById('endDateFilter');
         const employeeFilter = document.getElementById('employeeFilter');
+        const renderModeFilter = document.getElementById('renderModeFilter');
+        const routeDayLayersToggle = document.getElementById('routeDayLayersToggle');
+        const verificationToggle = document.getElementById('verificationToggle');
+        const verificationReportBtn = document.getElementById('verificationReportBtn');
+        const batchExportBtn = document.getElementById('batchExportBtn');
+        const outletLocationsUpload = document.getElementById('outletLocationsUpload');
+        const uploadOutletLocationsBtn = document.getElementById('uploadOutletLocationsBtn');
         const loadMapBtn = document.getElementById('loadMapBtn');
         const downloadMapBtn = document.getElementById('downloadMapBtn'); // New button
         const resetFiltersBtn = document.getElementById('resetFiltersBtn');
+        const cancelJobBtn = document.getElementById('cancelJobBtn');
         const mapContainer = document.getElementById('mapContainer');
         const loadingSpinnerUpload = document.getElementById('loadingSpinnerUpload');
         const loadingSpinnerMap = document.getElementById('loadingSpinnerMap');
         const messageBox = document.getElementById('messageBox');
 
+        // ID of the uploaded dataset, sent with every data request
+        let currentDatasetId = null;
+
         // Initial state: empty dates
         startDateFilter.value = '';
         endDateFilter.value = '';
@@ -393,41 +523,102 @@ HTML_TEMPLATE = """
             startDateFilter.disabled = !enabled;
             endDateFilter.disabled = !enabled;
             employeeFilter.disabled = !enabled;
+            renderModeFilter.disabled = !enabled;
+            routeDayLayersToggle.disabled = !enabled;
+            verificationToggle.disabled = !enabled;
+            verificationReportBtn.disabled = !enabled;
+            batchExportBtn.disabled = !enabled;
             loadMapBtn.disabled = !enabled;
             downloadMapBtn.disabled = !enabled; // Enable/disable download button
             resetFiltersBtn.disabled = !enabled;
         }
 
-        // Function to populate date dropdowns
+        // Function to populate date dropdowns (only the selected employee's dates, if any)
         async function populateDateDropdowns() {
             try {
-                const response = await fetch('/get_unique_dates');
+                const params = new URLSearchParams({ dataset_id: currentDatasetId });
+                if (employeeFilter.value) {
+                    params.set('employee_name', employeeFilter.value);
+                }
+                const response = await fetch('/get_unique_dates?' + params.toString());
                 if (!response.ok) {
                     const errorData = await response.json();
                     throw new Error(errorData.error || 'Failed to fetch unique dates.');
                 }
                 const dates = await response.json();
 
+                // Keep the selected dates if they are still offered
+                const selectedStart = startDateFilter.value;
+                const selectedEnd = endDateFilter.value;
                 startDateFilter.innerHTML = '<option value="">All Dates</option>';
                 endDateFilter.innerHTML = '<option value="">All Dates</option>';
 
                 dates.forEach(date => {
+                    const title = `${date.rows} rows, ${date.employees} employee(s)`;
                     const startOption = document.createElement('option');
                     startOption.value = date.value; // YYYY-MM-DD for backend
                     startOption.textContent = date.text; // DD-MM-YYYY for display
+                    startOption.title = title;
                     startDateFilter.appendChild(startOption);
 
                     const endOption = document.createElement('option');
                     endOption.value = date.value; // YYYY-MM-DD for backend
                     endOption.textContent = date.text; // DD-MM-YYYY for display
+                    endOption.title = title;
                     endDateFilter.appendChild(endOption);
                 });
+                const offered = new Set(dates.map(date => date.value));
+                startDateFilter.value = offered.has(selectedStart) ? selectedStart : '';
+                endDateFilter.value = offered.has(selectedEnd) ? selectedEnd : '';
             } catch (error) {
                 console.error('Error populating date dropdowns:', error);
                 showMessage(`Error loading dates: ${error.message}`, true);
             }
         }
 
+        // --- Background Jobs ---
+        // Uploads and map renders run as server jobs; poll one until it finishes,
+        // passing its progress to onProgress. The Cancel button stops the job.
+        let currentJobId = null;
+
+        function sleep(ms) {
+            return new Promise(resolve => setTimeout(resolve, ms));
+        }
+
+        async function waitForJob(jobId, onProgress) {
+            currentJobId = jobId;
+            cancelJobBtn.classList.remove('hidden');
+            try {
+                while (true) {
+                    const response = await fetch(`/api/jobs/${jobId}`);
+                    const job = await response.json();
+                    if (!response.ok) {
+                        throw new Error(job.error || 'Failed to check job status.');
+                    }
+                    if (job.status === 'done') {
+                        return job.result;
+                    }
+                    if (job.status === 'failed') {
+                        throw new Error(job.error || 'The job failed.');
+                    }
+                    if (job.status === 'cancelled') {
+                        throw new Error('Cancelled.');
+                    }
+                    onProgress(job.progress || {});
+                    await sleep(500);
+                }
+            } finally {
+                currentJobId = null;
+                cancelJobBtn.classList.add('hidden');
+            }
+        }
+
+        cancelJobBtn.addEventListener('click', async () => {
+            if (currentJobId) {
+                await fetch(`/api/jobs/${currentJobId}/cancel`, { method: 'POST' });
+            }
+        });
+
         // --- File Upload Logic ---
         uploadFileBtn.addEventListener('click', async () => {
             hideMessage();
@@ -444,6 +635,11 @@ HTML_TEMPLATE = """
 
             const formData = new FormData();
             formData.append('file', file);
+            formData.append('background', '1');
+            if (appendUploadToggle.checked && currentDatasetId) {
+                formData.append('mode', 'append');
+                formData.append('dataset_id', currentDatasetId);
+            }
 
             try {
                 const response = await fetch('/upload_data', {
@@ -456,17 +652,27 @@ HTML_TEMPLATE = """
                     throw new Error(errorData.error || 'Failed to upload and process file.');
                 }
 
-                const data = await response.json();
+                let data = await response.json();
+                if (response.status === 202) {
+                    data = await waitForJob(data.job_id, progress => {
+                        const rows = progress.rows ? ` (${progress.rows.toLocaleString()} rows read)` : '';
+                        mapContainer.innerHTML = `<p class="text-center text-gray-500 text-xl font-medium mt-20">Processing data: ${progress.stage || 'queued'}${rows}...</p>`;
+                    });
+                }
+                currentDatasetId = data.dataset_id;
                 showMessage(data.message || "File uploaded successfully!");
                 setFilterControlsEnabled(true);
 
                 // Populate employee dropdown
                 employeeFilter.innerHTML = '<option value="">All Employees</option>'; // Clear existing options
                 if (data.employees) {
-                    data.employees.forEach(emp => {
+                    data.employees.forEach((emp, i) => {
                         const option = document.createElement('option');
                         option.value = emp;
                         option.textContent = emp;
+                        if (data.employee_rows) {
+                            option.title = `${data.employee_rows[i]} rows`;
+                        }
                         employeeFilter.appendChild(option);
                     });
                 }
@@ -496,6 +702,22 @@ HTML_TEMPLATE = """
             const selectedEndDate = endDateFilter.value;     // This will be YYYY-MM-DD
             const selectedEmployee = employeeFilter.value;
 
+            if (renderModeFilter.value === 'live') {
+                try {
+                    await loadLiveMap(selectedStartDate, selectedEndDate, selectedEmployee);
+                } catch (error) {
+                    console.error('Error loading map:', error);
+                    mapContainer.innerHTML = `<p class="text-center text-red-500 text-xl font-medium mt-20">Error: ${error.message}</p>`;
+                    showMessage(`Error: ${error.message}`, true);
+                } finally {
+                    loadingSpinnerMap.style.display = 'none';
+                    loadMapBtn.disabled = false;
+                    downloadMapBtn.disabled = false;
+                    resetFiltersBtn.disabled = false;
+                }
+                return;
+            }
+
             try {
                 const response = await fetch('/get_map', {
                     method: 'POST',
@@ -503,9 +725,14 @@ HTML_TEMPLATE = """
                         'Content-Type': 'application/json',
                     },
                     body: JSON.stringify({
+                        dataset_id: currentDatasetId,
                         start_date: selectedStartDate,
                         end_date: selectedEndDate,
-                        employee_name: selectedEmployee
+                        employee_name: selectedEmployee,
+                        render_mode: renderModeFilter.value === 'live' ? '' : renderModeFilter.value,
+                        route_day_layers: routeDayLayersToggle.checked,
+                        verification: verificationToggle.checked,
+                        background: true
                     }),
                 });
 
@@ -514,7 +741,14 @@ HTML_TEMPLATE = """
                     throw new Error(errorData.error || 'Failed to load map data.');
                 }
 
-                const data = await response.json();
+                let data = await response.json();
+                if (response.status === 202) {
+                    data = await waitForJob(data.job_id, progress => {
+                        const step = progress.step ? `step ${progress.step} of ${progress.steps}: ${progress.stage}` : 'queued';
+                        const employees = progress.employees ? `, ${progress.employees} employee(s)` : '';
+                        mapContainer.innerHTML = `<p class="text-center text-gray-500 text-xl font-medium mt-20">Rendering map (${step}${employees})...</p>`;
+                    });
+                }
 
                 if (data.map_html) {
                     mapContainer.innerHTML = data.map_html;
@@ -539,6 +773,95 @@ HTML_TEMPLATE = """
             }
         }
 
+        // --- Live Viewport Map ---
+        // A plain Leaflet map that only fetches the points in view from /api/points,
+        // clustered by the server when zoomed out, and refetches as the user pans.
+        let liveMap = null;
+        let liveRequest = 0;
+
+        function escapeHtml(value) {
+            return value === null || value === undefined ? 'N/A' : String(value).replace(/[&<>"']/g, c => '&#' + c.charCodeAt(0) + ';');
+        }
+
+        function formatEpoch(t) {
+            if (t === null) { return 'N/A'; }
+            const pad = n => String(n).padStart(2, '0');
+            const d = new Date(t * 1000);
+            return `${pad(d.getUTCDate())}-${pad(d.getUTCMonth() + 1)}-${d.getUTCFullYear()} ${pad(d.getUTCHours())}:${pad(d.getUTCMinutes())}:${pad(d.getUTCSeconds())}`;
+        }
+
+        async function fetchViewport(filters, bbox, zoom) {
+            const params = new URLSearchParams({ ...filters, zoom: zoom });
+            if (bbox) { params.set('bbox', bbox); }
+            const response = await fetch('/api/points?' + params.toString());
+            const data = await response.json();
+            if (!response.ok) {
+                throw new Error(data.error || 'Failed to load points.');
+            }
+            return data;
+        }
+
+        function drawViewport(layer, data) {
+            layer.clearLayers();
+            if (data.clustered) {
+                const c = data.clusters;
+                c.count.forEach((count, i) => {
+                    const size = count < 10 ? 30 : count < 1000 ? 40 : 50;
+                    L.marker([c.lat[i], c.lon[i]], {
+                        icon: L.divIcon({
+                            html: `<div style="background:rgba(49,130,206,0.8);color:#fff;border-radius:50%;width:${size}px;height:${size}px;line-height:${size}px;text-align:center;font-weight:bold;">${count}</div>`,
+                            className: '', iconSize: [size, size]
+                        })
+                    }).bindTooltip(`Punch In: ${c.punch[i]} | Visits: ${c.visit[i]}`)
+                      .on('click', e => liveMap.setView(e.latlng, liveMap.getZoom() + 2))
+                      .addTo(layer);
+                });
+                return;
+            }
+            const p = data.points, names = p.employees;
+            p.punch.lat.forEach((lat, i) => {
+                L.circleMarker([lat, p.punch.lon[i]], { radius: 6, color: 'blue', fillOpacity: 0.7 })
+                    .bindPopup(() => `<strong>Employee:</strong> ${escapeHtml(names[p.punch.emp[i]])}<br><strong>Punch In Time:</strong> ⏰ ${formatEpoch(p.punch.t[i])}<br><strong>Latitude:</strong> ${lat.toFixed(4)}<br><strong>Longitude:</strong> ${p.punch.lon[i].toFixed(4)}`)
+                    .addTo(layer);
+            });
+            p.visit.lat.forEach((lat, i) => {
+                const outlet = p.outlets[p.visit.outlet[i]], outletId = p.outlet_ids[p.visit.outlet_id[i]];
+                L.circleMarker([lat, p.visit.lon[i]], { radius: 6, color: 'green', fillOpacity: 0.7 })
+                    .bindPopup(() => `<strong>Employee:</strong> ${escapeHtml(names[p.visit.emp[i]])}<br><strong>Outlet:</strong> ${escapeHtml(outlet)} (ID: ${escapeHtml(outletId)})<br><strong>Visit Time:</strong> ⏱️ ${formatEpoch(p.visit.t[i])}<br><strong>Latitude:</strong> ${lat.toFixed(4)}<br><strong>Longitude:</strong> ${p.visit.lon[i].toFixed(4)}`)
+                    .addTo(layer);
+            });
+        }
+
+        async function loadLiveMap(startDate, endDate, employee) {
+            const filters = { dataset_id: currentDatasetId || '', start_date: startDate, end_date: endDate, employee_name: employee };
+            const initial = await fetchViewport(filters, null, 5);
+            if (!initial.bounds) {
+                mapContainer.innerHTML = '<p class="text-center text-gray-500 text-xl font-medium mt-20">No data found for the selected filters.</p>';
+                return;
+            }
+
+            if (liveMap) { liveMap.remove(); }
+            mapContainer.innerHTML = '<div id="liveMap" style="width:100%;height:100%;"></div>';
+            liveMap = L.map('liveMap');
+            L.tileLayer('https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}{r}.png', {
+                attribution: '&copy; OpenStreetMap contributors &copy; CARTO', maxZoom: 20
+            }).addTo(liveMap);
+            const layer = L.layerGroup().addTo(liveMap);
+
+            liveMap.on('moveend', async () => {
+                // Only the newest request may draw, so fast panning never shows stale points
+                const request = ++liveRequest;
+                try {
+                    const data = await fetchViewport(filters, liveMap.getBounds().toBBoxString(), liveMap.getZoom());
+                    if (request === liveRequest) { drawViewport(layer, data); }
+                } catch (error) {
+                    showMessage(`Error: ${error.message}`, true);
+                }
+            });
+            liveMap.fitBounds(initial.bounds);
+            showMessage("Map loaded successfully!");
+        }
+
         // --- Download Map Logic ---
         downloadMapBtn.addEventListener('click', async () => {
             hideMessage();
@@ -554,9 +877,13 @@ HTML_TEMPLATE = """
                         'Content-Type': 'application/json',
                     },
                     body: JSON.stringify({
+                        dataset_id: currentDatasetId,
                         start_date: selectedStartDate,
                         end_date: selectedEndDate,
-                        employee_name: selectedEmployee
+                        employee_name: selectedEmployee,
+                        render_mode: renderModeFilter.value === 'live' ? '' : renderModeFilter.value,
+                        route_day_layers: routeDayLayersToggle.checked,
+                        verification: verificationToggle.checked
                     }),
                 });
 
@@ -582,15 +909,109 @@ HTML_TEMPLATE = """
         });
 
 
+        // --- Visit Verification Logic ---
+        uploadOutletLocationsBtn.addEventListener('click', async () => {
+            hideMessage();
+            const file = outletLocationsUpload.files[0];
+            if (!file) {
+                showMessage("Please select an outlet locations file first.", true);
+                return;
+            }
+            const formData = new FormData();
+            formData.append('file', file);
+            uploadOutletLocationsBtn.disabled = true;
+            try {
+                const response = await fetch('/upload_outlet_locations', { method: 'POST', body: formData });
+                const data = await response.json();
+                if (!response.ok) {
+                    throw new Error(data.error || 'Failed to upload outlet locations.');
+                }
+                showMessage(data.message);
+            } catch (error) {
+                console.error('Error uploading outlet locations:', error);
+                showMessage(`Error: ${error.message}`, true);
+            } finally {
+                uploadOutletLocationsBtn.disabled = false;
+            }
+        });
+
+        verificationReportBtn.addEventListener('click', () => {
+            const params = new URLSearchParams({
+                dataset_id: currentDatasetId,
+                start_date: startDateFilter.value,
+                end_date: endDateFilter.value,
+                employee_name: employeeFilter.value,
+                format: 'csv'
+            });
+            window.location.href = '/api/visit_verification?' + params.toString();
+        });
+
+        // --- Batch Export Logic ---
+        // One map per employee and day for the current date range (and employee, if selected)
+        batchExportBtn.addEventListener('click', async () => {
+            hideMessage();
+            batchExportBtn.disabled = true;
+            const exportId = Date.now().toString(36) + Math.random().toString(36).slice(2);
+            const params = new URLSearchParams({
+                dataset_id: currentDatasetId,
+                start_date: startDateFilter.value,
+                end_date: endDateFilter.value,
+                render_mode: renderModeFilter.value === 'live' ? '' : renderModeFilter.value,
+                route_day_layers: routeDayLayersToggle.checked,
+                verification: verificationToggle.checked,
+                export_id: exportId
+            });
+            if (employeeFilter.value) {
+                params.set('employee_name', employeeFilter.value);
+            }
+
+            showMessage('Exporting maps...', false, true);
+            const poll = setInterval(async () => {
+                const response = await fetch('/api/batch_maps/progress?export_id=' + exportId);
+                if (response.ok) {
+                    const progress = await response.json();
+                    if (!progress.finished) {
+                        showMessage(`Exporting maps: ${progress.done} of ${progress.total}...`, false, true);
+                    }
+                }
+            }, 1000);
+
+            try {
+                const response = await fetch('/api/batch_maps?' + params.toString());
+                if (!response.ok) {
+                    const errorData = await response.json();
+                    throw new Error(errorData.error || 'Failed to export maps.');
+                }
+                const blob = await response.blob();
+                const url = window.URL.createObjectURL(blob);
+                const a = document.createElement('a');
+                a.href = url;
+                a.download = 'employee_route_maps.zip';
+                document.body.appendChild(a);
+                a.click();
+                a.remove();
+                window.URL.revokeObjectURL(url);
+                showMessage('Maps exported successfully!');
+            } catch (error) {
+                console.error('Error exporting maps:', error);
+                showMessage(`Error exporting maps: ${error.message}`, true);
+            } finally {
+                clearInterval(poll);
+                batchExportBtn.disabled = false;
+            }
+        });
+
         // --- Reset Filters Logic ---
         resetFiltersBtn.addEventListener('click', () => {
             startDateFilter.value = '';
             endDateFilter.value = '';
             employeeFilter.value = '';
+            populateDateDropdowns(); // All employees' dates again
             loadMap(); // Reload map with all filters cleared
         });
 
         loadMapBtn.addEventListener('click', loadMap);
+        employeeFilter.addEventListener('change', populateDateDropdowns);
 
         // Initial state: disable filters until file is uploaded
         setFilterControlsEnabled(false);
@@ -599,162 +1020,500 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# Candidate formats for date, time-of-day and combined date+time values, in
+# order of preference (day-first, as in our field exports). The first format
+# that parses a sample of the column is used for the whole column.
+DATE_FORMATS = [
+    '%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y', '%d-%m-%y', '%d/%m/%y',
+    '%Y-%m-%d', '%Y/%m/%d', '%d-%b-%Y', '%d %b %Y', '%Y-%m-%d %H:%M:%S',
+]
+TIME_FORMATS = ['%H:%M:%S', '%H:%M', '%I:%M:%S %p', '%I:%M %p', '%H:%M:%S.%f']
+DATETIME_FORMATS = [
+    f"{date_fmt} {time_fmt}"
+    for date_fmt in DATE_FORMATS[:-1]
+    for time_fmt in ['%H:%M:%S', '%H:%M', '%I:%M:%S %p', '%I:%M %p']
+] + DATE_FORMATS
+
+FORMAT_SAMPLE_SIZE = 200
+
+def detect_datetime_format(values, formats):
+    """Return the first format that parses the most of a sample of values, or None."""
+    sample = values[:FORMAT_SAMPLE_SIZE]
+    best_format, best_hits = None, 0
+    for fmt in formats:
+        hits = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if hits > best_hits:
+            best_format, best_hits = fmt, hits
+            if hits == len(sample):
+                break
+    return best_format
+
+def to_datetime_series(series, formats, infer=True):
+    """
+    Parse a column to datetime64[ns] with a format detected once from a sample.
+    Each distinct value is parsed only once, which matters for dates (a few dozen
+    distinct values per month) and times (at most 86,400). With infer=True,
+    values that do not match the detected format fall back to day-first inference.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return pd.Series(series.to_numpy().astype('datetime64[ns]'), index=series.index)
+
+    codes, uniques = pd.factorize(series)
+    uniques = pd.Index(uniques).astype(str).str.strip()
+    fmt = detect_datetime_format(uniques, formats)
+    if fmt:
+        parsed = pd.to_datetime(uniques, format=fmt, errors='coerce')
+    else:
+        parsed = pd.DatetimeIndex([pd.NaT] * len(uniques))
+    missed = parsed.isna() & (uniques != '')
+    if infer and missed.any():
+        parsed = parsed.where(~missed, pd.to_datetime(uniques.where(missed, ''), dayfirst=True, format='mixed', errors='coerce'))
+
+    values = parsed.to_numpy().astype('datetime64[ns]').take(codes)
+    values[codes < 0] = np.datetime64('NaT')
+    return pd.Series(values, index=series.index)
+
 # Helper functions (from your original script)
-def parse_datetime_columns(data, time_col, date_col=None):
+def parse_datetime_columns(data, time_col, date_col=None, parsed_col=None):
+    """
+    Normalize time_col (optionally combined with a separate date_col) to
+    'DD-MM-YYYY HH:MM:SS' display strings. When parsed_col is given, the
+    native datetime64 values are also kept in that column so consumers do
+    not have to parse the display strings again.
+    """
     try:
-        data[time_col] = data[time_col].astype(str) # Convert to string first
-        
         if date_col and date_col in data.columns:
-            data[date_col] = data[date_col].astype(str) # Ensure date column is string
-
             # Attempt to parse date_col assuming DD-MM-YYYY or MM-DD-YYYY, preferring DD-MM-YYYY
-            parsed_date = pd.to_datetime(data[date_col], dayfirst=True, infer_datetime_format=True, errors='coerce')
-            data[date_col] = parsed_date.dt.strftime('%d-%m-%Y').fillna('')
-
-            combined_datetime_series = data.apply(lambda row: f"{row[date_col]} {row[time_col]}" if row[date_col] else row[time_col], axis=1)
-            
-            # Parse the combined string, again preferring dayfirst
-            parsed_dt = pd.to_datetime(combined_datetime_series, dayfirst=True, infer_datetime_format=True, errors='coerce')
-            data[time_col] = parsed_dt.dt.strftime('%d-%m-%Y %H:%M:%S').fillna("Invalid Time")
+            parsed_date = to_datetime_series(data[date_col], DATE_FORMATS).dt.normalize()
+            data[date_col] = format_datetimes(parsed_date, with_time=False)
+
+            # Combine the date with the time of day from time_col; rows without
+            # a date fall back to time_col on its own if it holds a full datetime
+            parsed_clock = to_datetime_series(data[time_col], TIME_FORMATS)
+            parsed_dt = parsed_date + (parsed_clock - parsed_clock.dt.normalize())
+            no_date = parsed_date.isna()
+            if no_date.any():
+                parsed_dt[no_date] = to_datetime_series(data.loc[no_date, time_col], DATETIME_FORMATS, infer=False)
         else:
             # If no separate date_col, assume time_col contains full datetime.
             # Parse it preferring DD-MM-YYYY.
-            parsed_dt = pd.to_datetime(data[time_col], dayfirst=True, infer_datetime_format=True, errors='coerce')
-            data[time_col] = parsed_dt.dt.strftime('%d-%m-%Y %H:%M:%S').fillna("Invalid Time")
+            parsed_dt = to_datetime_series(data[time_col], DATETIME_FORMATS)
+
+        data[time_col] = format_datetimes(parsed_dt, missing="Invalid Time")
+        if parsed_col:
+            data[parsed_col] = parsed_dt
     except Exception as e:
         print(f"Error parsing time column '{time_col}' (and optional date column '{date_col}'): {e}")
     return data
 
 def find_column(data, keywords):
-    """Find a column in the DataFrame based on a list of keywords."""
-    for col in data.columns:
-        if any(keyword.lower() in col.lower() for keyword in keywords):
-            return col
+    """
+    Find a column in the DataFrame based on a list of keywords. Keywords are
+    tried in order, so a specific keyword (e.g. "visit lat") wins over a
+    generic one (e.g. "lat") that also matches an earlier column.
+    """
+    for keyword in keywords:
+        for col in data.columns:
+            if keyword.lower() in col.lower():
+                return col
     return None
 
-def haversine_distance(lat1, lon1, lat2, lon2):
+@app.route('/')
+def index():
+    return render_template_string(HTML_TEMPLATE)
+
+def read_data_file(file, filename):
+    """Read a CSV or Excel file (path or file object) into a DataFrame. Returns None for other file types."""
+    # Determine file type and read accordingly
+    if filename.endswith('.csv'):
+        return pd.read_csv(file)
+    elif filename.endswith(('.xls', '.xlsx')):
+        return pd.read_excel(file)
+    return None
+
+# Columns that must be detected for the data to be usable
+MANDATORY_COLUMN_KEYS = [
+    'punch_lat_col', 'punch_lon_col', 'visit_lat_col', 'visit_lon_col', 
+    'punch_in_time_col', 'name_col', 'outlet_name_col', 'outlet_id_col'
+]
+
+def detect_columns(data):
+    """Map each column role (e.g. 'punch_lat_col') to the matching column header, or None."""
+    columns = {}
+    columns['punch_lat_col'] = find_column(data, ["punch in lat", "latitude", "lat"])
+    columns['punch_lon_col'] = find_column(data, ["punch in long", "longitude", "lon"])
+    columns['visit_lat_col'] = find_column(data, ["visit lat", "latitude", "lat"])
+    columns['visit_lon_col'] = find_column(data, ["visit long", "longitude", "lon"])
+    columns['punch_in_time_col'] = find_column(data, ["punch in time", "time", "punch_time"])
+    columns['visit_time_col'] = find_column(data, ["visit time", "time of visit", "visit_time"])
+    columns['punch_in_date_col'] = find_column(data, ["punch in date", "date", "punch_date"])
+    columns['visit_date_col'] = find_column(data, ["visit date", "date", "visit_date"])
+    columns['name_col'] = find_column(data, ["employee name", "name"])
+    columns['outlet_name_col'] = find_column(data, ["outlet name"])
+    columns['outlet_id_col'] = find_column(data, ["outlet id"])
+    return columns
+
+def check_columns(data, columns):
+    """Return an error message if a mandatory column was not detected, else None."""
+    # Check if all mandatory columns are found
+    missing_cols = [k for k in MANDATORY_COLUMN_KEYS if columns.get(k) is None]
+    
+    if missing_cols:
+        return f"Missing required columns: {', '.join(missing_cols)}. Please check your file headers. Detected: {data.columns.tolist()}"
+    return None
+
+# Column roles whose file columns are kept after ingest. The time and date
+# columns are read for parsing only: their values live on in the parsed
+# datetime columns.
+STORED_COLUMN_KEYS = [
+    'name_col', 'punch_lat_col', 'punch_lon_col', 'visit_lat_col', 'visit_lon_col',
+    'outlet_name_col', 'outlet_id_col'
+]
+
+def read_columns(columns, header):
+    """The file columns to read: the detected ones plus the EXTRA_COLUMNS present, in file order."""
+    wanted = set(col for col in columns.values() if col) | set(EXTRA_COLUMNS)
+    missing = [col for col in EXTRA_COLUMNS if col not in header]
+    if missing:
+        print(f"Warning: EXTRA_COLUMNS not found in the file: {', '.join(missing)}")
+    return [col for col in header if col in wanted]
+
+def compact_columns(data, columns):
     """
-    Calculate the distance between two points on Earth using the Haversine formula.
-    Returns distance in kilometers.
+    Reduce (a chunk of) parsed rows to their stored form: the STORED_COLUMN_KEYS
+    columns and the EXTRA_COLUMNS, in that order, then the parsed datetimes.
+    Coordinates become float32, names, outlet IDs and text extras
+    categoricals, and the parsed datetimes whole epoch seconds
+    (datetime64[s]).
     """
-    R = 6371 # Radius of Earth in kilometers
-    lat1_rad = math.radians(lat1)
-    lon1_rad = math.radians(lon1)
-    lat2_rad = math.radians(lat2)
-    lon2_rad = math.radians(lon2)
+    kept = [columns[key] for key in STORED_COLUMN_KEYS if columns.get(key)] + EXTRA_COLUMNS
+    if PARSED_TIME_COL not in data.columns:
+        # Parsing failed: Dataset falls back to the display strings
+        kept.append(columns['punch_in_time_col'])
+    kept = [col for col in dict.fromkeys(kept) if col in data.columns]
+    kept += [col for col in (PARSED_TIME_COL, PARSED_VISIT_TIME_COL) if col in data.columns]
+    data = data[kept].copy()
+
+    for key in ['punch_lat_col', 'punch_lon_col', 'visit_lat_col', 'visit_lon_col']:
+        col = columns.get(key)
+        if col in data.columns and data[col].dtype != np.float32:
+            data[col] = pd.to_numeric(data[col], errors='coerce').astype(np.float32)
+    # Outlet IDs are stored as text in one form, whether read as numbers or not
+    id_col = columns.get('outlet_id_col')
+    if id_col in data.columns:
+        data[id_col] = normalize_outlet_ids(data[id_col])
+    for col in data.columns:
+        if data[col].dtype == object:
+            data[col] = data[col].astype('category')
+    for col in (PARSED_TIME_COL, PARSED_VISIT_TIME_COL):
+        if col in data.columns:
+            data[col] = data[col].astype('datetime64[s]')
+    return data
 
-    dlon = lon2_rad - lon1_rad
-    dlat = lat2_rad - lat1_rad
+def frame_bytes(data):
+    """Memory held by a DataFrame, strings included."""
+    return int(data.memory_usage(index=False, deep=True).sum())
 
-    a = math.sin(dlat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+def prepare_rows(data, columns, usage=None):
+    """
+    Parse the datetime columns of (a chunk of) the file and compact it for
+    storage. usage, if given, accumulates the memory of the rows before
+    ('raw') and after ('compact') compaction.
+    """
+    if usage is not None:
+        usage['raw'] += frame_bytes(data)
 
-    distance = R * c
-    return distance
+    # Parse time columns
+    data = parse_datetime_columns(data, columns['punch_in_time_col'], columns['punch_in_date_col'], PARSED_TIME_COL)
+    if columns['visit_time_col'] and columns['visit_time_col'] in data.columns:
+        data = parse_datetime_columns(data, columns['visit_time_col'], columns['visit_date_col'], PARSED_VISIT_TIME_COL)
 
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
+    data = compact_columns(data, columns)
+    if usage is not None:
+        usage['compact'] += frame_bytes(data)
+    return data
+
+def memory_usage_tracker():
+    """A usage dict for prepare_rows when MEMORY_REPORT is on, else None."""
+    return {'raw': 0, 'compact': 0} if MEMORY_REPORT else None
+
+def report_memory(usage, dataset):
+    """Print the memory of an upload's rows before and after compaction, and of the indexed dataset."""
+    if usage is None:
+        return
+    mb = 1024 * 1024
+    print(f"Memory for {len(dataset)} rows: {usage['raw'] / mb:.1f} MB as read, "
+          f"{usage['compact'] / mb:.1f} MB compacted ({usage['raw'] / max(usage['compact'], 1):.1f}x smaller), "
+          f"{dataset.nbytes / mb:.1f} MB indexed")
+
+def build_dataset(data):
+    """
+    Detect columns, parse the datetime columns and index the rows of a freshly read file.
+    Returns (dataset, error_message).
+    """
+    # Convert all column names to string type
+    data.columns = data.columns.astype(str)
+
+    columns = detect_columns(data)
+    error_message = check_columns(data, columns)
+    if error_message:
+        return None, error_message
+
+    usage = memory_usage_tracker()
+    data = prepare_rows(data, columns, usage)
+
+    # Sort and index once; filters on later requests are binary searches
+    dataset = Dataset(data, columns)
+    report_memory(usage, dataset)
+    return dataset, None
+
+def build_dataset_from_csv(file, chunk_rows=None, progress=None):
+    """
+    Streaming variant of build_dataset for CSV files. Columns are detected from
+    the header and only the detected ones (see read_columns) are read, parsed
+    and compacted chunk by chunk, so only one raw chunk is ever held in
+    memory. progress, if given, is called with the number of rows parsed
+    after each chunk. Returns (dataset, error_message).
+    """
+    # Column detection only looks at the header
+    header = pd.read_csv(file, nrows=0)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    columns = detect_columns(header)
+    error_message = check_columns(header, columns)
+    if error_message:
+        return None, error_message
+
+    usage = memory_usage_tracker()
+    chunks = []
+    rows = 0
+    for chunk in pd.read_csv(file, chunksize=chunk_rows or CSV_CHUNK_ROWS, usecols=read_columns(columns, header.columns)):
+        chunks.append(prepare_rows(chunk, columns, usage))
+        rows += len(chunk)
+        if progress:
+            progress(stage='parsing', rows=rows)
+
+    if not chunks:
+        return None, 'The uploaded file has no data rows.'
+    if progress:
+        progress(stage='indexing')
+
+    # Sort and index once; filters on later requests are binary searches
+    dataset = Dataset(concat_chunks(chunks), columns)
+    report_memory(usage, dataset)
+    return dataset, None
+
+def build_dataset_from_xlsx(file, chunk_rows=None, progress=None):
+    """
+    Streaming variant of build_dataset for .xlsx files (see XlsxReader).
+    Columns are detected from the header row and only the detected columns
+    are read; rows are parsed and compacted chunk by chunk as for CSV files,
+    with the same progress reports. Returns (dataset, error_message).
+    """
+    try:
+        reader = XlsxReader(file)
+    except (zipfile.BadZipFile, KeyError, ExpatError) as e:
+        return None, f'Could not read the Excel file: {e}'
+    try:
+        header = pd.DataFrame(columns=reader.header)
+        columns = detect_columns(header)
+        error_message = check_columns(header, columns)
+        if error_message:
+            return None, error_message
+
+        usage = memory_usage_tracker()
+        chunks = []
+        rows = 0
+        for chunk in reader.chunks(read_columns(columns, reader.header), chunk_rows or CSV_CHUNK_ROWS):
+            chunks.append(prepare_rows(chunk, columns, usage))
+            rows += len(chunk)
+            if progress:
+                progress(stage='parsing', rows=rows)
+    finally:
+        reader.close()
+    if not chunks:
+        return None, 'The uploaded file has no data rows.'
+    if progress:
+        progress(stage='indexing')
+
+    # Sort and index once; filters on later requests are binary searches
+    dataset = Dataset(concat_chunks(chunks), columns)
+    report_memory(usage, dataset)
+    return dataset, None
+
+def load_dataset_file(file, filename, progress=None):
+    """
+    Read and index a CSV or .xlsx file (both streamed in chunks, reporting
+    progress) or an .xls file. Returns (dataset, error_message).
+    """
+    if filename.endswith('.csv'):
+        return build_dataset_from_csv(file, progress=progress)
+    if filename.endswith('.xlsx') and XLSX_STREAMING:
+        return build_dataset_from_xlsx(file, progress=progress)
+    data = read_data_file(file, filename)
+    if data is None:
+        return None, 'Unsupported file type. Please upload a CSV or Excel file.'
+    return build_dataset(data)
+
+def load_dataset_file_cached(file, filename, progress=None):
+    """
+    load_dataset_file behind the on-disk cache: files are hashed on arrival and a
+    file that was parsed before (by any worker) is memory-mapped from disk instead
+    of being parsed again. The content hash becomes the dataset ID.
+    file must be a seekable binary file object. Returns (dataset, error_message).
+    """
+    key = content_hash(file, filename, EXTRA_COLUMNS)
+    dataset = load_cached_dataset(key)
+    if dataset is not None:
+        return dataset, None
+
+    dataset, error_message = load_dataset_file(file, filename, progress)
+    if dataset is None:
+        return None, error_message
+    if progress:
+        progress(stage='saving')
+    dataset.dataset_id = key
+    save_cached_dataset(key, dataset)
+
+    # Serve the memory-mapped copy, so this worker shares pages with the
+    # other workers instead of keeping a private copy of the parsed data
+    return load_cached_dataset(key) or dataset, None
+
+def append_dataset(base, dataset):
+    """
+    Merge a freshly uploaded dataset into an earlier one (see Dataset.append).
+    The result is cached under a new ID derived from both, so workers still
+    holding the earlier dataset keep serving it consistently.
+    Returns (dataset, appended row numbers, error_message).
+    """
+    merged, new_rows, error_message = base.append(dataset)
+    if error_message or merged is base:
+        return merged, new_rows, error_message
+    merged.dataset_id = hashlib.sha256(f"{base.dataset_id}+{dataset.dataset_id}".encode()).hexdigest()
+    save_cached_dataset(merged.dataset_id, merged)
+    return merged, new_rows, None
+
+def process_upload(file, filename, mode=None, base_dataset_id=None, progress=None):
+    """
+    Parse an uploaded file and register the dataset; with mode='append', merge
+    it into the dataset base_dataset_id instead (see append_dataset).
+    Returns (response payload, error_message).
+    """
+    if progress:
+        progress(stage='hashing')
+    dataset, error_message = load_dataset_file_cached(file, filename, progress)
+    if error_message:
+        return None, error_message
+
+    message = 'File processed successfully!'
+    if mode == 'append':
+        base, error_message = get_dataset(base_dataset_id)
+        if error_message:
+            return None, error_message
+        if progress:
+            progress(stage='appending')
+        uploaded = dataset
+        dataset, new_rows, error_message = append_dataset(base, uploaded)
+        if error_message:
+            return None, error_message
+        _, master_error = update_outlet_master(dataset, new_rows, source_id=uploaded.dataset_id)
+        message = f'Appended {len(new_rows)} new rows ({len(uploaded) - len(new_rows)} duplicates skipped).'
+    else:
+        _, master_error = update_outlet_master(dataset)
+    if master_error:
+        message = f'{message} {master_error}'
+
+    dataset_registry.add(dataset)
+    if mode == 'append' and dataset is not base:
+        invalidate_cached_maps(base.dataset_id)
+
+    # The dropdown lists the employees by name, with their row counts (appended
+    # employees come last in the index, so index order is not sorted)
+    order = np.argsort(dataset.employees.astype(str), kind='stable')
+    return {'message': message, 'employees': dataset.employees[order].tolist(),
+            'employee_rows': dataset.employee_rows()[order].tolist(),
+            'dataset_id': dataset.dataset_id, 'version': dataset.version}, None
+
+def upload_job(job, path, filename, mode, base_dataset_id):
+    """Background upload: process the spooled file, then delete it."""
+    try:
+        with open(path, 'rb') as f:
+            return process_upload(f, filename, mode, base_dataset_id, job.report)
+    finally:
+        os.remove(path)
 
 @app.route('/upload_data', methods=['POST'])
 def upload_data():
-    global global_data, global_columns
+    """
+    Upload a data file. With mode=append, its rows are merged into the
+    dataset given by dataset_id (required in that mode) instead of
+    replacing it, skipping rows that are already there. With background=1,
+    the file is spooled to disk and processed by a background job: the
+    response (202) holds the job ID to poll at /api/jobs/<job_id>.
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     file = request.files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
+    mode, base_dataset_id = request.form.get('mode'), request.form.get('dataset_id')
 
-    try:
-        # Determine file type and read accordingly
-        if file.filename.endswith('.csv'):
-            data = pd.read_csv(file)
-        elif file.filename.endswith(('.xls', '.xlsx')):
-            data = pd.read_excel(file)
-        else:
-            return jsonify({'error': 'Unsupported file type. Please upload a CSV or Excel file.'}), 400
-        
-        # Convert all column names to string type
-        data.columns = data.columns.astype(str)
-
-        # Detect and store globally
-        global_columns['punch_lat_col'] = find_column(data, ["punch in lat", "latitude", "lat"])
-        global_columns['punch_lon_col'] = find_column(data, ["punch in long", "longitude", "lon"])
-        global_columns['visit_lat_col'] = find_column(data, ["visit lat", "latitude", "lat"])
-        global_columns['visit_lon_col'] = find_column(data, ["visit long", "longitude", "lon"])
-        global_columns['punch_in_time_col'] = find_column(data, ["punch in time", "time", "punch_time"])
-        global_columns['visit_time_col'] = find_column(data, ["visit time", "time of visit", "visit_time"])
-        global_columns['punch_in_date_col'] = find_column(data, ["punch in date", "date", "punch_date"])
-        global_columns['visit_date_col'] = find_column(data, ["visit date", "date", "visit_date"])
-        global_columns['name_col'] = find_column(data, ["employee name", "name"])
-        global_columns['outlet_name_col'] = find_column(data, ["outlet name"])
-        global_columns['outlet_id_col'] = find_column(data, ["outlet id"])
-
-        # Check if all mandatory columns are found
-        mandatory_cols_keys = [
-            'punch_lat_col', 'punch_lon_col', 'visit_lat_col', 'visit_lon_col', 
-            'punch_in_time_col', 'name_col', 'outlet_name_col', 'outlet_id_col'
-        ]
-        missing_cols = [k for k in mandatory_cols_keys if global_columns.get(k) is None]
-        
-        if missing_cols:
-            return jsonify({'error': f"Missing required columns: {', '.join(missing_cols)}. Please check your file headers. Detected: {data.columns.tolist()}"}), 400
-
-        # Parse time columns
-        # Ensure the column exists before attempting to parse
-        if global_columns['punch_in_time_col'] in data.columns:
-            data = parse_datetime_columns(data, global_columns['punch_in_time_col'], global_columns['punch_in_date_col'])
-        else:
-            data[global_columns['punch_in_time_col']] = "Column Not Found" # Fallback if column not in data
-
-        if global_columns['visit_time_col'] and global_columns['visit_time_col'] in data.columns:
-            data = parse_datetime_columns(data, global_columns['visit_time_col'], global_columns['visit_date_col'])
-        else:
-            # Create the column with 'N/A' if it's not found, so it's always accessible
-            data[global_columns.get('visit_time_col', 'visit_time_placeholder')] = 'N/A' 
+    if str(request.form.get('background', '')).lower() in ('1', 'true', 'yes'):
+        fd, path = tempfile.mkstemp(prefix='upload-', suffix=os.path.splitext(file.filename)[1])
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(file.stream, f)
+        job = job_queue.submit('upload', upload_job, path, file.filename, mode, base_dataset_id)
+        return jsonify(job.to_dict()), 202
 
-
-        global_data = data # Store processed data globally
-
-        employees = data[global_columns['name_col']].unique().tolist()
-        return jsonify({'message': 'File processed successfully!', 'employees': employees}), 200
+    try:
+        payload, error_message = process_upload(file, file.filename, mode, base_dataset_id)
+        if error_message:
+            return jsonify({'error': error_message}), 400
+        return jsonify(payload), 200
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def get_dataset(dataset_id):
+    """
+    Look up the dataset a request refers to by its dataset_id, which every
+    request must give (each worker holds its own datasets, so there is no
+    meaningful "latest" one). Returns (dataset, error_message).
+    """
+    if not dataset_id:
+        return None, 'No dataset_id given. Please upload a file first.'
+    dataset = dataset_registry.get(dataset_id)
+    if dataset is None:
+        return None, 'Unknown dataset. It may have expired; please upload the file again.'
+    return dataset, None
+
 @app.route('/get_unique_dates', methods=['GET'])
 def get_unique_dates():
-    global global_data, global_columns
-    if global_data is None:
-        return jsonify({'error': 'No data uploaded yet. Please upload a file first.'}), 400
-
-    punch_in_time_col_name = global_columns.get('punch_in_time_col')
-    if not punch_in_time_col_name or punch_in_time_col_name not in global_data.columns:
-        return jsonify({'error': 'Punch In Time column not found in the uploaded data.'}), 400
-
-    try:
-        # Convert to datetime using the expected DD-MM-YYYY HH:MM:SS format
-        # This is crucial for correct parsing before extracting date
-        unique_dates = pd.to_datetime(global_data[punch_in_time_col_name], format='%d-%m-%Y %H:%M:%S', errors='coerce').dt.date.dropna().unique()
-        
-        # Sort dates
-        sorted_dates = sorted(unique_dates)
-
-        # Format for dropdown (value as YYYY-MM-DD for backend, text as DD-MM-YYYY for display)
-        formatted_dates = [{'value': date.strftime('%Y-%m-%d'), 'text': date.strftime('%d-%m-%Y')} for date in sorted_dates]
-        
-        return jsonify(formatted_dates), 200
-    except Exception as e:
-        return jsonify({'error': f"Error processing dates: {str(e)}"}), 500
+    """
+    The sorted distinct punch-in dates for the date dropdowns (value as
+    YYYY-MM-DD for the backend, text as DD-MM-YYYY for display), with the
+    number of rows and employees on each. With employee_name, only the dates
+    that employee worked on. Precomputed per dataset, so no rows are read.
+    """
+    dataset, error_message = get_dataset(request.args.get('dataset_id'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
 
+    employee_name = request.args.get('employee_name')
+    dates = dataset.employee_dates(employee_name) if employee_name else dataset.dates
+    if dates is None:
+        return jsonify({'error': f"Unknown employee '{employee_name}'."}), 400
 
-def generate_map_html(start_date_str, end_date_str, employee_name):
-    global global_data, global_columns
-    if global_data is None:
-        return None, "No data uploaded. Please upload a file first."
+    formatted_dates = [
+        {'value': value, 'text': text, 'rows': rows, 'employees': employees}
+        for value, text, rows, employees in zip(
+            dates['value'].tolist(), dates['text'].tolist(), dates['rows'].tolist(), dates['employees'].tolist())
+    ]
+    return jsonify(formatted_dates), 200
 
-    filtered_data = global_data.copy()
 
+def parse_date_filters(start_date_str, end_date_str):
+    """Parse optional YYYY-MM-DD filter dates. Returns (start_date, end_date, error_message)."""
     # Convert filter dates to datetime objects for comparison
     start_date_filter_dt = None
     end_date_filter_dt = None
@@ -764,129 +1523,39 @@ def generate_map_html(start_date_str, end_date_str, employee_name):
         try:
             start_date_filter_dt = datetime.strptime(start_date_str, '%Y-%m-%d').date()
         except ValueError:
-            return None, "Invalid Start Date format. Please use YYYY-MM-DD."
+            return None, None, "Invalid Start Date format. Please use YYYY-MM-DD."
     if end_date_str:
         try:
             end_date_filter_dt = datetime.strptime(end_date_str, '%Y-%m-%d').date()
         except ValueError:
-            return None, "Invalid End Date format. Please use YYYY-MM-DD."
-
-    # Filter by date range
-    punch_in_time_col_name = global_columns.get('punch_in_time_col')
-    if not punch_in_time_col_name or punch_in_time_col_name not in filtered_data.columns:
-        return None, 'Punch In Time column not found for date filtering.'
-
-    try:
-        # Ensure the column is datetime objects for filtering, explicitly parsing DD-MM-YYYY HH:MM:SS
-        filtered_data['ParsedPunchInTime'] = pd.to_datetime(filtered_data[punch_in_time_col_name], format='%d-%m-%Y %H:%M:%S', errors='coerce')
-        filtered_data = filtered_data.dropna(subset=['ParsedPunchInTime']) # Drop rows where date parsing failed
-        
-        if start_date_filter_dt:
-            filtered_data = filtered_data[filtered_data['ParsedPunchInTime'].dt.date >= start_date_filter_dt]
-        if end_date_filter_dt:
-            filtered_data = filtered_data[filtered_data['ParsedPunchInTime'].dt.date <= end_date_filter_dt]
-    except Exception as e:
-        return None, f"Error filtering by date range: {e}"
+            return None, None, "Invalid End Date format. Please use YYYY-MM-DD."
+    return start_date_filter_dt, end_date_filter_dt, None
 
-    # Filter by employee
-    if employee_name:
-        name_col_name = global_columns.get('name_col')
-        if name_col_name and name_col_name in filtered_data.columns:
-            filtered_data = filtered_data[filtered_data[name_col_name] == employee_name]
-        else:
-            return None, 'Employee Name column not found for employee filtering.'
-
-    if filtered_data.empty:
-        return None, 'No data found for the selected filters.'
-
-    # Calculate bounds for zooming
-    min_lat = filtered_data[global_columns['punch_lat_col']].min()
-    max_lat = filtered_data[global_columns['punch_lat_col']].max()
-    min_lon = filtered_data[global_columns['punch_lon_col']].min()
-    max_lon = filtered_data[global_columns['punch_lon_col']].max()
-
-    # Center the map around the filtered data
-    avg_lat = filtered_data[global_columns['punch_lat_col']].mean() if not filtered_data.empty else 20.5937
-    avg_lon = filtered_data[global_columns['punch_lon_col']].mean() if not filtered_data.empty else 78.9629
-
-    fmap = folium.Map(
-        location=[avg_lat, avg_lon],
-        zoom_start=5,
-        tiles='CartoDB positron'
-    )
-
-    # Adjust the map to fit the bounds if an employee is selected
-    if employee_name and not filtered_data.empty:
-        fmap.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]])
-
-    Fullscreen().add_to(fmap)
-    MiniMap().add_to(fmap)
+def add_marker_layers(fmap, dataset, selection, outlet_master):
+    """
+    Detailed rendering: one folium.Marker per distinct punch-in location and
+    one per visited outlet in a MarkerCluster.
+    """
+    columns = dataset.columns
     marker_cluster = MarkerCluster(name="Locations").add_to(fmap)
 
-    color_palette = [
-        "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
-        "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf",
-        "#aec7e8", "#ffbb78", "#98df8a", "#ff9896", "#c5b0d5"
-    ]
-    employees = filtered_data[global_columns['name_col']].unique()
-    employee_colors = {emp: color_palette[i % len(color_palette)] for i, emp in enumerate(employees)}
-    employee_total_distances = {} # Dictionary to store total distance for each employee
-
     # To keep track of added markers to avoid duplicates
     added_markers = set()
 
-    for emp in employees:
-        employee_route_group = FeatureGroup(name=f"Routes: {emp}")
-        emp_data = filtered_data[filtered_data[global_columns['name_col']] == emp].copy()
-        color = employee_colors[emp]
-
-        # Ensure datetime columns are properly parsed for sorting
-        if global_columns['punch_in_time_col'] in emp_data.columns:
-            emp_data['PunchInDateTime'] = pd.to_datetime(emp_data[global_columns['punch_in_time_col']], format='%d-%m-%Y %H:%M:%S', errors='coerce')
-        else:
-            emp_data['PunchInDateTime'] = pd.NaT # Not a Time
-
-        emp_data = emp_data.sort_values(by='PunchInDateTime').reset_index(drop=True)
-
-        current_employee_distance = 0
-        prev_punch_lat, prev_punch_lon = None, None
+    for emp, start_row, stop_row in selection:
+        emp_data = dataset.slice(start_row, stop_row)
 
         for idx, row in emp_data.iterrows():
-            current_punch_lat = row[global_columns['punch_lat_col']]
-            current_punch_lon = row[global_columns['punch_lon_col']]
-            current_visit_lat = row[global_columns['visit_lat_col']]
-            current_visit_lon = row[global_columns['visit_lon_col']]
-            current_punch_in_time_display = row[global_columns['punch_in_time_col']]
-            
-            # Safely get visit time display
-            current_visit_time_display = row.get(global_columns.get('visit_time_col', 'visit_time_placeholder'), 'N/A')
-
-            current_outlet_name = row[global_columns['outlet_name_col']] if global_columns['outlet_name_col'] else 'N/A'
-            current_outlet_id = row[global_columns['outlet_id_col']] if global_columns['outlet_id_col'] else 'N/A'
+            current_punch_lat = row[columns['punch_lat_col']]
+            current_punch_lon = row[columns['punch_lon_col']]
             
-            current_date = pd.to_datetime(current_punch_in_time_display, format='%d-%m-%Y %H:%M:%S', errors='coerce').strftime('%Y-%m-%d') if pd.notna(pd.to_datetime(current_punch_in_time_display, format='%d-%m-%Y %H:%M:%S', errors='coerce')) else 'N/A'
-
-            # Format punch in time for display - EXPLICITLY specify format
-            try:
-                punch_in_dt = pd.to_datetime(current_punch_in_time_display, format='%d-%m-%Y %H:%M:%S', errors='coerce')
-                punch_in_time_display_fmt = punch_in_dt.strftime('%d-%m-%Y %H:%M:%S') if not pd.isnull(punch_in_dt) else current_punch_in_time_display
-            except Exception:
-                punch_in_time_display_fmt = current_punch_in_time_display
-
-            # Format visit time for display - EXPLICITLY specify format
-            try:
-                visit_in_dt = pd.to_datetime(current_visit_time_display, format='%d-%m-%Y %H:%M:%S', errors='coerce')
-                visit_time_display_fmt = visit_in_dt.strftime('%d-%m-%Y %H:%M:%S') if not pd.isnull(visit_in_dt) else current_visit_time_display
-            except Exception:
-                visit_time_display_fmt = current_visit_time_display
+            # Punch-in time was parsed once at upload
+            punch_in_dt = row[PARSED_TIME_COL]
+            current_date = punch_in_dt.strftime('%Y-%m-%d')
+            punch_in_time_display_fmt = punch_in_dt.strftime('%d-%m-%Y %H:%M:%S')
 
             punch_lat_display = f"{current_punch_lat:.4f}" if pd.notna(current_punch_lat) else 'N/A'
             punch_lon_display = f"{current_punch_lon:.4f}" if pd.notna(current_punch_lon) else 'N/A'
-            visit_lat_display = f"{current_visit_lat:.4f}" if pd.notna(current_visit_lat) else 'N/A'
-            visit_lon_display = f"{current_visit_lon:.4f}" if pd.notna(current_visit_lon) else 'N/A'
-            outlet_name_display = current_outlet_name if pd.notna(current_outlet_name) else 'N/A'
-            outlet_id_display = current_outlet_id if pd.notna(current_outlet_id) else 'N/A'
-
 
             # Add Punch In Marker (only if unique for the day at this location)
             punch_marker_key = (current_punch_lat, current_punch_lon, current_date, 'punch')
@@ -904,42 +1573,121 @@ def generate_map_html(start_date_str, end_date_str, employee_name):
                 ).add_to(marker_cluster)
                 added_markers.add(punch_marker_key)
 
-            # Add Visit Marker (only if unique for the day at this location/outlet)
-            visit_marker_key = (current_visit_lat, current_visit_lon, current_date, outlet_name_display, 'visit')
-            if visit_marker_key not in added_markers:
-                folium.Marker(
-                    location=[current_visit_lat, current_visit_lon],
-                    popup=f"""
-                    <strong>Employee:</strong> {emp}<br>
-                    <strong>Outlet:</strong> {outlet_name_display} (ID: {outlet_id_display})<br>
-                    <strong>Visit Time:</strong> ⏱️ {visit_time_display_fmt}<br>
-                    <strong>Latitude:</strong> {visit_lat_display}<br>
-                    <strong>Longitude:</strong> {visit_lon_display}
-                    """,
-                    tooltip=f"Outlet: {outlet_name_display} | Visit: {visit_time_display_fmt}",
-                    icon=folium.Icon(color="green", icon="briefcase", prefix='fa', icon_size=(30, 30))
-                ).add_to(marker_cluster)
-                added_markers.add(visit_marker_key)
+    # Add one Visit Marker per outlet, with the visits to it aggregated
+    outlets, outlet_names, outlet_ids = outlet_points(dataset, Dataset.row_index(selection), outlet_master)
+    first_visits = format_datetimes(pd.to_datetime(outlets['first'], unit='s').to_numpy(), missing='N/A')
+    last_visits = format_datetimes(pd.to_datetime(outlets['last'], unit='s').to_numpy(), missing='N/A')
+    for i, outlet in enumerate(outlets.itertuples(index=False)):
+        outlet_name_display = outlet_names[outlet.outlet] if outlet.outlet >= 0 else 'N/A'
+        outlet_id_display = outlet_ids[outlet.outlet_id] if outlet.outlet_id >= 0 else 'N/A'
+        employees_display = f"{outlet.employees} employee{'s' if outlet.employees != 1 else ''}"
+        history_display = ''
+        if pd.notna(outlet.total_visits):
+            history_display = f"<strong>All Uploads:</strong> {int(outlet.total_visits)} visits, {outlet.first_seen} to {outlet.last_seen}<br>"
+        folium.Marker(
+            location=[outlet.lat, outlet.lon],
+            popup=f"""
+            <strong>Outlet:</strong> {outlet_name_display} (ID: {outlet_id_display})<br>
+            <strong>Visits:</strong> {outlet.visits} by {employees_display}<br>
+            <strong>First Visit:</strong> ⏱️ {first_visits[i]}<br>
+            <strong>Last Visit:</strong> ⏱️ {last_visits[i]}<br>
+            {history_display}<strong>Latitude:</strong> {outlet.lat:.4f}<br>
+            <strong>Longitude:</strong> {outlet.lon:.4f}
+            """,
+            tooltip=f"Outlet: {outlet_name_display} | Visits: {outlet.visits}",
+            icon=folium.Icon(color="green", icon="briefcase", prefix='fa', icon_size=(30, 30))
+        ).add_to(marker_cluster)
+
+# Progress stages of a map render, in order
+RENDER_STAGES = ('selecting', 'markers', 'routes', 'verification', 'html')
+
+def generate_map_html(dataset, start_date_str, end_date_str, employee_name, render_mode=None, route_day_layers=None,
+                      verification=False, progress=None):
+    """
+    Render the map for the given filters. progress, if given, is called at
+    each of RENDER_STAGES with the stage, its step and the number of
+    employees on the map. Returns (map_html, error_message).
+    """
+    def report(stage, **fields):
+        if progress:
+            progress(stage=stage, step=RENDER_STAGES.index(stage) + 1, steps=len(RENDER_STAGES), **fields)
 
+    render_mode = render_mode or MAP_RENDER_MODE
+    if route_day_layers is None:
+        route_day_layers = ROUTE_DAY_LAYERS
+    if render_mode not in RENDER_MODES:
+        return None, f"Unknown render mode '{render_mode}'. Use one of: {', '.join(RENDER_MODES)}."
 
-            # Draw line between consecutive punch-in locations for the same employee
-            if prev_punch_lat is not None and pd.notna(current_punch_lat) and pd.notna(current_punch_lon):
-                folium.PolyLine(
-                    locations=[(prev_punch_lat, prev_punch_lon), (current_punch_lat, current_punch_lon)],
-                    color=color,
-                    weight=4,
-                    opacity=0.7
-                ).add_to(employee_route_group)
-                
-                # Calculate and add distance to the total for the employee
-                dist = haversine_distance(prev_punch_lat, prev_punch_lon, current_punch_lat, current_punch_lon)
-                current_employee_distance += dist
+    start_date_filter_dt, end_date_filter_dt, error_message = parse_date_filters(start_date_str, end_date_str)
+    if error_message:
+        return None, error_message
 
-            prev_punch_lat = current_punch_lat
-            prev_punch_lon = current_punch_lon
-        
-        employee_route_group.add_to(fmap) # Add each employee's route group to the map
-        employee_total_distances[emp] = current_employee_distance
+    # Filter by date range and employee: binary searches over the sorted index,
+    # giving one contiguous row range per employee
+    report('selecting')
+    selection = dataset.select(start_date_filter_dt, end_date_filter_dt, employee_name)
+
+    if not selection:
+        return None, 'No data found for the selected filters.'
+
+    rows = Dataset.row_index(selection)
+    if render_mode == 'auto':
+        render_mode = next((mode for mode, max_rows in AUTO_RENDER_MODES if len(rows) <= max_rows), 'clustered')
+    punch_lats = dataset.punch_lat[rows]
+    punch_lons = dataset.punch_lon[rows]
+
+    # Calculate bounds for zooming
+    min_lat = np.nanmin(punch_lats)
+    max_lat = np.nanmax(punch_lats)
+    min_lon = np.nanmin(punch_lons)
+    max_lon = np.nanmax(punch_lons)
+
+    # Center the map around the filtered data
+    avg_lat = np.nanmean(punch_lats)
+    avg_lon = np.nanmean(punch_lons)
+
+    fmap = folium.Map(
+        location=[avg_lat, avg_lon],
+        zoom_start=5,
+        tiles='CartoDB positron'
+    )
+
+    # Adjust the map to fit the bounds if an employee is selected
+    if employee_name:
+        fmap.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]])
+
+    Fullscreen().add_to(fmap)
+    MiniMap().add_to(fmap)
+
+    color_palette = [
+        "#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd",
+        "#8c564b", "#e377c2", "#7f7f7f", "#bcbd22", "#17becf",
+        "#aec7e8", "#ffbb78", "#98df8a", "#ff9896", "#c5b0d5"
+    ]
+    employees = [emp for emp, _, _ in selection]
+    employee_colors = {emp: color_palette[i % len(color_palette)] for i, emp in enumerate(employees)}
+    # Sum of each employee's per-day route distances, for all employees in one vectorized pass
+    employee_total_distances, _ = selection_route_totals(dataset, selection)
+
+    # Visits are drawn as one marker per outlet, at its canonical location
+    report('markers', employees=len(employees), rows=len(rows))
+    outlet_master = load_outlet_master()
+    if render_mode == 'clustered':
+        add_clustered_layers(fmap, dataset, selection, CLUSTER_STREET_ZOOM, CLUSTER_MAX_MARKERS, outlet_master)
+    elif render_mode == 'compact':
+        add_compact_layers(fmap, dataset, selection, outlet_master)
+    else:
+        add_marker_layers(fmap, dataset, selection, outlet_master)
+    report('routes')
+    add_route_layers(
+        fmap, dataset, selection, employee_colors, day_layers=route_day_layers,
+        tolerance_m=ROUTE_SIMPLIFY_M, zoom_levels=ROUTE_ZOOM_LEVELS
+    )
+    if verification:
+        report('verification')
+        verified = verify_visits(dataset, rows, GEOFENCE_RADIUS_M, load_outlet_locations(), outlet_master)
+        add_verification_layer(fmap, verified)
+        fmap.get_root().html.add_child(folium.Element(verification_legend_html()))
 
     # Add LayerControl to toggle employee routes
     folium.LayerControl().add_to(fmap)
@@ -967,12 +1715,13 @@ def generate_map_html(start_date_str, end_date_str, employee_name):
         employee_legend_items_html += f"""
         <div class="employee-legend-item">
             <div class="employee-legend-color-box" style="background-color:{color};"></div>
-            <span>{emp} (Dist: {distance:.2f} km)</span>
+            <span>{emp} (Daily routes: {distance:.2f} km)</span>
         </div>
         """
     employee_color_legend_html = f"""
     <div class="employee-legend">
-        <h4 style="margin-top:0; margin-bottom:12px; font-weight:bold; color:#333;">Employee Routes & Distance</h4>
+        <h4 style="margin-top:0; margin-bottom:4px; font-weight:bold; color:#333;">Employee Routes & Distance</h4>
+        <div style="margin-bottom:12px; font-size:12px; color:#666;">Sum of per-day routes; travel between days is not counted.</div>
         {employee_legend_items_html}
     </div>
     """
@@ -986,8 +1735,104 @@ def generate_map_html(start_date_str, end_date_str, employee_name):
     """
     fmap.get_root().html.add_child(folium.Element(signature_html))
 
+    report('html')
     return fmap._repr_html_(), None # Return HTML and no error
 
+def verification_legend_html():
+    """Legend for the colour-coded visit verification layer."""
+    labels = {
+        'within': f'Within {GEOFENCE_RADIUS_M:g} m of outlet',
+        'outside': f'Outside {GEOFENCE_RADIUS_M:g} m of outlet',
+        'no_reference': 'No outlet location',
+    }
+    items_html = ""
+    for status, color in VERIFICATION_COLORS.items():
+        items_html += f"""
+        <div class="employee-legend-item">
+            <div class="employee-legend-color-box" style="background-color:{color}; border-radius:50%;"></div>
+            <span>{labels[status]}</span>
+        </div>
+        """
+    return f"""
+    <div class="employee-legend" style="left: auto; right: 20px; bottom: 60px;">
+        <h4 style="margin-top:0; margin-bottom:12px; font-weight:bold; color:#333;">Visit Verification</h4>
+        {items_html}
+    </div>
+    """
+
+def invalidate_cached_maps(dataset_id):
+    """
+    Drop the cached maps of the dataset dataset_id. An append caches the
+    merged dataset under a new ID, so the maps of the dataset it replaced
+    would otherwise stay in the cache until they are evicted.
+    """
+    map_cache.discard_where(lambda key: key[0] == dataset_id)
+
+def map_cache_key(dataset, start_date_str, end_date_str, employee_name, render_mode=None, route_day_layers=None,
+                  verification=False):
+    """The rendered-map cache key of a map request."""
+    render_mode = render_mode or MAP_RENDER_MODE
+    if route_day_layers is None:
+        route_day_layers = ROUTE_DAY_LAYERS
+    return (dataset.dataset_id, dataset.version, start_date_str or '', end_date_str or '', employee_name or '',
+            render_mode, bool(route_day_layers), outlet_master_version(),
+            outlet_locations_version() if verification else None)
+
+def generate_map_html_cached(dataset, start_date_str, end_date_str, employee_name, render_mode=None, route_day_layers=None,
+                             verification=False, progress=None):
+    """
+    generate_map_html behind the rendered-map cache.
+    Returns (map_html, etag, error_message).
+    """
+    key = map_cache_key(dataset, start_date_str, end_date_str, employee_name, render_mode, route_day_layers, verification)
+    cached = map_cache.get(key)
+    if cached is not None:
+        return cached[0], cached[1], None
+
+    render_mode, route_day_layers = key[5], key[6]
+    map_html, error_message = generate_map_html(
+        dataset, start_date_str, end_date_str, employee_name, render_mode, route_day_layers, bool(verification), progress
+    )
+    if error_message or not map_html:
+        return map_html, None, error_message
+
+    # The key fully determines the map, so it also identifies the HTML
+    etag = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()[:32]
+    map_cache.put(key, (map_html, etag))
+    return map_html, etag, None
+
+def not_modified(etag):
+    """True if the client already holds the map with this ETag (If-None-Match)."""
+    return etag is not None and request.if_none_match.contains(etag)
+
+def render_map_job(job, *map_args):
+    """Background map render; the result is what /get_map would return."""
+    map_html, _, error_message = generate_map_html_cached(*map_args, progress=job.report)
+    if error_message:
+        return None, error_message
+    if not map_html:
+        return {'message': 'No map could be generated with the current filters. Try adjusting them.'}, None
+    return {'map_html': map_html}, None
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job(job_id):
+    """
+    Status of a background job: queued, running, done, failed or cancelled,
+    its progress (e.g. rows parsed, render stage) and, once done, its result.
+    """
+    job = job_queue.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job. It may have finished too long ago.'}), 404
+    return jsonify(job), 200
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    """Cancel a background job (a running job stops at its next progress report)."""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job. It may have finished too long ago.'}), 404
+    return jsonify(job), 200
+
 @app.route('/get_map', methods=['POST'])
 def get_map():
     req_data = request.get_json()
@@ -995,13 +1840,30 @@ def get_map():
     selected_end_date_str = req_data.get('end_date')
     selected_employee = req_data.get('employee_name')
 
-    map_html, error_message = generate_map_html(selected_start_date_str, selected_end_date_str, selected_employee)
+    dataset, error_message = get_dataset(req_data.get('dataset_id'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+
+    map_args = (
+        dataset, selected_start_date_str, selected_end_date_str, selected_employee,
+        req_data.get('render_mode'), req_data.get('route_day_layers'), req_data.get('verification')
+    )
+    # Maps not rendered yet can be rendered by a background job (202 with its ID)
+    if req_data.get('background') and map_cache.get(map_cache_key(*map_args)) is None:
+        job = job_queue.submit('render', render_map_job, *map_args)
+        return jsonify(job.to_dict()), 202
+
+    map_html, etag, error_message = generate_map_html_cached(*map_args)
 
     if error_message:
         return jsonify({'error': error_message}), 500
     
     if map_html:
-        return jsonify({'map_html': map_html}), 200
+        if not_modified(etag):
+            return '', 304, {'ETag': f'"{etag}"'}
+        response = jsonify({'map_html': map_html})
+        response.set_etag(etag)
+        return response, 200
     else:
         return jsonify({'message': 'No map could be generated with the current filters. Try adjusting them.'}), 200
 
@@ -1013,27 +1875,689 @@ def download_map_html():
     selected_end_date_str = req_data.get('end_date')
     selected_employee = req_data.get('employee_name')
 
-    map_html, error_message = generate_map_html(selected_start_date_str, selected_end_date_str, selected_employee)
+    dataset, error_message = get_dataset(req_data.get('dataset_id'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+
+    map_html, etag, error_message = generate_map_html_cached(
+        dataset, selected_start_date_str, selected_end_date_str, selected_employee,
+        req_data.get('render_mode'), req_data.get('route_day_layers'), req_data.get('verification')
+    )
 
     if error_message:
         return jsonify({'error': error_message}), 500
     
     if map_html:
+        if not_modified(etag):
+            return '', 304, {'ETag': f'"{etag}"'}
+
         # Create a BytesIO object to hold the HTML content
         buffer = io.BytesIO()
         buffer.write(map_html.encode('utf-8'))
         buffer.seek(0) # Rewind to the beginning of the buffer
 
         # Send the file
-        return send_file(
+        response = send_file(
             buffer,
             mimetype='text/html',
             as_attachment=True,
-            download_name='employee_route_map.html'
+            download_name='employee_route_map.html',
+            etag=False
         )
+        response.set_etag(etag)
+        return response
     else:
         return jsonify({'error': 'Failed to generate map for download.'}), 500
 
+BATCH_SPLITS = ('day', 'employee')
+
+def batch_map_tasks(dataset, start_date_str, end_date_str, employee_names=None, split='day'):
+    """
+    The maps of a batch export as (employee, start_date, end_date) tasks: one
+    per employee and day with data (split='day'), or one per employee over
+    the whole range (split='employee'). employee_names limits the export to
+    those employees (all when empty). Days come from the per-day summaries,
+    so no rows are read. Returns (tasks, error_message).
+    """
+    if split not in BATCH_SPLITS:
+        return None, f"Unknown split '{split}'. Use one of: {', '.join(BATCH_SPLITS)}."
+    start_date_filter_dt, end_date_filter_dt, error_message = parse_date_filters(start_date_str, end_date_str)
+    if error_message:
+        return None, error_message
+    unknown = [name for name in employee_names or [] if dataset.employee_code(name) is None]
+    if unknown:
+        return None, f"Unknown employees: {', '.join(unknown)}."
+
+    days = dataset.daily_in_selection(dataset.select(start_date_filter_dt, end_date_filter_dt, employee_names or None))
+    if split == 'employee':
+        return [(emp, start_date_str or '', end_date_str or '') for emp in days['employee'].unique()], None
+    dates = np.datetime_as_string(days['date'].to_numpy().astype('datetime64[D]'), unit='D')
+    return [(emp, date, date) for emp, date in zip(days['employee'], dates)], None
+
+def render_batch_map(dataset, task, render_mode=None, route_day_layers=None, verification=False):
+    """Render one map of a batch export. Returns (file name in the ZIP, HTML), or None if the map is empty."""
+    employee, start_date_str, end_date_str = task
+    map_html, error_message = generate_map_html(
+        dataset, start_date_str, end_date_str, employee, render_mode, route_day_layers, verification
+    )
+    if error_message or not map_html:
+        return None
+    if start_date_str and start_date_str == end_date_str:
+        period = start_date_str
+    else:
+        period = f"{start_date_str or 'start'}_to_{end_date_str or 'end'}"
+    folder = re.sub(r'[^\w.-]+', '_', employee).strip('_') or 'employee'
+    return f"{folder}/{period}.html", map_html
+
+def batch_employee_names(params):
+    """Employees to export: employee_names (a JSON list) or repeated employee_name parameters; 'all' or none for everyone."""
+    if hasattr(params, 'getlist'):
+        names = params.getlist('employee_name')
+    else:
+        names = params.get('employee_names', [params.get('employee_name')])
+    if isinstance(names, str):
+        names = [names]
+    names = [str(name) for name in names or [] if name]
+    return [] if names == ['all'] else names
+
+@app.route('/api/batch_maps', methods=['GET', 'POST'])
+def api_batch_maps():
+    """
+    ZIP of route maps, one HTML file per employee and day (split=day, the
+    default) or per employee (split=employee), for start_date/end_date and
+    the given employees (all by default). Maps are rendered in parallel by
+    BATCH_EXPORT_WORKERS processes and streamed into the ZIP as they finish.
+    With export_id, progress can be polled at /api/batch_maps/progress.
+    """
+    params = request.get_json(silent=True) or request.args
+    dataset, error_message = get_dataset(params.get('dataset_id'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    render_mode = params.get('render_mode') or MAP_RENDER_MODE
+    if render_mode not in RENDER_MODES:
+        return jsonify({'error': f"Unknown render mode '{render_mode}'. Use one of: {', '.join(RENDER_MODES)}."}), 400
+
+    tasks, error_message = batch_map_tasks(
+        dataset, params.get('start_date'), params.get('end_date'), batch_employee_names(params),
+        params.get('split') or 'day'
+    )
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    if not tasks:
+        return jsonify({'error': 'No data for the selected dates and employees.'}), 400
+
+    render = partial(
+        render_batch_map, render_mode=render_mode,
+        route_day_layers=str(params.get('route_day_layers', ROUTE_DAY_LAYERS)).lower() in ('1', 'true', 'yes'),
+        verification=str(params.get('verification', '')).lower() in ('1', 'true', 'yes'),
+    )
+    return Response(
+        export_zip(dataset, tasks, render, export_id=params.get('export_id')),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=employee_route_maps.zip'}
+    )
+
+@app.route('/api/batch_maps/progress', methods=['GET'])
+def api_batch_maps_progress():
+    """Progress of a batch export: total maps, done, written (non-empty), failed and finished."""
+    progress = get_progress(request.args.get('export_id'))
+    if progress is None:
+        return jsonify({'error': 'Unknown export.'}), 404
+    return jsonify(progress), 200
+
+
+def distance_report(dataset, start_date_str, end_date_str, employee_name):
+    """
+    Per-employee, per-day route kilometres for the same filters as the map,
+    read from the per-day summaries computed at upload without building any
+    map objects. Returns (report DataFrame, error_message).
+    """
+    start_date_filter_dt, end_date_filter_dt, error_message = parse_date_filters(start_date_str, end_date_str)
+    if error_message:
+        return None, error_message
+
+    selection = dataset.select(start_date_filter_dt, end_date_filter_dt, employee_name)
+    _, per_day = selection_route_totals(dataset, selection)
+
+    # Routes are split at day boundaries, so the column is named for what it holds
+    report = per_day[['employee', 'date', 'points', 'km']].rename(columns={'km': 'day_km'})
+    report['date'] = report['date'].dt.strftime('%Y-%m-%d')
+    report['day_km'] = report['day_km'].round(3)
+    return report, None
+
+def format_distance_report(report, output_format):
+    """
+    Render a distance report as CSV text or a JSON-serializable dict with
+    per-employee totals. A total is the sum of the employee's per-day route
+    distances (the travel between one day's last punch and the next day's
+    first is not part of any day), hence sum_of_day_km.
+    """
+    if output_format == 'csv':
+        return report.to_csv(index=False)
+    totals = report.groupby('employee', sort=False)['day_km'].sum().round(3)
+    return {
+        'days': report.astype(object).to_dict('records'),
+        'totals': [{'employee': emp, 'sum_of_day_km': float(km)} for emp, km in totals.items()],
+    }
+
+def daily_summary_report(dataset, start_date_str, end_date_str, employee_name):
+    """
+    The per-day summaries (first and last punch, punches, visits, distinct
+    outlets, kilometres and active hours) for the same filters as the map.
+    Returns (report DataFrame, error_message).
+    """
+    start_date_filter_dt, end_date_filter_dt, error_message = parse_date_filters(start_date_str, end_date_str)
+    if error_message:
+        return None, error_message
+
+    selection = dataset.select(start_date_filter_dt, end_date_filter_dt, employee_name)
+    per_day = dataset.daily_in_selection(selection)
+    report = per_day[['employee', 'date', 'first_punch', 'last_punch', 'punches', 'visits', 'unique_outlets',
+                      'km', 'active_hours']].copy()
+    report['date'] = report['date'].dt.strftime('%Y-%m-%d')
+    report['first_punch'] = format_datetimes(report['first_punch'].to_numpy())
+    report['last_punch'] = format_datetimes(report['last_punch'].to_numpy())
+    report['km'] = report['km'].round(3)
+    report['active_hours'] = report['active_hours'].round(2)
+    return report, None
+
+@app.route('/api/daily_summaries', methods=['GET', 'POST'])
+def api_daily_summaries():
+    """
+    Per-employee, per-day summaries as JSON (default) or CSV (format=csv),
+    with the same filters as /api/distances.
+    """
+    params = request.get_json(silent=True) or request.args
+    dataset, error_message = get_dataset(params.get('dataset_id'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+
+    report, error_message = daily_summary_report(
+        dataset, params.get('start_date'), params.get('end_date'), params.get('employee_name')
+    )
+    if error_message:
+        return jsonify({'error': error_message}), 400
+
+    if params.get('format', 'json') == 'csv':
+        return Response(
+            report.to_csv(index=False),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=daily_summaries.csv'}
+        )
+    return jsonify({'days': report.astype(object).to_dict('records')}), 200
+
+@app.route('/api/distances', methods=['GET', 'POST'])
+def api_distances():
+    """
+    Per-employee, per-day route kilometres (day_km) as JSON (default) or CSV
+    (format=csv); the JSON totals are their sums per employee (sum_of_day_km).
+    Takes the same dataset_id/start_date/end_date/employee_name filters as
+    /get_map, as query parameters or a JSON body.
+    """
+    params = request.get_json(silent=True) or request.args
+    dataset, error_message = get_dataset(params.get('dataset_id'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+
+    report, error_message = distance_report(
+        dataset, params.get('start_date'), params.get('end_date'), params.get('employee_name')
+    )
+    if error_message:
+        return jsonify({'error': error_message}), 400
+
+    output_format = params.get('format', 'json')
+    if output_format == 'csv':
+        return Response(
+            format_distance_report(report, 'csv'),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=employee_distances.csv'}
+        )
+    return jsonify(format_distance_report(report, 'json')), 200
+
+@app.route('/api/outlets', methods=['GET'])
+def api_outlets():
+    """The outlet master built from all uploads, as JSON (default) or CSV (format=csv)."""
+    master = load_outlet_master().reset_index()
+    for col in ('first_seen', 'last_seen'):
+        master[col] = pd.to_datetime(master[col]).dt.strftime('%Y-%m-%d')
+    if request.args.get('format', 'json') == 'csv':
+        return Response(
+            master.to_csv(index=False),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=outlet_master.csv'}
+        )
+    return jsonify({'outlets': master.astype(object).where(master.notna(), None).to_dict('records')}), 200
+
+@app.route('/api/points', methods=['GET', 'POST'])
+def api_points():
+    """
+    Points inside a viewport for the live map. Takes bbox=west,south,east,north
+    and zoom plus the same dataset_id/start_date/end_date/employee_name
+    filters as /get_map, as query parameters or a JSON body. Zoomed out (or
+    when the viewport holds too many points) the points come back as grid
+    clusters with counts instead.
+    """
+    params = request.get_json(silent=True) or request.args
+    dataset, error_message = get_dataset(params.get('dataset_id'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+
+    start_date_filter_dt, end_date_filter_dt, error_message = parse_date_filters(params.get('start_date'), params.get('end_date'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    bbox, error_message = parse_bbox(params.get('bbox'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    zoom, error_message = parse_zoom(params.get('zoom'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+
+    selection = dataset.select(start_date_filter_dt, end_date_filter_dt, params.get('employee_name'))
+    return jsonify(viewport_points(dataset, selection, bbox, zoom)), 200
+
+SPATIAL_KINDS = ('punch', 'visit')
+# Most points listed in one spatial query response (the totals cover all matches)
+SPATIAL_RESULT_LIMIT = int(os.getenv('SPATIAL_RESULT_LIMIT', 1000))
+
+def parse_number(params, name, required=True, default=None):
+    """Read a float parameter. Returns (value, error_message)."""
+    value = params.get(name)
+    if value in (None, ''):
+        if required:
+            return None, f"Missing parameter '{name}'."
+        return default, None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None, f"Invalid parameter '{name}'. Expected a number."
+    if not np.isfinite(number):
+        return None, f"Invalid parameter '{name}'. Expected a number."
+    return number, None
+
+def spatial_request(params):
+    """
+    Common part of the spatial query endpoints: the dataset, which location
+    to query (kind=punch|visit, default punch) and the optional
+    start_date/end_date/employee_name filters as a selection (None when
+    unfiltered). Returns (dataset, kind, selection, error_message).
+    """
+    dataset, error_message = get_dataset(params.get('dataset_id'))
+    if error_message:
+        return None, None, None, error_message
+    kind = params.get('kind') or 'punch'
+    if kind not in SPATIAL_KINDS:
+        return None, None, None, f"Invalid kind '{kind}'. Use one of: {', '.join(SPATIAL_KINDS)}."
+
+    start_date_str, end_date_str, employee_name = params.get('start_date'), params.get('end_date'), params.get('employee_name')
+    selection = None
+    if start_date_str or end_date_str or employee_name:
+        start_date_filter_dt, end_date_filter_dt, error_message = parse_date_filters(start_date_str, end_date_str)
+        if error_message:
+            return None, None, None, error_message
+        selection = dataset.select(start_date_filter_dt, end_date_filter_dt, employee_name)
+    return dataset, kind, selection, None
+
+def spatial_results(dataset, kind, rows, distances=None, limit=SPATIAL_RESULT_LIMIT):
+    """
+    JSON body for spatial query results: the match count, the matches per
+    employee and the first `limit` matching points.
+    """
+    columns = dataset.columns
+    codes, counts = np.unique(dataset.codes[rows], return_counts=True)
+    shown = rows[:limit]
+    lat = dataset.punch_lat if kind == 'punch' else dataset.visit_lat
+    lon = dataset.punch_lon if kind == 'punch' else dataset.visit_lon
+
+    points = pd.DataFrame({
+        'employee': dataset.employees[dataset.codes[shown]],
+        'punch_in_time': format_datetimes(dataset.punch_time[shown]),
+        'lat': lat[shown].round(6),
+        'lon': lon[shown].round(6),
+    })
+    for key, name in (('outlet_name_col', 'outlet_name'), ('outlet_id_col', 'outlet_id')):
+        if columns.get(key):
+            points[name] = dataset.frame[columns[key]].take(shown).astype(str).to_numpy()
+    if distances is not None:
+        points['distance_m'] = np.round(distances[:limit], 1)
+
+    return {
+        'total': int(len(rows)),
+        'employees': [
+            {'employee': emp, 'count': int(count)}
+            for emp, count in zip(dataset.employees[codes], counts)
+        ],
+        'points': points.to_dict('records'),
+    }
+
+def spatial_response(dataset, kind, selection, rows, distances=None):
+    """Drop rows outside the selection and render the results as JSON."""
+    if selection is not None:
+        keep = dataset.in_selection(rows, selection)
+        rows = rows[keep]
+        distances = distances[keep] if distances is not None else None
+    return jsonify(spatial_results(dataset, kind, rows, distances)), 200
+
+@app.route('/api/spatial/bbox', methods=['GET', 'POST'])
+def api_spatial_bbox():
+    """Punch-in (kind=punch) or visit (kind=visit) points inside bbox=west,south,east,north."""
+    params = request.get_json(silent=True) or request.args
+    dataset, kind, selection, error_message = spatial_request(params)
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    bbox, error_message = parse_bbox(params.get('bbox'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    return spatial_response(dataset, kind, selection, np.sort(dataset.spatial[kind].bbox(*bbox)))
+
+@app.route('/api/spatial/radius', methods=['GET', 'POST'])
+def api_spatial_radius():
+    """Points within radius_m metres of lat/lon, nearest first, e.g. who punched in within 200 m of an outlet."""
+    params = request.get_json(silent=True) or request.args
+    dataset, kind, selection, error_message = spatial_request(params)
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    values = {}
+    for name in ('lat', 'lon', 'radius_m'):
+        values[name], error_message = parse_number(params, name)
+        if error_message:
+            return jsonify({'error': error_message}), 400
+    rows, distances = dataset.spatial[kind].radius(values['lat'], values['lon'], values['radius_m'])
+    return spatial_response(dataset, kind, selection, rows, distances)
+
+@app.route('/api/spatial/nearest', methods=['GET', 'POST'])
+def api_spatial_nearest():
+    """The k points nearest to lat/lon (default 10), optionally no farther than radius_m metres."""
+    params = request.get_json(silent=True) or request.args
+    dataset, kind, selection, error_message = spatial_request(params)
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    values = {}
+    for name, required, default in (('lat', True, None), ('lon', True, None), ('k', False, 10), ('radius_m', False, None)):
+        values[name], error_message = parse_number(params, name, required, default)
+        if error_message:
+            return jsonify({'error': error_message}), 400
+    k = int(values['k'])
+    if k < 1:
+        return jsonify({'error': "Invalid parameter 'k'. Expected a positive number."}), 400
+
+    where = (lambda rows: dataset.in_selection(rows, selection)) if selection is not None else None
+    rows, distances = dataset.spatial[kind].nearest(values['lat'], values['lon'], k, values['radius_m'], where)
+    return spatial_response(dataset, kind, None, rows, distances)
+
+@app.route('/api/spatial/polygon', methods=['POST'])
+def api_spatial_polygon():
+    """Points inside polygon, a JSON list of at least three [lat, lon] vertices."""
+    params = request.get_json(silent=True) or {}
+    dataset, kind, selection, error_message = spatial_request(params)
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    try:
+        vertices = np.asarray(params.get('polygon'), dtype=np.float64)
+    except (TypeError, ValueError):
+        vertices = None
+    if vertices is None or vertices.ndim != 2 or vertices.shape[1] != 2 or len(vertices) < 3 or not np.isfinite(vertices).all():
+        return jsonify({'error': "Invalid polygon. Use a list of at least three [lat, lon] vertices."}), 400
+    return spatial_response(dataset, kind, selection, np.sort(dataset.spatial[kind].polygon(vertices)))
+
+def parse_outlet_locations(data):
+    """
+    Outlet reference locations from an uploaded outlet master file (columns
+    like "Outlet ID", "Latitude", "Longitude"). Returns (DataFrame of
+    outlet_id, lat, lon, error_message).
+    """
+    data.columns = data.columns.astype(str)
+    id_col = find_column(data, ["outlet id", "outlet_id", "id"])
+    lat_col = find_column(data, ["latitude", "lat"])
+    lon_col = find_column(data, ["longitude", "long", "lon", "lng"])
+    if id_col is None or lat_col is None or lon_col is None:
+        return None, f"Outlet locations need outlet ID, latitude and longitude columns. Detected: {data.columns.tolist()}"
+    locations = pd.DataFrame({
+        'outlet_id': normalize_outlet_ids(data[id_col]),
+        'lat': pd.to_numeric(data[lat_col], errors='coerce'),
+        'lon': pd.to_numeric(data[lon_col], errors='coerce'),
+    }).dropna()
+    if locations.empty:
+        return None, 'No outlet with a valid location found in the file.'
+    # The last row wins if an outlet is listed more than once
+    return locations.drop_duplicates('outlet_id', keep='last'), None
+
+@app.route('/upload_outlet_locations', methods=['POST'])
+def upload_outlet_locations():
+    """Replace the outlet reference locations used for visit verification."""
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    data = read_data_file(file, file.filename)
+    if data is None:
+        return jsonify({'error': 'Unsupported file type. Please upload a CSV or Excel file.'}), 400
+    locations, error_message = parse_outlet_locations(data)
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    save_outlet_locations(locations)
+    return jsonify({'message': f'Saved locations of {len(locations)} outlets.', 'outlets': len(locations)}), 200
+
+def verification_report(dataset, start_date_str, end_date_str, employee_name, radius_m=GEOFENCE_RADIUS_M, flagged_only=False):
+    """
+    Distance of every selected visit to its outlet's reference location and
+    whether it lies within radius_m metres (see verification.verify_visits).
+    Returns (report DataFrame, error_message).
+    """
+    start_date_filter_dt, end_date_filter_dt, error_message = parse_date_filters(start_date_str, end_date_str)
+    if error_message:
+        return None, error_message
+
+    selection = dataset.select(start_date_filter_dt, end_date_filter_dt, employee_name)
+    report = verify_visits(
+        dataset, Dataset.row_index(selection), radius_m, load_outlet_locations(), load_outlet_master()
+    )
+    report = report.drop(columns='row')
+    if flagged_only:
+        report = report[report['status'] != 'within']
+    return report, None
+
+def format_verification_report(report, output_format):
+    """Render a verification report as CSV text or a JSON-serializable dict with status counts."""
+    if output_format == 'csv':
+        return report.to_csv(index=False)
+    return {
+        'summary': verification_summary(report),
+        'visits': report.astype(object).where(report.notna(), None).to_dict('records'),
+    }
+
+@app.route('/api/visit_verification', methods=['GET', 'POST'])
+def api_visit_verification():
+    """
+    Geofence check of visits as JSON (default) or CSV (format=csv). Takes the
+    same filters as /get_map plus radius_m (default GEOFENCE_RADIUS_M) and
+    flagged_only, which leaves out the visits within the radius.
+    """
+    params = request.get_json(silent=True) or request.args
+    dataset, error_message = get_dataset(params.get('dataset_id'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    radius_m, error_message = parse_number(params, 'radius_m', required=False, default=GEOFENCE_RADIUS_M)
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    flagged_only = str(params.get('flagged_only', '')).lower() in ('1', 'true', 'yes')
+
+    report, error_message = verification_report(
+        dataset, params.get('start_date'), params.get('end_date'), params.get('employee_name'), radius_m, flagged_only
+    )
+    if error_message:
+        return jsonify({'error': error_message}), 400
+
+    if params.get('format', 'json') == 'csv':
+        return Response(
+            format_verification_report(report, 'csv'),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=visit_verification.csv'}
+        )
+    return jsonify(format_verification_report(report, 'json')), 200
+
+def stays_report(dataset, start_date_str, end_date_str, employee_name, radius_m=STAY_RADIUS_M, min_minutes=STAY_MIN_MINUTES):
+    """
+    Stay points (where and how long employees stayed) for the same filters as
+    the map, see staypoints.selection_stays. Returns (report DataFrame, error_message).
+    """
+    start_date_filter_dt, end_date_filter_dt, error_message = parse_date_filters(start_date_str, end_date_str)
+    if error_message:
+        return None, error_message
+
+    selection = dataset.select(start_date_filter_dt, end_date_filter_dt, employee_name)
+    return selection_stays(dataset, selection, radius_m, min_minutes * 60), None
+
+def format_stays_report(report, output_format):
+    """Render a stays report as CSV text or a JSON-serializable dict with per-employee dwell totals."""
+    if output_format == 'csv':
+        return report.to_csv(index=False)
+    totals = report.groupby('employee', sort=False)['duration_min'].agg(['size', 'sum'])
+    return {
+        'stays': report.astype(object).where(report.notna(), None).to_dict('records'),
+        'totals': [
+            {'employee': emp, 'stays': int(row['size']), 'minutes': round(float(row['sum']), 1)}
+            for emp, row in totals.iterrows()
+        ],
+    }
+
+@app.route('/api/stays', methods=['GET', 'POST'])
+def api_stays():
+    """
+    Stay points as JSON (default) or CSV (format=csv). Takes the same filters
+    as /get_map plus radius_m and min_minutes (defaults STAY_RADIUS_M and
+    STAY_MIN_MINUTES).
+    """
+    params = request.get_json(silent=True) or request.args
+    dataset, error_message = get_dataset(params.get('dataset_id'))
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    radius_m, error_message = parse_number(params, 'radius_m', required=False, default=STAY_RADIUS_M)
+    if error_message:
+        return jsonify({'error': error_message}), 400
+    min_minutes, error_message = parse_number(params, 'min_minutes', required=False, default=STAY_MIN_MINUTES)
+    if error_message:
+        return jsonify({'error': error_message}), 400
+
+    report, error_message = stays_report(
+        dataset, params.get('start_date'), params.get('end_date'), params.get('employee_name'), radius_m, min_minutes
+    )
+    if error_message:
+        return jsonify({'error': error_message}), 400
+
+    if params.get('format', 'json') == 'csv':
+        return Response(
+            format_stays_report(report, 'csv'),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=employee_stays.csv'}
+        )
+    return jsonify(format_stays_report(report, 'json')), 200
+
+@app.cli.command('distances')
+@click.argument('data_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--start-date', default='', help='First punch-in date to include (YYYY-MM-DD).')
+@click.option('--end-date', default='', help='Last punch-in date to include (YYYY-MM-DD).')
+@click.option('--employee', default='', help='Only report this employee.')
+@click.option('--format', 'output_format', type=click.Choice(['csv', 'json']), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.File('w'), default='-', help='Output file (default: stdout).')
+def distances_command(data_file, start_date, end_date, employee, output_format, output):
+    """Write per-employee, per-day route kilometres for DATA_FILE without rendering a map."""
+    with open(data_file, 'rb') as f:
+        dataset, error_message = load_dataset_file_cached(f, data_file)
+    if error_message:
+        raise click.ClickException(error_message)
+
+    report, error_message = distance_report(dataset, start_date, end_date, employee)
+    if error_message:
+        raise click.ClickException(error_message)
+
+    formatted = format_distance_report(report, output_format)
+    if output_format == 'json':
+        formatted = json.dumps(formatted, indent=2)
+    output.write(formatted)
+
+@app.cli.command('verify-visits')
+@click.argument('data_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--start-date', default='', help='First punch-in date to include (YYYY-MM-DD).')
+@click.option('--end-date', default='', help='Last punch-in date to include (YYYY-MM-DD).')
+@click.option('--employee', default='', help='Only report this employee.')
+@click.option('--radius', 'radius_m', type=float, default=GEOFENCE_RADIUS_M, show_default=True, help='Geofence radius in metres.')
+@click.option('--flagged-only', is_flag=True, help='Leave out visits within the radius.')
+@click.option('--format', 'output_format', type=click.Choice(['csv', 'json']), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.File('w'), default='-', help='Output file (default: stdout).')
+def verify_visits_command(data_file, start_date, end_date, employee, radius_m, flagged_only, output_format, output):
+    """Write the distance of each visit in DATA_FILE to its outlet and flag visits outside the geofence."""
+    with open(data_file, 'rb') as f:
+        dataset, error_message = load_dataset_file_cached(f, data_file)
+    if error_message:
+        raise click.ClickException(error_message)
+
+    report, error_message = verification_report(dataset, start_date, end_date, employee, radius_m, flagged_only)
+    if error_message:
+        raise click.ClickException(error_message)
+
+    formatted = format_verification_report(report, output_format)
+    if output_format == 'json':
+        formatted = json.dumps(formatted, indent=2)
+    output.write(formatted)
+
+@app.cli.command('stays')
+@click.argument('data_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--start-date', default='', help='First punch-in date to include (YYYY-MM-DD).')
+@click.option('--end-date', default='', help='Last punch-in date to include (YYYY-MM-DD).')
+@click.option('--employee', default='', help='Only report this employee.')
+@click.option('--radius', 'radius_m', type=float, default=STAY_RADIUS_M, show_default=True, help='Stay radius in metres.')
+@click.option('--min-minutes', type=float, default=STAY_MIN_MINUTES, show_default=True, help='Shortest stay to report.')
+@click.option('--format', 'output_format', type=click.Choice(['csv', 'json']), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.File('w'), default='-', help='Output file (default: stdout).')
+def stays_command(data_file, start_date, end_date, employee, radius_m, min_minutes, output_format, output):
+    """Write the stay points (start, end, duration, centroid) of each employee in DATA_FILE."""
+    with open(data_file, 'rb') as f:
+        dataset, error_message = load_dataset_file_cached(f, data_file)
+    if error_message:
+        raise click.ClickException(error_message)
+
+    report, error_message = stays_report(dataset, start_date, end_date, employee, radius_m, min_minutes)
+    if error_message:
+        raise click.ClickException(error_message)
+
+    formatted = format_stays_report(report, output_format)
+    if output_format == 'json':
+        formatted = json.dumps(formatted, indent=2)
+    output.write(formatted)
+
+@app.cli.command('export-maps')
+@click.argument('data_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--start-date', default='', help='First punch-in date to include (YYYY-MM-DD).')
+@click.option('--end-date', default='', help='Last punch-in date to include (YYYY-MM-DD).')
+@click.option('--employee', 'employees', multiple=True, help='Only export this employee (repeatable).')
+@click.option('--split', type=click.Choice(BATCH_SPLITS), default='day', show_default=True,
+              help='One map per employee and day, or per employee.')
+@click.option('--render-mode', type=click.Choice(RENDER_MODES), default=MAP_RENDER_MODE, show_default=True)
+@click.option('--workers', type=int, default=BATCH_EXPORT_WORKERS, show_default=True, help='Rendering processes.')
+@click.option('--output', '-o', type=click.File('wb'), required=True, help='ZIP file to write.')
+def export_maps_command(data_file, start_date, end_date, employees, split, render_mode, workers, output):
+    """Write a ZIP of route maps for DATA_FILE, one HTML file per employee and day."""
+    with open(data_file, 'rb') as f:
+        dataset, error_message = load_dataset_file_cached(f, data_file)
+    if error_message:
+        raise click.ClickException(error_message)
+
+    tasks, error_message = batch_map_tasks(dataset, start_date, end_date, list(employees), split)
+    if error_message:
+        raise click.ClickException(error_message)
+    if not tasks:
+        raise click.ClickException('No data for the selected dates and employees.')
+
+    render = partial(render_batch_map, render_mode=render_mode)
+    with click.progressbar(length=len(tasks), label='Rendering maps', file=sys.stderr) as bar:
+        # One chunk per finished map, then the end of the archive
+        for i, chunk in enumerate(export_zip(dataset, tasks, render, workers)):
+            output.write(chunk)
+            if i < len(tasks):
+                bar.update(1)
+
 
 if __name__ == '__main__':
     # Create a 'static' directory if it doesn't exist
@@ -0,0 +1,191 @@
+import io
+import json
+import os
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dataset_cache import DATASET_CACHE_DIR, cache_path, load_cached_dataset
+from file_lock import replace_file
+
+# Processes rendering maps for one batch export (default: one per CPU)
+BATCH_EXPORT_WORKERS = int(os.getenv('BATCH_EXPORT_WORKERS', 0)) or os.cpu_count() or 1
+
+# Progress of the most recent exports, by export ID
+MAX_TRACKED_EXPORTS = 100
+_progress = {}
+_progress_lock = threading.Lock()
+# When each export's progress was last written to its file
+_saved = {}
+
+# Progress is also written here, one JSON file per export, so a poll routed
+# to another worker process finds it. Empty: progress is only known to the
+# process running the export.
+EXPORT_PROGRESS_DIR = os.getenv(
+    'EXPORT_PROGRESS_DIR', os.path.join(DATASET_CACHE_DIR, 'exports') if DATASET_CACHE_DIR else ''
+)
+
+# Progress files are rewritten at most this often while an export runs (in
+# seconds), and removed this long after they were last written
+EXPORT_PROGRESS_INTERVAL = 0.5
+EXPORT_PROGRESS_TTL = 3600
+
+# Export IDs are chosen by the client; only these are used in file names
+_EXPORT_ID_PATTERN = re.compile(r'[0-9A-Za-z_-]{1,64}')
+
+# The dataset a pool worker renders from, set once per process
+_worker = {'dataset': None}
+
+
+def _init_worker(dataset_id, dataset):
+    # Cached datasets are memory-mapped from disk, so workers share their pages
+    _worker['dataset'] = dataset if dataset is not None else load_cached_dataset(dataset_id)
+
+
+def _run_task(render, task):
+    return render(_worker['dataset'], task)
+
+
+def _progress_path(export_id):
+    if not EXPORT_PROGRESS_DIR or not isinstance(export_id, str) or not _EXPORT_ID_PATTERN.fullmatch(export_id):
+        return None
+    return os.path.join(EXPORT_PROGRESS_DIR, export_id + '.json')
+
+
+def set_progress(export_id, **fields):
+    if not export_id:
+        return
+    with _progress_lock:
+        entry = _progress.pop(export_id, None)
+        if entry is None:
+            entry = {'total': 0, 'done': 0, 'written': 0, 'failed': 0, 'finished': False}
+            _saved.pop(export_id, None)
+            _expire_progress_files()
+        entry.update(fields)
+        _progress[export_id] = entry
+        while len(_progress) > MAX_TRACKED_EXPORTS:
+            _saved.pop(next(iter(_progress)), None)
+            del _progress[next(iter(_progress))]
+        # The first and last updates are always written, others at most every EXPORT_PROGRESS_INTERVAL
+        now = time.time()
+        if export_id in _saved and now - _saved[export_id] < EXPORT_PROGRESS_INTERVAL and not entry['finished']:
+            return
+        _saved[export_id] = now
+        state = dict(entry)
+    path = _progress_path(export_id)
+    if path:
+        try:
+            os.makedirs(EXPORT_PROGRESS_DIR, exist_ok=True)
+            replace_file(path, lambda f: json.dump(state, f))
+        except OSError as e:
+            print(f"Could not write the progress of export {export_id}: {e}")
+
+
+def get_progress(export_id):
+    """{'total', 'done', 'written', 'failed', 'finished'} for an export, or None if unknown."""
+    with _progress_lock:
+        entry = _progress.get(export_id)
+        if entry is not None:
+            return dict(entry)
+    path = _progress_path(export_id)
+    if not path:
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _expire_progress_files():
+    if not EXPORT_PROGRESS_DIR:
+        return
+    cutoff = time.time() - EXPORT_PROGRESS_TTL
+    try:
+        names = os.listdir(EXPORT_PROGRESS_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(EXPORT_PROGRESS_DIR, name)
+        try:
+            if name.endswith('.json') and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            continue
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only stream collecting what zipfile writes, to be sent as it is produced."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def render_tasks(dataset, tasks, render, workers=None):
+    """
+    Yield (task, result) for render(dataset, task) over all tasks, in
+    completion order. With more than one worker the tasks are fanned out
+    over a process pool; each worker loads the dataset once (from the
+    dataset cache when it is there, so nothing large is pickled).
+    """
+    workers = min(workers or BATCH_EXPORT_WORKERS, len(tasks))
+    if workers <= 1:
+        for task in tasks:
+            yield task, render(dataset, task)
+        return
+
+    on_disk = bool(DATASET_CACHE_DIR) and dataset.dataset_id and os.path.isdir(cache_path(dataset.dataset_id))
+    executor = ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker,
+        initargs=(dataset.dataset_id, None if on_disk else dataset),
+    )
+    try:
+        futures = {executor.submit(_run_task, render, task): task for task in tasks}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # Also reached when the client disconnects: queued tasks are dropped
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def export_zip(dataset, tasks, render, workers=None, export_id=None):
+    """
+    Stream a ZIP archive of rendered files: render(dataset, task) returns
+    (file name, text) or None when there is nothing to write for a task.
+    Each file is compressed and yielded as soon as its task finishes, and
+    progress is recorded under export_id (see get_progress).
+    """
+    set_progress(export_id, total=len(tasks), done=0, written=0, failed=0, finished=False)
+    stream = _ZipStream()
+    done = written = failed = 0
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        try:
+            for task, result in render_tasks(dataset, tasks, render, workers):
+                done += 1
+                if result is not None:
+                    name, text = result
+                    archive.writestr(name, text)
+                    written += 1
+                set_progress(export_id, done=done, written=written)
+                yield stream.take()
+        except Exception as e:
+            failed = len(tasks) - done
+            print(f"Batch export {export_id or ''} stopped after {done} of {len(tasks)} files: {e}")
+            archive.writestr('ERROR.txt', f'The export stopped after {done} of {len(tasks)} files: {e}\n')
+    set_progress(export_id, failed=failed, finished=True)
+    yield stream.take()
@@ -0,0 +1,102 @@
+"""
+Compare the two .xlsx ingest paths on synthetic workbooks: pd.read_excel
+(openpyxl, every column) followed by build_dataset, against the streaming
+XlsxReader path (build_dataset_from_xlsx). Each run happens in a fresh
+process so peak memory is measured per path.
+
+    python benchmark_xlsx.py                      # 100k, 500k and 1M rows
+    python benchmark_xlsx.py --rows 100000 --keep
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import openpyxl
+
+# Detected columns plus the kind of extra columns real exports carry
+HEADER = [
+    'Employee Name', 'Employee Code', 'Region', 'Designation', 'Punch In Date', 'Punch In Time',
+    'Punch In Lat', 'Punch In Long', 'Outlet Name', 'Outlet ID', 'Beat Name', 'Visit Date',
+    'Visit Time', 'Visit Lat', 'Visit Long', 'Remarks',
+]
+
+
+def write_workbook(path, rows, seed=0):
+    """A synthetic attendance export: 300 employees, 5,000 outlets, one month."""
+    rng = np.random.default_rng(seed)
+    employees = rng.integers(0, 300, rows)
+    outlets = rng.integers(0, 5000, rows)
+    days = rng.integers(1, 29, rows)
+    seconds = rng.integers(9 * 3600, 19 * 3600, rows)
+    lat = 12 + rng.random(rows)
+    lon = 77 + rng.random(rows)
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADER)
+    for i in range(rows):
+        date = f'{days[i]:02d}-07-2025'
+        s = int(seconds[i])
+        punch_time = f'{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}'
+        visit_s = s + 300
+        visit_time = f'{visit_s // 3600:02d}:{visit_s // 60 % 60:02d}:{visit_s % 60:02d}'
+        sheet.append([
+            f'Emp {employees[i]}', f'E{employees[i]:04d}', 'South', 'Sales Officer', date, punch_time,
+            float(lat[i]), float(lon[i]), f'Outlet {outlets[i]}', f'OUT{outlets[i]:04d}',
+            f'Beat {outlets[i] % 40}', date, visit_time, float(lat[i] + 1e-4), float(lon[i] - 1e-4), 'Visited',
+        ])
+    workbook.save(path)
+
+
+def _run(path, streaming, results):
+    import app
+    app.XLSX_STREAMING = streaming
+    start = time.perf_counter()
+    dataset, error_message = app.load_dataset_file(path, os.path.basename(path))
+    elapsed = time.perf_counter() - start
+    if error_message:
+        raise SystemExit(error_message)
+    # ru_maxrss is in kilobytes on Linux
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, len(dataset)))
+
+
+def measure(path, streaming):
+    """(seconds, peak RSS in MB, rows) of one ingest in a fresh process."""
+    results = multiprocessing.get_context('spawn').Queue()
+    process = multiprocessing.get_context('spawn').Process(target=_run, args=(path, streaming, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 500000, 1000000])
+    parser.add_argument('--dir', default=tempfile.gettempdir(), help='where the workbooks are written')
+    parser.add_argument('--keep', action='store_true', help='keep (and reuse) the generated workbooks')
+    args = parser.parse_args()
+
+    print(f"{'rows':>9} {'MB':>6} {'read_excel s':>13} {'peak MB':>8} {'streaming s':>12} {'peak MB':>8} {'speedup':>8}")
+    for rows in args.rows:
+        path = os.path.join(args.dir, f'benchmark_{rows}.xlsx')
+        if not os.path.exists(path):
+            write_workbook(path, rows)
+        try:
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            pandas_s, pandas_mb, pandas_rows = measure(path, streaming=False)
+            stream_s, stream_mb, stream_rows = measure(path, streaming=True)
+            assert pandas_rows == stream_rows == rows, (pandas_rows, stream_rows, rows)
+            print(f'{rows:>9} {size_mb:>6.1f} {pandas_s:>13.1f} {pandas_mb:>8.0f} {stream_s:>12.1f} {stream_mb:>8.0f} '
+                  f'{pandas_s / stream_s:>7.1f}x')
+        finally:
+            if not args.keep:
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
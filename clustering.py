@@ -0,0 +1,79 @@
+import numpy as np
+
+# Side of a cluster cell in screen pixels
+CLUSTER_CELL_PX = 64
+TILE_SIZE = 256
+MAX_MERCATOR_LAT = 85.0511287798
+MAX_ZOOM = 22
+
+
+def mercator_pixels(lat, lon, zoom):
+    """Web Mercator pixel coordinates of points at a zoom level (as used by Leaflet tiles)."""
+    scale = TILE_SIZE * 2.0 ** zoom
+    lat = np.radians(np.clip(lat, -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT))
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * scale
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * scale
+    return x, y
+
+
+def _aggregate(cells, lat_sum, lon_sum, counts, visits):
+    """Sum the per-item totals of equal cells. Returns the distinct cells and their totals."""
+    cells, ids = np.unique(cells, return_inverse=True)
+    return (
+        cells,
+        np.bincount(ids, weights=lat_sum),
+        np.bincount(ids, weights=lon_sum),
+        np.bincount(ids, weights=counts).astype(np.int64),
+        np.bincount(ids, weights=visits).astype(np.int64),
+    )
+
+
+def _columns(lat_sum, lon_sum, counts, visits):
+    return {
+        'lat': np.round(lat_sum / counts, 5).tolist(),
+        'lon': np.round(lon_sum / counts, 5).tolist(),
+        'count': counts.tolist(),
+        'punch': (counts - visits).tolist(),
+        'visit': visits.tolist(),
+    }
+
+
+def _cell_keys(lat, lon, zoom):
+    x, y = mercator_pixels(lat, lon, zoom)
+    return (x // CLUSTER_CELL_PX).astype(np.int64) << 32 | (y // CLUSTER_CELL_PX).astype(np.int64)
+
+
+def grid_clusters(lat, lon, is_visit, zoom):
+    """
+    Aggregate points into CLUSTER_CELL_PX square screen cells at one zoom level.
+    Each cluster is placed at the mean position of its points and carries the
+    number of punch-in and visit points in it. Returns a columnar dict with
+    lat, lon, count, punch and visit lists.
+    """
+    is_visit = np.asarray(is_visit, dtype=np.float64)
+    _, lat_sum, lon_sum, counts, visits = _aggregate(
+        _cell_keys(lat, lon, zoom), lat, lon, np.ones(len(lat)), is_visit
+    )
+    return _columns(lat_sum, lon_sum, counts, visits)
+
+
+def cluster_pyramid(lat, lon, is_visit, max_zoom):
+    """
+    Grid clusters for every zoom level from 0 to max_zoom, as a list indexed
+    by zoom (see grid_clusters).
+
+    Only the finest level is binned from the points. Cells have a fixed size
+    in pixels and every zoom level halves the pixel coordinates, so each
+    coarser level is built by merging the cells of the level below in 2x2
+    blocks, which costs a fraction of re-binning all points per level.
+    """
+    is_visit = np.asarray(is_visit, dtype=np.float64)
+    cells, lat_sum, lon_sum, counts, visits = _aggregate(
+        _cell_keys(lat, lon, max_zoom), lat, lon, np.ones(len(lat)), is_visit
+    )
+    levels = [_columns(lat_sum, lon_sum, counts, visits)]
+    for _ in range(max_zoom):
+        parents = (cells >> 33) << 32 | (cells & 0xFFFFFFFF) >> 1
+        cells, lat_sum, lon_sum, counts, visits = _aggregate(parents, lat_sum, lon_sum, counts, visits)
+        levels.append(_columns(lat_sum, lon_sum, counts, visits))
+    return levels[::-1]
@@ -0,0 +1,580 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from distance import SECONDS_PER_DAY, daily_route_totals
+from spatial_index import GridIndex
+
+# Format that parse_datetime_columns writes the punch-in column in
+PUNCH_TIME_FORMAT = '%d-%m-%Y %H:%M:%S'
+
+# Names of the native datetime64 columns kept alongside the display strings
+PARSED_TIME_COL = 'ParsedPunchInTime'
+PARSED_VISIT_TIME_COL = 'ParsedVisitTime'
+
+# Bumped whenever the on-disk layout written by Dataset.save changes, or the
+# column roles it records are detected differently (or which rows are kept)
+STORAGE_FORMAT_VERSION = 6
+MANIFEST_FILE = 'manifest.json'
+
+# The sort key packs the employee code into the high bits and the punch-in
+# epoch second into the low 34 bits (enough for dates up to the year 2514).
+_TIME_BITS = 34
+_TIME_MASK = (1 << _TIME_BITS) - 1
+
+
+def _digits(out, start, values, width):
+    """Write zero-padded decimal digits of values into out[:, start:start + width]."""
+    for i in range(width - 1, -1, -1):
+        out[:, start + i] = values % 10 + ord('0')
+        values = values // 10
+
+
+def format_datetimes(values, missing='', with_time=True):
+    """
+    Format datetime64 values as 'DD-MM-YYYY HH:MM:SS' (or 'DD-MM-YYYY'
+    without the time) in one vectorized pass. Equivalent to
+    Series.dt.strftime(PUNCH_TIME_FORMAT) but several times faster, since
+    the digits are computed with integer arithmetic on whole arrays and each
+    distinct value is only turned into a string once.
+    """
+    values = np.asarray(values, dtype='datetime64[s]')
+    if not with_time:
+        values = values.astype('datetime64[D]').astype('datetime64[s]')
+    codes, uniques = pd.factorize(values.view(np.int64), use_na_sentinel=False)
+    uniques = uniques.view('datetime64[s]')
+    nat = np.isnat(uniques)
+    uniques = np.where(nat, np.datetime64(0, 's'), uniques)
+
+    # Calendar fields only need computing once per distinct day
+    seconds = uniques.astype(np.int64)
+    day_codes, days = pd.factorize(seconds // 86400)
+    days = days.astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    years = days.astype('datetime64[Y]')
+    date_digits = np.empty((len(days), 10), dtype=np.uint8)
+    _digits(date_digits, 0, (days - months).astype(np.int64) + 1, 2)
+    _digits(date_digits, 3, (months - years).astype(np.int64) + 1, 2)
+    _digits(date_digits, 6, years.astype(np.int64) + 1970, 4)
+    date_digits[:, [2, 5]] = ord('-')
+
+    width = 19 if with_time else 10
+    out = np.empty((len(uniques), width), dtype=np.uint8)
+    out[:, :10] = date_digits[day_codes]
+    if with_time:
+        seconds = seconds % 86400
+        _digits(out, 11, seconds // 3600, 2)
+        _digits(out, 14, seconds // 60 % 60, 2)
+        _digits(out, 17, seconds % 60, 2)
+        out[:, 10] = ord(' ')
+        out[:, [13, 16]] = ord(':')
+
+    formatted = out.view(f'S{width}').ravel().astype(f'U{width}').astype(object)
+    formatted[nat] = missing
+    return formatted.take(codes)
+
+
+def normalize_outlet_ids(values):
+    """
+    Outlet IDs as text, with integral numbers written without a decimal part,
+    so an ID read as a float (12.0, from a numeric column with blanks)
+    matches the same ID read as an integer or text ('12'). Missing IDs stay
+    missing (None). Each distinct value is converted once.
+    """
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    text = pd.Index(uniques, dtype=object).astype(str).str.strip().str.replace(r'^(-?\d+)\.0*$', r'\1', regex=True)
+    return pd.Series(np.append(text.to_numpy(dtype=object), None)[codes], index=values.index, dtype=object)
+
+
+def concat_chunks(chunks):
+    """
+    Concatenate DataFrame chunks read from one file. Categorical columns are
+    merged with union_categoricals, since pd.concat would fall back to object
+    dtype whenever the chunks saw different categories.
+    """
+    if len(chunks) == 1:
+        return chunks[0]
+    combined = pd.concat(chunks, ignore_index=True)
+    for col in chunks[0].columns:
+        if isinstance(chunks[0][col].dtype, pd.CategoricalDtype):
+            combined[col] = union_categoricals([chunk[col] for chunk in chunks])
+    return combined
+
+
+def _epoch_seconds(value):
+    """
+    Convert a date/datetime/Timestamp to int64 epoch seconds. Read at second
+    resolution, so dates beyond the nanosecond range (1677-2262) convert too.
+    """
+    return int(pd.Timestamp(value).asm8.astype('datetime64[s]').astype(np.int64))
+
+
+class Dataset:
+    """
+    Columnar, pre-indexed view of an uploaded punch/visit file.
+
+    Rows are parsed once at ingest, sorted by (employee, punch-in time) and
+    indexed so that employee and date-range filters become binary searches
+    returning contiguous row ranges instead of boolean masks over the frame.
+    Rows without an employee name or a parseable punch-in time are dropped,
+    since no map or report can place them, and so are rows whose punch-in
+    time falls outside the range of the sort key.
+    """
+
+    def __init__(self, data, columns):
+        self.columns = dict(columns)
+        name_col = columns['name_col']
+        time_col = columns['punch_in_time_col']
+
+        if PARSED_TIME_COL in data.columns:
+            punch_time = data[PARSED_TIME_COL]
+        else:
+            punch_time = pd.to_datetime(data[time_col], format=PUNCH_TIME_FORMAT, errors='coerce')
+        # The sort key only holds times from 1970 to 2514 (see _TIME_BITS); a
+        # time outside would wrap around and land in the wrong place
+        in_range = punch_time.between(pd.Timestamp(0, unit='s'), pd.Timestamp(_TIME_MASK, unit='s')).to_numpy()
+        out_of_range = int((punch_time.notna().to_numpy() & ~in_range).sum())
+        if out_of_range:
+            print(f"Dropping {out_of_range} rows with a punch-in time before 1970 or after 2514")
+        valid = in_range & data[name_col].notna().to_numpy()
+        data = data[valid]
+        punch_time = punch_time[valid]
+
+        names = data[name_col]
+        if isinstance(names.dtype, pd.CategoricalDtype):
+            names = names.cat.remove_unused_categories()
+            names = names.cat.rename_categories(names.cat.categories.astype(str))
+        else:
+            names = names.astype(str)
+        codes, employees = pd.factorize(names, sort=True)
+        seconds = punch_time.to_numpy().astype('datetime64[s]').astype(np.int64)
+
+        order = np.lexsort((seconds, codes))
+        frame = data.take(order).reset_index(drop=True)
+        # Categories are the sorted employee names, so the codes are the index codes
+        frame[name_col] = pd.Categorical.from_codes(codes[order], pd.Index(employees, dtype=object))
+        frame[PARSED_TIME_COL] = punch_time.to_numpy()[order]
+        self.frame = frame
+        self.dataset_id = None
+        self.version = 0
+        self._build_index()
+
+    @classmethod
+    def from_sorted_frame(cls, frame, columns, daily=None, spatial=None, version=0):
+        """
+        Wrap a frame that is already in Dataset order (e.g. one loaded from
+        disk), with its per-day summaries and spatial indexes if they are
+        already known.
+        """
+        dataset = cls.__new__(cls)
+        dataset.columns = dict(columns)
+        dataset.frame = frame
+        dataset.dataset_id = None
+        dataset.version = version
+        dataset._build_index(daily, spatial)
+        return dataset
+
+    def _build_index(self, daily=None, spatial=None):
+        """
+        Derive the index arrays (and, unless given, the per-day summaries and
+        spatial indexes) from the sorted frame.
+        """
+        frame = self.frame
+        names = frame[self.columns['name_col']]
+
+        # Contiguous arrays for the hot paths (filters, bounds, distances)
+        self.employees = np.asarray(names.cat.categories, dtype=object)
+        self._employee_codes = {emp: i for i, emp in enumerate(self.employees)}
+        self.codes = names.cat.codes.to_numpy().astype(np.int64)
+        self.punch_time = frame[PARSED_TIME_COL].to_numpy()
+        self.seconds = self.punch_time.astype('datetime64[s]').astype(np.int64)
+        self.keys = (self.codes << _TIME_BITS) | (self.seconds & _TIME_MASK)
+        self.punch_lat = self._float_column('punch_lat_col')
+        self.punch_lon = self._float_column('punch_lon_col')
+        self.visit_lat = self._float_column('visit_lat_col')
+        self.visit_lon = self._float_column('visit_lon_col')
+
+        # offsets[i]:offsets[i + 1] is the row range of employee i
+        self.offsets = np.searchsorted(self.codes, np.arange(len(self.employees) + 1))
+
+        # Grid indexes for bbox/radius/nearest/polygon queries on either location
+        self.spatial = spatial or {
+            'punch': GridIndex(self.punch_lat, self.punch_lon),
+            'visit': GridIndex(self.visit_lat, self.visit_lon),
+        }
+
+        self.daily = daily if daily is not None else self._build_daily()
+        self.dates = self._build_dates()
+
+    def _build_daily(self, rows=None):
+        """
+        One summary row per employee and day, computed once per upload so that
+        legends and reports never walk the rows again. Rows are sorted by
+        (employee, time), so each employee-day is the contiguous row range
+        row_start:row_stop. Holds the first and last punch-in, the number of
+        punches and visits, the distinct outlets, the route kilometres (see
+        distance.daily_route_totals) and the active hours between the first
+        and last punch. rows (sorted, whole employee-days) limits the
+        summaries to those days.
+        """
+        if rows is None:
+            rows = np.arange(len(self.frame))
+        codes, seconds = self.codes[rows], self.seconds[rows]
+        days = seconds // SECONDS_PER_DAY
+        group_starts = np.ones(len(days), dtype=bool)
+        group_starts[1:] = (codes[1:] != codes[:-1]) | (days[1:] != days[:-1])
+        group_ids = np.cumsum(group_starts) - 1
+        n_groups = int(group_ids[-1]) + 1 if len(group_ids) else 0
+        first = np.flatnonzero(group_starts)
+        last = np.r_[first[1:], len(days)] - 1
+
+        outlet_col = self.columns.get('outlet_id_col')
+        if outlet_col and outlet_col in self.frame.columns:
+            outlet_codes, _ = pd.factorize(self.frame[outlet_col].take(rows))
+        else:
+            outlet_codes = np.full(len(days), -1)
+        # A row is a visit if it names an outlet or has a visit location
+        is_visit = (outlet_codes >= 0) | (np.isfinite(self.visit_lat[rows]) & np.isfinite(self.visit_lon[rows]))
+        # Distinct (day, outlet) pairs, counted per day
+        has_outlet = outlet_codes >= 0
+        width = int(outlet_codes.max(initial=0)) + 1
+        pairs = np.unique(group_ids[has_outlet] * width + outlet_codes[has_outlet])
+        unique_outlets = np.bincount(pairs // width, minlength=n_groups)
+
+        routes = daily_route_totals(self.punch_lat[rows], self.punch_lon[rows], codes, seconds)
+        first_seconds, last_seconds = seconds[first], seconds[last]
+        return pd.DataFrame({
+            'employee_code': codes[first],
+            'date': days[first].astype('datetime64[D]'),
+            'row_start': rows[first].astype(np.int64),
+            'row_stop': rows[last].astype(np.int64) + 1,
+            'first_punch': first_seconds.astype('datetime64[s]'),
+            'last_punch': last_seconds.astype('datetime64[s]'),
+            'punches': last - first + 1,
+            'visits': np.bincount(group_ids, weights=is_visit, minlength=n_groups).astype(np.int64),
+            'unique_outlets': unique_outlets.astype(np.int64),
+            'points': routes['points'].to_numpy(),
+            'km': routes['km'].to_numpy(),
+            'active_hours': (last_seconds - first_seconds) / 3600,
+        })
+
+    def _build_dates(self):
+        """
+        The distinct punch-in dates in order, with their rows and employees,
+        from the per-day summaries: what the date dropdowns show, without a
+        pass over the rows. value (YYYY-MM-DD) and text (DD-MM-YYYY) are the
+        dropdown's option value and label.
+        """
+        dates, inverse = np.unique(self.daily['date'].to_numpy().astype('datetime64[D]'), return_inverse=True)
+        values = np.datetime_as_string(dates, unit='D').astype(object)
+        return pd.DataFrame({
+            'date': dates,
+            'value': values,
+            'text': [f'{v[8:10]}-{v[5:7]}-{v[:4]}' for v in values],
+            'rows': np.bincount(inverse, weights=self.daily['punches'].to_numpy(), minlength=len(dates)).astype(np.int64),
+            'employees': np.bincount(inverse, minlength=len(dates)).astype(np.int64),
+        })
+
+    def employee_dates(self, employee_name):
+        """
+        The dates on which one employee punched in, like self.dates but with
+        the employee's own rows per date. None for an unknown employee.
+        """
+        code = self.employee_code(employee_name)
+        if code is None:
+            return None
+        # The per-day summaries are in row order, so one employee's days are contiguous
+        start, stop = np.searchsorted(self.daily['employee_code'].to_numpy(), [code, code + 1])
+        days = self.daily.iloc[start:stop]
+        positions = np.searchsorted(self.dates['date'].to_numpy(), days['date'].to_numpy().astype('datetime64[D]'))
+        dates = self.dates.iloc[positions].reset_index(drop=True)
+        dates['rows'] = days['punches'].to_numpy()
+        dates['employees'] = 1
+        return dates
+
+    def daily_in_selection(self, selection):
+        """
+        The per-day summary rows of a selection, with an 'employee' column.
+        Selections are made of whole days, so every day is either fully in
+        the selection or not at all.
+        """
+        # The summaries are sorted by row_start, so each range's days are contiguous too
+        row_start = self.daily['row_start'].to_numpy()
+        ranges = np.array([(start, stop) for _, start, stop in selection], dtype=np.int64).reshape(-1, 2)
+        firsts = np.searchsorted(row_start, ranges[:, 0])
+        lasts = np.searchsorted(row_start, ranges[:, 1])
+        days = np.concatenate([np.arange(first, last) for first, last in zip(firsts, lasts)] or [np.empty(0, np.int64)])
+        daily = self.daily.iloc[days].reset_index(drop=True)
+        daily.insert(0, 'employee', self.employees[daily['employee_code'].to_numpy()])
+        return daily
+
+    def save(self, directory):
+        """
+        Write the sorted frame to directory as one .npy file per column plus a
+        JSON manifest. Categorical and text columns are stored as integer codes
+        plus their categories, so every file can be memory-mapped on load (text
+        columns come back as categoricals).
+        """
+        os.makedirs(directory, exist_ok=True)
+        stored = []
+        for i, col in enumerate(self.frame.columns):
+            values = self.frame[col]
+            if not isinstance(values.dtype, pd.CategoricalDtype) and values.dtype != object:
+                np.save(os.path.join(directory, f'col_{i}.npy'), values.to_numpy())
+                stored.append({'name': col, 'kind': 'array'})
+                continue
+            if values.dtype == object:
+                values = values.astype('category')
+            categories = values.cat.categories
+            if categories.dtype == object:
+                categories = np.asarray(categories.astype(str), dtype=str)
+            np.save(os.path.join(directory, f'col_{i}.npy'), values.cat.codes.to_numpy())
+            np.save(os.path.join(directory, f'col_{i}_categories.npy'), np.asarray(categories))
+            stored.append({'name': col, 'kind': 'categorical'})
+
+        # Per-day summaries are stored too, so loading does not recompute them
+        for col in self.daily.columns:
+            np.save(os.path.join(directory, f'daily_{col}.npy'), self.daily[col].to_numpy())
+
+        manifest = {'format': STORAGE_FORMAT_VERSION, 'columns': self.columns, 'stored': stored,
+                    'daily': self.daily.columns.tolist(), 'version': self.version}
+        with open(os.path.join(directory, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Load a Dataset written by save. Numeric columns and categorical codes
+        are memory-mapped (read-only) unless mmap_mode is None. Returns None if
+        directory holds no dataset in the current storage format.
+        """
+        try:
+            with open(os.path.join(directory, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('format') != STORAGE_FORMAT_VERSION:
+            return None
+
+        data = {}
+        for i, entry in enumerate(manifest['stored']):
+            values = np.load(os.path.join(directory, f'col_{i}.npy'), mmap_mode=mmap_mode)
+            if entry['kind'] == 'categorical':
+                categories = np.load(os.path.join(directory, f'col_{i}_categories.npy'), allow_pickle=False)
+                if categories.dtype.kind == 'U':
+                    categories = categories.astype(object)
+                values = pd.Categorical.from_codes(values, categories)
+            data[entry['name']] = values
+        daily = pd.DataFrame({col: np.load(os.path.join(directory, f'daily_{col}.npy')) for col in manifest['daily']})
+        return cls.from_sorted_frame(pd.DataFrame(data, copy=False), manifest['columns'], daily,
+                                     version=manifest.get('version', 0))
+
+    def _float_column(self, key):
+        col = self.columns.get(key)
+        if not col or col not in self.frame.columns:
+            return np.full(len(self.frame), np.nan)
+        return np.ascontiguousarray(pd.to_numeric(self.frame[col], errors='coerce').to_numpy(dtype=np.float64))
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the frame and the index arrays."""
+        arrays = [self.codes, self.seconds, self.keys, self.offsets,
+                  self.punch_lat, self.punch_lon, self.visit_lat, self.visit_lon]
+        return (int(self.frame.memory_usage(index=False).sum()) + sum(a.nbytes for a in arrays)
+                + sum(index.nbytes for index in self.spatial.values())
+                + int(self.daily.memory_usage(index=False).sum())
+                + int(self.dates.memory_usage(index=False, deep=True).sum()))
+
+    def employee_code(self, employee_name):
+        """The code of an employee (the index into employees and offsets), or None if unknown."""
+        return self._employee_codes.get(str(employee_name))
+
+    def employee_rows(self):
+        """Number of rows of each employee, in the order of employees."""
+        return np.diff(self.offsets)
+
+    def select(self, start_date=None, end_date=None, employee_name=None):
+        """
+        Return [(employee, start_row, stop_row), ...] for rows whose punch-in
+        date lies in [start_date, end_date] (both inclusive, either optional),
+        optionally restricted to one employee or a list of employees (unknown
+        names are ignored). Ranges are in row order; empty ones are omitted.
+        """
+        if isinstance(employee_name, (list, tuple, np.ndarray)):
+            codes = [self.employee_code(name) for name in employee_name]
+            codes = np.unique(np.array([code for code in codes if code is not None], dtype=np.int64))
+        elif employee_name:
+            code = self.employee_code(employee_name)
+            if code is None:
+                return []
+            codes = np.array([code], dtype=np.int64)
+        else:
+            codes = np.arange(len(self.employees), dtype=np.int64)
+
+        # Clipped to the sort key's time range, which holds every row
+        lo_seconds = min(max(_epoch_seconds(start_date), 0), _TIME_MASK + 1) if start_date else 0
+        hi_seconds = min(max(_epoch_seconds(end_date) + 86400, 0), _TIME_MASK + 1) if end_date else _TIME_MASK + 1
+
+        base = codes << _TIME_BITS
+        starts = np.searchsorted(self.keys, base + lo_seconds, side='left')
+        stops = np.searchsorted(self.keys, base + hi_seconds, side='left')
+        return [
+            (self.employees[code], int(start), int(stop))
+            for code, start, stop in zip(codes, starts, stops)
+            if stop > start
+        ]
+
+    def slice(self, start, stop):
+        """Rows start:stop of the sorted frame (a view, not a copy)."""
+        return self.frame.iloc[start:stop]
+
+    @staticmethod
+    def row_index(selection):
+        """Concatenate the row ranges of a selection into one index array."""
+        if not selection:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, stop) for _, start, stop in selection])
+
+    @staticmethod
+    def in_selection(rows, selection):
+        """Mask of the rows (row numbers in any order) that lie in one of the selection's ranges."""
+        if not selection:
+            return np.zeros(len(rows), dtype=bool)
+        starts = np.array([start for _, start, _ in selection])
+        stops = np.array([stop for _, _, stop in selection])
+        i = np.searchsorted(starts, rows, side='right') - 1
+        return (i >= 0) & (rows < stops[np.maximum(i, 0)])
+
+    def _visit_identity(self, rows=None):
+        """
+        Outlet IDs (as text, '' when there is no column) and visit times (epoch
+        seconds, -1 when missing) of the given rows (all by default), which
+        together with the sort key identify a row when appending.
+        """
+        if rows is None:
+            rows = np.arange(len(self.frame))
+        outlet_col = self.columns.get('outlet_id_col')
+        if outlet_col and outlet_col in self.frame.columns:
+            outlets = np.asarray(self.frame[outlet_col].take(rows).astype(str), dtype=object)
+        else:
+            outlets = np.full(len(rows), '', dtype=object)
+        if PARSED_VISIT_TIME_COL in self.frame.columns:
+            visit_time = self.frame[PARSED_VISIT_TIME_COL].to_numpy()[rows].astype('datetime64[s]')
+            visits = np.where(np.isnat(visit_time), -1, visit_time.astype(np.int64))
+        else:
+            visits = np.full(len(rows), -1, dtype=np.int64)
+        return outlets, visits
+
+    def visit_keys(self, rows=None):
+        """
+        64-bit hashes of the given rows (all by default) that match across
+        datasets when the same visit is uploaded twice: the employee, punch-in
+        time, outlet ID and visit time that append deduplicates on.
+        """
+        if rows is None:
+            rows = np.arange(len(self.frame))
+        outlets, visits = self._visit_identity(rows)
+        identity = pd.DataFrame({
+            'employee': self.employees[self.codes[rows]].astype(str),
+            'punch': self.seconds[rows],
+            'outlet': outlets,
+            'visit': visits,
+        })
+        return pd.util.hash_pandas_object(identity, index=False).to_numpy()
+
+    def append(self, other):
+        """
+        Merge the rows of another Dataset (e.g. the next daily export) into a
+        new Dataset, skipping rows already present with the same employee,
+        punch-in time, outlet ID and visit time (so repeated visits to an
+        outlet within one punch-in session are all kept). The existing rows are not parsed or
+        sorted again: the new rows are placed by binary search, the spatial
+        indexes are extended rather than rebuilt, and only the per-day
+        summaries of the employee-days that received rows are recomputed.
+        The result's version is one higher; if every row is a duplicate, the
+        dataset itself is returned.
+        Returns (dataset, row numbers of the appended rows, error_message).
+        """
+        if other.columns != self.columns or list(other.frame.columns) != list(self.frame.columns):
+            return None, None, 'The appended file must have the same columns as the dataset.'
+
+        # Existing employees keep their codes (and so their row order); new ones are added at the end
+        added_employees = other.employees[~np.isin(other.employees, self.employees)]
+        employees = np.concatenate([self.employees, added_employees])
+        old_codes, old_keys = self.codes, self.keys
+        new_codes = pd.Index(employees).get_indexer(other.employees)[other.codes]
+        new_keys = (new_codes << _TIME_BITS) | (other.seconds & _TIME_MASK)
+
+        # Duplicates within the new rows, then against existing rows with the same key
+        new_outlets, new_visits = other._visit_identity()
+        duplicate = pd.DataFrame({'key': new_keys, 'outlet': new_outlets, 'visit': new_visits}).duplicated().to_numpy()
+        lo = np.searchsorted(old_keys, new_keys, side='left')
+        hi = np.searchsorted(old_keys, new_keys, side='right')
+        for offset in range(int((hi - lo).max(initial=0))):
+            candidates = np.flatnonzero(lo + offset < hi)
+            old_outlets, old_visits = self._visit_identity(lo[candidates] + offset)
+            same = (old_outlets == new_outlets[candidates]) & (old_visits == new_visits[candidates])
+            duplicate[candidates[same]] = True
+        kept = np.flatnonzero(~duplicate)
+        if not len(kept):
+            return self, kept, None
+        # New employees' codes come last, so the kept rows need sorting by their merged key
+        kept = kept[np.argsort(new_keys[kept], kind='stable')]
+        new_codes, new_keys = new_codes[kept], new_keys[kept]
+
+        # Merged positions: new rows go after existing rows with an equal key
+        n_old, n_new = len(self.frame), len(kept)
+        insert_at = np.searchsorted(old_keys, new_keys, side='right')
+        new_positions = insert_at + np.arange(n_new)
+        old_positions = np.arange(n_old) + np.searchsorted(insert_at, np.arange(n_old), side='right')
+        order = np.empty(n_old + n_new, dtype=np.int64)
+        order[old_positions] = np.arange(n_old)
+        order[new_positions] = n_old + np.arange(n_new)
+
+        old_frame, new_frame = self.frame, other.frame.take(kept).reset_index(drop=True)
+        for col in old_frame.columns:
+            # Text columns are categoricals on one side at least; merge them as such
+            if isinstance(old_frame[col].dtype, pd.CategoricalDtype) != isinstance(new_frame[col].dtype, pd.CategoricalDtype):
+                if not isinstance(old_frame[col].dtype, pd.CategoricalDtype):
+                    old_frame = old_frame.assign(**{col: old_frame[col].astype('category')})
+                else:
+                    new_frame = new_frame.assign(**{col: new_frame[col].astype('category')})
+        frame = concat_chunks([old_frame, new_frame]).take(order).reset_index(drop=True)
+        codes = np.empty(n_old + n_new, dtype=np.int64)
+        codes[old_positions] = old_codes
+        codes[new_positions] = new_codes
+        frame[self.columns['name_col']] = pd.Categorical.from_codes(codes, pd.Index(employees, dtype=object))
+
+        spatial = {
+            kind: index.merge(lat[kept], lon[kept], new_positions, old_positions)
+            for kind, index, lat, lon in (
+                ('punch', self.spatial['punch'], other.punch_lat, other.punch_lon),
+                ('visit', self.spatial['visit'], other.visit_lat, other.visit_lon),
+            )
+        }
+        merged = Dataset.from_sorted_frame(frame, self.columns, self.daily.iloc[:0], spatial, self.version + 1)
+
+        # Only the employee-days that received rows are summarised again
+        new_days = np.unique(new_codes << 20 | other.seconds[kept] // SECONDS_PER_DAY)
+        old_daily = self.daily.copy()
+        old_days = old_daily['employee_code'].to_numpy() << 20 | (
+            old_daily['date'].to_numpy().astype('datetime64[D]').astype(np.int64))
+        old_daily = old_daily[~np.isin(old_days, new_days)]
+        old_daily['row_stop'] = old_positions[old_daily['row_stop'].to_numpy() - 1] + 1
+        old_daily['row_start'] = old_positions[old_daily['row_start'].to_numpy()]
+
+        day_codes, days = new_days >> 20, new_days & ((1 << 20) - 1)
+        starts = np.searchsorted(merged.keys, day_codes << _TIME_BITS | days * SECONDS_PER_DAY, side='left')
+        stops = np.searchsorted(merged.keys, day_codes << _TIME_BITS | (days + 1) * SECONDS_PER_DAY, side='left')
+        lengths = stops - starts
+        rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+        merged.daily = pd.concat([old_daily, merged._build_daily(rows)]).sort_values('row_start').reset_index(drop=True)
+        merged.dates = merged._build_dates()
+        return merged, new_positions, None
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+from dataset import Dataset, STORAGE_FORMAT_VERSION
+
+# Parsed uploads are persisted here, one directory per content hash.
+# Set DATASET_CACHE_DIR to an empty string to disable the cache.
+DATASET_CACHE_DIR = os.getenv(
+    'DATASET_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset_cache')
+)
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Keys are hex SHA-256 digests; anything else (e.g. a path) is rejected
+_KEY_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+
+def content_hash(file, filename, extra_columns=()):
+    """
+    SHA-256 of an uploaded file's bytes, read in blocks and rewound afterwards.
+    The file extension (which decides how the bytes are parsed), the storage
+    format version and the extra columns kept are part of the key, so a
+    format or configuration change never reuses stale entries.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{STORAGE_FORMAT_VERSION}{os.path.splitext(filename)[1].lower()}\n".encode())
+    if extra_columns:
+        digest.update(f"extra:{','.join(extra_columns)}\n".encode())
+    for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def cache_path(key):
+    return os.path.join(DATASET_CACHE_DIR, key)
+
+
+def is_valid_key(key):
+    return isinstance(key, str) and _KEY_PATTERN.fullmatch(key) is not None
+
+
+def load_cached_dataset(key):
+    """Return the memory-mapped Dataset cached under key (with dataset_id set), or None on a miss."""
+    if not DATASET_CACHE_DIR or not is_valid_key(key):
+        return None
+    try:
+        dataset = Dataset.load(cache_path(key))
+    except Exception as e:
+        print(f"Ignoring unreadable dataset cache entry '{key}': {e}")
+        return None
+    if dataset is not None:
+        dataset.dataset_id = key
+    return dataset
+
+
+def save_cached_dataset(key, dataset):
+    """
+    Persist dataset under key. The entry is written to a temporary directory and
+    renamed into place, so other workers never see a half-written entry.
+    Failures are reported but never break the upload itself.
+    """
+    if not DATASET_CACHE_DIR:
+        return
+    tmp_dir = None
+    try:
+        os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=DATASET_CACHE_DIR)
+        dataset.save(tmp_dir)
+        os.rename(tmp_dir, cache_path(key))
+        tmp_dir = None
+    except OSError as e:
+        # Another worker may have written the same entry first
+        if not os.path.isdir(cache_path(key)):
+            print(f"Could not write dataset cache entry '{key}': {e}")
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
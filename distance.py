@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371 # Radius of Earth in kilometers
+
+SECONDS_PER_DAY = 86400
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in kilometers between two points (or two arrays of
+    points, element-wise) using the Haversine formula.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def route_segments(lat, lon, group_ids):
+    """
+    Distances between consecutive points of a time-sorted track.
+
+    Points with missing coordinates are skipped, so the route joins the
+    points on either side of them. Returns (keep, segment_km) where keep is
+    the boolean mask of usable points and segment_km[i] is the distance from
+    usable point i to usable point i + 1, or 0 where the two belong to
+    different groups (a new employee or a new day).
+    """
+    keep = np.isfinite(lat) & np.isfinite(lon)
+    lat, lon, group_ids = lat[keep], lon[keep], group_ids[keep]
+    segment_km = haversine_km(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    segment_km[group_ids[1:] != group_ids[:-1]] = 0
+    return keep, segment_km
+
+
+def daily_route_totals(lat, lon, employee_codes, seconds):
+    """
+    Per-employee, per-day route totals in one vectorized pass.
+
+    The inputs are parallel arrays sorted by (employee, time), with times as
+    epoch seconds. Routes are split at day boundaries, so the jump between
+    one day's last punch and the next day's first punch is not counted.
+    Returns a DataFrame with one row per (employee code, day) holding the
+    day (datetime64[D]), the number of located points and the kilometres.
+    """
+    days = seconds // SECONDS_PER_DAY
+    # One group id per (employee, day); codes and days are both sorted, so a
+    # change in either marks the start of a new group
+    group_starts = np.ones(len(days), dtype=bool)
+    group_starts[1:] = (employee_codes[1:] != employee_codes[:-1]) | (days[1:] != days[:-1])
+    group_ids = np.cumsum(group_starts) - 1
+
+    keep, segment_km = route_segments(lat, lon, group_ids)
+    kept_groups = group_ids[keep]
+    n_groups = int(group_ids[-1]) + 1 if len(group_ids) else 0
+
+    km = np.bincount(kept_groups[1:], weights=segment_km, minlength=n_groups)
+    points = np.bincount(kept_groups, minlength=n_groups)
+    first_rows = np.flatnonzero(group_starts)
+    return pd.DataFrame({
+        'employee_code': employee_codes[first_rows],
+        'date': days[first_rows].astype('datetime64[D]'),
+        'points': points,
+        'km': km,
+    })
+
+
+def selection_route_totals(dataset, selection):
+    """
+    Route totals for a Dataset selection (see Dataset.select), read from the
+    per-day summaries computed at upload.
+    Returns ({employee: total km}, per-day DataFrame with an 'employee' column).
+    """
+    per_day = dataset.daily_in_selection(selection)
+    per_employee = per_day.groupby('employee', sort=False)['km'].sum()
+    return {emp: float(per_employee.get(emp, 0.0)) for emp, _, _ in selection}, per_day
+
+
+def simplify_route(lat, lon, tolerance_m, group_ids=None):
+    """
+    Ramer-Douglas-Peucker simplification of a track, for display only.
+
+    Returns a boolean mask of the points to keep: every point that lies more
+    than tolerance_m metres from the simplified line is retained. The first
+    and last point of each group (e.g. each employee-day) are always kept, so
+    groups are simplified independently. Instead of recursing one segment at
+    a time, each pass finds the farthest point of every open segment at once,
+    so the number of passes is the depth of the recursion, not the number of
+    points. Points are projected onto a local plane in metres, which is
+    accurate at the scale of a day's route.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    n = len(lat)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[[0, -1]] = True
+    if group_ids is not None:
+        boundaries = np.flatnonzero(group_ids[1:] != group_ids[:-1])
+        keep[boundaries] = True
+        keep[boundaries + 1] = True
+    if n < 3 or tolerance_m <= 0:
+        keep[:] = True
+        return keep
+
+    lat0 = np.radians(np.nanmean(lat))
+    x = np.radians(lon) * np.cos(lat0) * EARTH_RADIUS_KM * 1000
+    y = np.radians(lat) * EARTH_RADIUS_KM * 1000
+
+    # Points still waiting for a decision; everything else is kept or dropped
+    open_points = np.flatnonzero(~keep)
+    while len(open_points):
+        kept = np.flatnonzero(keep)
+        after = np.searchsorted(kept, open_points)
+        start, end = kept[after - 1], kept[after]
+
+        # Distance from each open point to the segment between the kept
+        # points around it (to the start point when the segment is degenerate)
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[open_points] - x[start], y[open_points] - y[start]
+        length_sq = dx * dx + dy * dy
+        t = np.clip(np.divide(px * dx + py * dy, length_sq, out=np.zeros(len(open_points)), where=length_sq > 0), 0, 1)
+        dist = np.hypot(px - t * dx, py - t * dy)
+
+        # Farthest point of each segment; open points are in index order, so
+        # each segment's points are contiguous
+        first = np.flatnonzero(np.r_[True, start[1:] != start[:-1]])
+        segment = np.cumsum(np.r_[True, start[1:] != start[:-1]]) - 1
+        farthest = np.maximum.reduceat(dist, first)
+        is_max = dist == farthest[segment]
+        _, argmax = np.unique(segment[is_max], return_index=True)
+        argmax = np.flatnonzero(is_max)[argmax]
+
+        split = farthest > tolerance_m
+        keep[open_points[argmax[split]]] = True
+        # Segments within tolerance are final: their interior points are dropped
+        open_points = open_points[split[segment] & ~keep[open_points]]
+    return keep
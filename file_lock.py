@@ -0,0 +1,40 @@
+import fcntl
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def locked(path):
+    """
+    Hold an exclusive lock for the file at path, through the sibling file
+    path + '.lock'. flock locks are per open file, so they serialise both
+    threads of one worker and separate gunicorn workers.
+    """
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def replace_file(path, write):
+    """
+    Atomically replace the file at path: write(f) fills a uniquely named
+    temporary file (opened for text) in the same directory, which is then
+    renamed over path. Readers see either the old or the new file, never a
+    partial one.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            write(f)
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
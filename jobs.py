@@ -0,0 +1,254 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dataset_cache import DATASET_CACHE_DIR
+from file_lock import replace_file
+
+# Background jobs (uploads, map renders) run on this many threads per process
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+
+# Finished jobs are kept this many seconds, for their results to be collected
+JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', 600))
+
+# Job state and results are also written here, one JSON file per job, so any
+# worker process can answer polls and cancel requests for a job. Empty: jobs
+# are only visible to the process running them.
+JOB_STATE_DIR = os.getenv(
+    'JOB_STATE_DIR', os.path.join(DATASET_CACHE_DIR, 'jobs') if DATASET_CACHE_DIR else ''
+)
+
+# Progress reports are written to the job's state file at most this often, in seconds
+JOB_STATE_INTERVAL = float(os.getenv('JOB_STATE_INTERVAL', 0.5))
+
+# Job IDs are hex UUIDs; anything else (e.g. a path) is rejected
+_JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised by Job.report once the job is cancelled, to unwind its work."""
+
+
+class Job:
+    """
+    One unit of background work. The work function reports progress through
+    report(), which doubles as its cancellation point: cancelling a running
+    job takes effect at its next report.
+    """
+
+    def __init__(self, kind, state_dir=''):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+        self._future = None
+        self._state_dir = state_dir
+        self._saved = 0
+
+    def report(self, **progress):
+        """Record progress (e.g. rows=..., stage=...). Raises JobCancelled if the job was cancelled."""
+        if self.cancel_requested():
+            raise JobCancelled()
+        self.progress = {**self.progress, **progress}
+        if time.time() - self._saved >= JOB_STATE_INTERVAL:
+            self.save()
+
+    def cancel_requested(self):
+        """Whether the job was cancelled, here or (through its cancel file) by another process."""
+        if not self._cancel.is_set() and self._state_dir and os.path.exists(_cancel_path(self._state_dir, self.id)):
+            self._cancel.set()
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Cancel the job: at once if it is still queued, else at its next progress report."""
+        if self.status in FINISHED_STATES:
+            return False
+        self._cancel.set()
+        if self._future is not None and self._future.cancel():
+            self._finish(CANCELLED)
+        return True
+
+    def _finish(self, status, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self.status = status
+        self.save()
+
+    def save(self):
+        """Write the job's state to its state file, if jobs are shared through files."""
+        if not self._state_dir:
+            return
+        self._saved = time.time()
+        state = self.to_dict()
+        try:
+            os.makedirs(self._state_dir, exist_ok=True)
+            replace_file(_state_path(self._state_dir, self.id), lambda f: json.dump(state, f))
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Could not write the state of job {self.id}: {e}")
+
+    def to_dict(self):
+        job = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'cancel_requested': self._cancel.is_set(),
+        }
+        if self.status == DONE:
+            job['result'] = self.result
+        if self.error:
+            job['error'] = self.error
+        return job
+
+
+def _state_path(state_dir, job_id):
+    return os.path.join(state_dir, job_id + '.json')
+
+
+def _cancel_path(state_dir, job_id):
+    return os.path.join(state_dir, job_id + '.cancel')
+
+
+class JobQueue:
+    """
+    Job table with a thread pool. Request threads submit work and return the
+    job ID at once; clients poll the job for progress and its result. A job
+    runs in the process that accepted it. With a state_dir, its state is
+    also kept in a file there, so polls and cancel requests routed to other
+    server processes (e.g. other gunicorn workers) see it too.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_RESULT_TTL, state_dir=JOB_STATE_DIR):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.ttl = ttl
+        self.state_dir = state_dir
+
+    def submit(self, kind, fn, *args, **kwargs):
+        """
+        Run fn(job, *args, **kwargs) in the background. fn returns
+        (result, error_message); result must be JSON-serialisable.
+        """
+        job = Job(kind, self.state_dir)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        job.save()
+        job._future = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancel_requested():
+            job._finish(CANCELLED)
+            return
+        job.status = RUNNING
+        job.save()
+        try:
+            result, error_message = fn(job, *args, **kwargs)
+        except JobCancelled:
+            job._finish(CANCELLED)
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind}) failed: {e}")
+            job._finish(FAILED, error=str(e))
+        else:
+            if error_message:
+                job._finish(FAILED, error=error_message)
+            else:
+                job._finish(DONE, result=result)
+
+    def get(self, job_id):
+        """The Job object for job_id, if it was submitted to this process."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        """The state of a job (see Job.to_dict), or None if it is unknown."""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return self._load_state(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a job and return its state, or None if it is unknown. A job run
+        by another process is cancelled through its cancel file, which it
+        checks at its next progress report.
+        """
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+            return job.to_dict()
+        state = self._load_state(job_id)
+        if state is None or state['status'] in FINISHED_STATES:
+            return state
+        try:
+            open(_cancel_path(self.state_dir, job_id), 'a').close()
+        except OSError as e:
+            print(f"Could not cancel job {job_id}: {e}")
+            return state
+        return {**state, 'cancel_requested': True}
+
+    def _load_state(self, job_id):
+        if not self.state_dir or not isinstance(job_id, str) or not _JOB_ID_PATTERN.fullmatch(job_id):
+            return None
+        try:
+            with open(_state_path(self.state_dir, job_id)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if os.path.exists(_cancel_path(self.state_dir, job_id)):
+            state['cancel_requested'] = True
+        return state
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [job.id for job in self._jobs.values() if job.finished is not None and job.finished < cutoff]:
+            del self._jobs[job_id]
+        if self.state_dir:
+            self._expire_files(cutoff)
+
+    def _expire_files(self, cutoff):
+        # Any process may remove the files of finished jobs, once they are past
+        # the TTL. Files of jobs whose process died are removed once they are
+        # a day older than that.
+        try:
+            names = os.listdir(self.state_dir)
+        except OSError:
+            return
+        for name in names:
+            job_id, ext = os.path.splitext(name)
+            if ext != '.json' or not _JOB_ID_PATTERN.fullmatch(job_id) or job_id in self._jobs:
+                continue
+            path = os.path.join(self.state_dir, name)
+            try:
+                modified = os.path.getmtime(path)
+                if modified >= cutoff:
+                    continue
+                if modified >= cutoff - 86400:
+                    with open(path) as f:
+                        if json.load(f).get('status') not in FINISHED_STATES:
+                            continue
+                os.remove(path)
+                if os.path.exists(_cancel_path(self.state_dir, job_id)):
+                    os.remove(_cancel_path(self.state_dir, job_id))
+            except (OSError, ValueError):
+                continue
@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+
+
+class SizedLRUCache:
+    """
+    Thread-safe mapping that evicts least recently used entries once the total
+    size of its values exceeds max_bytes. sizeof(value) gives an entry's size.
+    The most recently added entry is always kept, even if it alone is over budget.
+    """
+
+    def __init__(self, max_bytes, sizeof):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        size = self._sizeof(value)
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                self._discard(next(iter(self._entries)))
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._entries.get(key, default)
+            self._discard(key)
+            return value
+
+    def discard_where(self, predicate):
+        """Remove every entry whose key satisfies predicate(key)."""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.total_bytes = 0
+
+    def _discard(self, key):
+        if key in self._entries:
+            del self._entries[key]
+            self.total_bytes -= self._sizes.pop(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
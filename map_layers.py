@@ -0,0 +1,647 @@
+import numpy as np
+import pandas as pd
+from branca.element import Element
+from folium.map import Layer, LayerControl
+from folium.plugins import MarkerCluster
+from folium.template import Template
+from folium.utilities import remove_empty
+from jinja2.utils import htmlsafe_json_dumps
+
+from dataset import PARSED_VISIT_TIME_COL
+from clustering import cluster_pyramid
+from distance import simplify_route
+
+# Coordinates are shipped with 5 decimals (about 1 m), which is plenty for
+# markers and routes and keeps the payload small
+COORDINATE_DECIMALS = 5
+
+# Minimum zoom of each route level of detail. A level is simplified to about
+# one screen pixel at its zoom (never finer than the base route tolerance).
+ROUTE_DETAIL_ZOOMS = (0, 8, 11, 14, 17)
+METRES_PER_PIXEL_ZOOM_0 = 156543.03
+
+# A cluster level that merges less than this share of the points is not
+# worth shipping; individual markers are shown from that zoom on instead.
+MIN_CLUSTER_REDUCTION = 0.5
+
+
+class _VerbatimScript(Element):
+    """Script text added to the page as is (an Element would compile it as a template)."""
+
+    def __init__(self, text):
+        super().__init__()
+        self.text = text
+
+    def render(self, **kwargs):
+        return self.text
+
+
+class _InlineData:
+    """
+    Mixin for layers with a large data payload. folium compiles the rendered
+    script of every element as a Jinja template, which for megabytes of JSON
+    takes longer than building the map. The payload returned by data() is
+    therefore written verbatim to a <name>_data variable that the layer's
+    template refers to instead.
+
+    Layers using it define data(), returning the JSON-serialisable payload,
+    and list the mixin before their folium base class.
+    """
+
+    def data_name(self):
+        return self.get_name() + '_data'
+
+    def render(self, **kwargs):
+        script = f"var {self.data_name()} = {htmlsafe_json_dumps(self.data(), separators=(',', ':'))};"
+        self.get_root().script.add_child(_VerbatimScript(script), name=self.data_name())
+        super().render(**kwargs)
+
+
+# Defines pointMarker(points, kind, i), which builds the Leaflet marker for
+# point i of kind 'punch' or 'visit' (a visit or, with per-outlet data, an
+# outlet) from compact_points data, with the same icons, popup and tooltip as
+# the folium.Marker rendering. Popups and tooltips are only built when first
+# opened.
+_POINT_MARKER_JS = """
+                var pointIcons = {
+                    punch: L.AwesomeMarkers.icon({icon: 'user-clock', prefix: 'fa', markerColor: 'blue'}),
+                    visit: L.AwesomeMarkers.icon({icon: 'briefcase', prefix: 'fa', markerColor: 'green'})
+                };
+                function esc(value) {
+                    return value === null || value === undefined ? 'N/A' : String(value).replace(/[&<>"']/g, function(c) { return '&#' + c.charCodeAt(0) + ';'; });
+                }
+                function pad(n) { return (n < 10 ? '0' : '') + n; }
+                function fmtTime(t) {
+                    if (t === null) { return 'N/A'; }
+                    var d = new Date(t * 1000);
+                    return pad(d.getUTCDate()) + '-' + pad(d.getUTCMonth() + 1) + '-' + d.getUTCFullYear() + ' ' +
+                        pad(d.getUTCHours()) + ':' + pad(d.getUTCMinutes()) + ':' + pad(d.getUTCSeconds());
+                }
+                function pointMarker(points, kind, i) {
+                    var p = points[kind], lat = p.lat[i], lon = p.lon[i], name = esc(points.employees[p.emp[i]]);
+                    var marker = L.marker([lat, lon], {icon: pointIcons[kind]});
+                    if (kind === 'punch') {
+                        marker.bindPopup(function() {
+                            return '<strong>Employee:</strong> ' + name + '<br>' +
+                                '<strong>Punch In Time:</strong> ⏰ ' + fmtTime(p.t[i]) + '<br>' +
+                                '<strong>Latitude:</strong> ' + lat.toFixed(4) + '<br>' +
+                                '<strong>Longitude:</strong> ' + lon.toFixed(4);
+                        });
+                        marker.bindTooltip(function() { return 'Name: ' + name + ' | Punch In: ' + fmtTime(p.t[i]); });
+                    } else if (p.n) {
+                        // One marker per outlet with its visits aggregated
+                        var outletName = esc(points.outlets[p.outlet[i]]), outletKey = esc(points.outlet_ids[p.outlet_id[i]]);
+                        marker.bindPopup(function() {
+                            return '<strong>Outlet:</strong> ' + outletName + ' (ID: ' + outletKey + ')<br>' +
+                                '<strong>Visits:</strong> ' + p.n[i] + ' by ' + p.emps[i] + (p.emps[i] === 1 ? ' employee' : ' employees') + '<br>' +
+                                '<strong>First Visit:</strong> ⏱️ ' + fmtTime(p.first[i]) + '<br>' +
+                                '<strong>Last Visit:</strong> ⏱️ ' + fmtTime(p.last[i]) + '<br>' +
+                                (p.total[i] === null ? '' : '<strong>All Uploads:</strong> ' + p.total[i] + ' visits, ' + esc(p.first_seen[i]) + ' to ' + esc(p.last_seen[i]) + '<br>') +
+                                '<strong>Latitude:</strong> ' + lat.toFixed(4) + '<br>' +
+                                '<strong>Longitude:</strong> ' + lon.toFixed(4);
+                        });
+                        marker.bindTooltip(function() { return 'Outlet: ' + outletName + ' | Visits: ' + p.n[i]; });
+                    } else {
+                        var outlet = esc(points.outlets[p.outlet[i]]), outletId = esc(points.outlet_ids[p.outlet_id[i]]);
+                        marker.bindPopup(function() {
+                            return '<strong>Employee:</strong> ' + name + '<br>' +
+                                '<strong>Outlet:</strong> ' + outlet + ' (ID: ' + outletId + ')<br>' +
+                                '<strong>Visit Time:</strong> ⏱️ ' + fmtTime(p.t[i]) + '<br>' +
+                                '<strong>Latitude:</strong> ' + lat.toFixed(4) + '<br>' +
+                                '<strong>Longitude:</strong> ' + lon.toFixed(4);
+                        });
+                        marker.bindTooltip(function() { return 'Outlet: ' + outlet + ' | Visit: ' + fmtTime(p.t[i]); });
+                    }
+                    return marker;
+                }
+"""
+
+
+class CompactMarkerCluster(_InlineData, MarkerCluster):
+    """
+    Punch-in and visit markers created in the browser from columnar arrays.
+
+    Unlike one folium.Marker per row, the server only serializes one list per
+    field, and popups and tooltips are built by the browser from the same
+    arrays when a marker is opened or hovered.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var points = {{ this.data_name() }};
+                var cluster = L.markerClusterGroup({{ this.options|tojavascript }});
+""" + _POINT_MARKER_JS + """
+                var markers = [];
+                ['punch', 'visit'].forEach(function(kind) {
+                    points[kind].lat.forEach(function(lat, i) { markers.push(pointMarker(points, kind, i)); });
+                });
+                cluster.addLayers(markers);
+                return cluster;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, points, name=None, overlay=True, control=True, show=True, **kwargs):
+        super().__init__(name=name, overlay=overlay, control=control, show=show, chunkedLoading=True, **kwargs)
+        self._name = 'CompactMarkerCluster'
+        self.points = points
+
+    def data(self):
+        return self.points
+
+
+class GridClusterLayer(_InlineData, Layer):
+    """
+    Server-side clustered punch-in and visit markers.
+
+    Below street_zoom the browser only draws the precomputed grid clusters of
+    the current zoom level (see clustering.cluster_pyramid) that fall inside
+    the view. From street_zoom up it draws the individual markers in view,
+    falling back to the finest cluster level while the view holds more than
+    max_markers of them. Nothing is clustered in the browser, so the cost of a
+    redraw depends on what is visible, not on the size of the dataset.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var points = {{ this.data_name() }}.points, levels = {{ this.data_name() }}.levels;
+                var streetZoom = {{ this.street_zoom }}, maxMarkers = {{ this.max_markers }};
+                var layer = L.layerGroup();
+""" + _POINT_MARKER_JS + """
+                var markerCache = {};
+                function clusterMarker(level, i) {
+                    var count = level.count[i], size = count < 10 ? 30 : count < 1000 ? 40 : 50;
+                    var color = count < 10 ? 'rgba(110, 204, 57, 0.8)' : count < 1000 ? 'rgba(240, 194, 12, 0.8)' : 'rgba(241, 128, 23, 0.8)';
+                    var marker = L.marker([level.lat[i], level.lon[i]], {icon: L.divIcon({
+                        html: '<div style="background:' + color + ';border-radius:50%;width:' + size + 'px;height:' + size + 'px;line-height:' + size +
+                            'px;text-align:center;font:bold 12px sans-serif;">' + count + '</div>',
+                        className: '', iconSize: [size, size]
+                    })});
+                    marker.bindTooltip('Punch In: ' + level.punch[i] + ' | Outlets: ' + level.visit[i]);
+                    marker.on('click', function() { layer._map.setView(marker.getLatLng(), layer._map.getZoom() + 2); });
+                    return marker;
+                }
+                function draw() {
+                    var map = layer._map, zoom = map.getZoom(), bounds = map.getBounds().pad(0.2);
+                    var visible = [];
+                    if (zoom >= streetZoom) {
+                        ['punch', 'visit'].forEach(function(kind) {
+                            var p = points[kind];
+                            for (var i = 0; i < p.lat.length && (visible.length <= maxMarkers || !levels.length); i++) {
+                                if (bounds.contains([p.lat[i], p.lon[i]])) {
+                                    var key = kind + i;
+                                    visible.push(markerCache[key] || (markerCache[key] = pointMarker(points, kind, i)));
+                                }
+                            }
+                        });
+                        if (visible.length > maxMarkers && levels.length) { visible = []; }
+                    }
+                    if (!visible.length && levels.length) {
+                        var level = levels[Math.min(zoom, levels.length - 1)];
+                        for (var i = 0; i < level.count.length; i++) {
+                            if (bounds.contains([level.lat[i], level.lon[i]])) { visible.push(clusterMarker(level, i)); }
+                        }
+                    }
+                    layer.clearLayers();
+                    visible.forEach(function(marker) { layer.addLayer(marker); });
+                }
+                layer.on('add', function() { layer._map.on('moveend', draw); draw(); });
+                layer.on('remove', function() { layer._map.off('moveend', draw); });
+                return layer;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, points, levels, street_zoom, max_markers, name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'GridClusterLayer'
+        self.points = points
+        self.levels = levels
+        self.street_zoom = int(street_zoom)
+        self.max_markers = int(max_markers)
+
+    def data(self):
+        return {'points': self.points, 'levels': self.levels}
+
+
+class RouteLayer(_InlineData, Layer):
+    """
+    The routes of all employees as one layer, built in the browser from a
+    single payload: routes is a list of [employee, color, days] with days a
+    list of [day, locations] (locations a list of [lat, lon] pairs), or with
+    zoom_levels [day, [[min_zoom, locations], ...]] in increasing zoom order.
+
+    Each employee's days are drawn as one multi-polyline in a "Routes:
+    <employee>" group; with day_layers, each day is its own polyline in a
+    "Routes: <employee> (<day>)" sub-group instead. The groups are added to
+    the map's LayerControl from the browser, so thousands of employee-days
+    cost no folium elements (each of which compiles its own template). With
+    zoom_levels, the most detailed level whose min_zoom is reached is shown
+    and the vertices are swapped whenever the map zoom changes.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var data = {{ this.data_name() }}, map = {{ this._parent.get_name() }};
+                var routes = L.layerGroup(), overlays = [], lines = [];
+                function locationsAt(day, zoom) {
+                    if (!data.zoom_levels) { return day[1]; }
+                    var locations = day[1][0][1];
+                    day[1].forEach(function(level) { if (zoom >= level[0]) { locations = level[1]; } });
+                    return locations;
+                }
+                function update() {
+                    var zoom = map.getZoom();
+                    lines.forEach(function(line) {
+                        var days = line._routeDays, locations = days.map(function(day) { return locationsAt(day, zoom); });
+                        line.setLatLngs(days.length === 1 ? locations[0] : locations);
+                    });
+                }
+                data.routes.forEach(function(route) {
+                    var group = L.featureGroup().addTo(routes), options = Object.assign({color: route[1]}, data.options);
+                    overlays.push(['Routes: ' + route[0], group]);
+                    var parts = data.day_layers ? route[2].map(function(day) { return [day]; }) : [route[2]];
+                    parts.forEach(function(days) {
+                        var line = L.polyline([], options);
+                        line._routeDays = days;
+                        lines.push(line);
+                        if (data.day_layers) {
+                            var dayGroup = L.featureGroup().addTo(group);
+                            overlays.push(['Routes: ' + route[0] + ' (' + days[0][0] + ')', dayGroup]);
+                            line.addTo(dayGroup);
+                        } else {
+                            line.addTo(group);
+                        }
+                    });
+                });
+                update();
+                if (data.zoom_levels) { map.on('zoomend', update); }
+                {%- if this.layer_control_name() %}
+                // The layer control is created after this layer; register once all scripts ran
+                setTimeout(function() {
+                    overlays.forEach(function(overlay) { {{ this.layer_control_name() }}.addOverlay(overlay[1], overlay[0]); });
+                }, 0);
+                {%- endif %}
+                return routes;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, routes, day_layers=False, zoom_levels=False, name=None, overlay=True, control=False, show=True,
+                 **kwargs):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'RouteLayer'
+        self.routes = routes
+        self.day_layers = bool(day_layers)
+        self.zoom_levels = bool(zoom_levels)
+        self.options = remove_empty(**kwargs)
+
+    def layer_control_name(self):
+        """Variable name of the LayerControl on the same map, if there is one."""
+        for child in self._parent._children.values():
+            if isinstance(child, LayerControl):
+                return child.get_name()
+        return None
+
+    def data(self):
+        return {'routes': self.routes, 'day_layers': self.day_layers, 'zoom_levels': self.zoom_levels,
+                'options': self.options}
+
+
+def _nullable(values, decimals=None):
+    """Array to list for JSON, with NaN/NaT (or negative codes) as None."""
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        missing = np.isnan(values)
+        if decimals is not None:
+            values = np.round(values, decimals)
+    else:
+        missing = values < 0
+    listed = values.tolist()
+    for i in np.flatnonzero(missing):
+        listed[i] = None
+    return listed
+
+
+def _time_seconds(values):
+    """datetime64 values as float epoch seconds, NaN where missing."""
+    values = np.asarray(values, dtype='datetime64[s]')
+    seconds = values.astype(np.int64).astype(np.float64)
+    seconds[np.isnat(values)] = np.nan
+    return seconds
+
+
+def _lookup(frame, col, rows):
+    """Factorize frame[col] at rows into (codes, list of distinct values)."""
+    if not col or col not in frame.columns:
+        return np.full(len(rows), -1), []
+    codes, uniques = pd.factorize(frame[col].take(rows))
+    return codes, [str(value) for value in uniques]
+
+
+def bbox_mask(lat, lon, bbox):
+    """Mask of the points inside bbox = (west, south, east, north); NaN coordinates are outside."""
+    west, south, east, north = bbox
+    return (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+
+
+def _located(points, bbox):
+    lat, lon = points['lat'].to_numpy(), points['lon'].to_numpy()
+    if bbox is not None:
+        return bbox_mask(lat, lon, bbox)
+    return np.isfinite(lat) & np.isfinite(lon)
+
+
+def outlet_points(dataset, rows, outlet_master, bbox=None):
+    """
+    One point per outlet visited in the given dataset rows, at the outlet's
+    canonical location from the outlet master (or the median location of
+    these visits for outlets the master does not know). Each point carries
+    the number of visits and distinct employees and the first and last visit
+    time within the rows, plus the outlet's all-time visit count and
+    first/last-seen dates from the master. Returns (DataFrame of outlets,
+    distinct outlet names, distinct outlet IDs); the outlet and outlet_id
+    columns hold codes into the two lists (-1 where missing).
+    """
+    frame = dataset.frame
+    columns = dataset.columns
+    id_codes, outlet_ids = _lookup(frame, columns.get('outlet_id_col'), rows)
+    name_codes, outlet_names = _lookup(frame, columns.get('outlet_name_col'), rows)
+    if PARSED_VISIT_TIME_COL in frame.columns:
+        visit_seconds = _time_seconds(frame[PARSED_VISIT_TIME_COL].to_numpy()[rows])
+    else:
+        visit_seconds = np.full(len(rows), np.nan)
+    # Visits without an outlet ID are grouped by outlet name instead
+    key = np.where(id_codes >= 0, id_codes, -2 - name_codes)
+    visits = pd.DataFrame({
+        'key': key, 'outlet_id': id_codes, 'outlet': name_codes, 'emp': dataset.codes[rows],
+        'lat': dataset.visit_lat[rows], 'lon': dataset.visit_lon[rows], 't': visit_seconds,
+    })[(id_codes >= 0) | (name_codes >= 0)]
+    outlets = visits.groupby('key', sort=False).agg(
+        outlet_id=('outlet_id', 'first'), outlet=('outlet', 'first'),
+        lat=('lat', 'median'), lon=('lon', 'median'),
+        visits=('emp', 'size'), employees=('emp', 'nunique'), first=('t', 'min'), last=('t', 'max'),
+    ).reset_index(drop=True)
+
+    outlet_id_values = np.append(np.asarray(outlet_ids, dtype=object), None)[outlets['outlet_id'].to_numpy()]
+    known = outlet_master.reindex(outlet_id_values) if len(outlet_master) else None
+    if known is not None:
+        located = (known['lat'].notna() & known['lon'].notna()).to_numpy()
+        outlets.loc[located, 'lat'] = known['lat'].to_numpy(dtype=np.float64)[located]
+        outlets.loc[located, 'lon'] = known['lon'].to_numpy(dtype=np.float64)[located]
+        outlets['total_visits'] = known['visits'].to_numpy(dtype=np.float64)
+        outlets['first_seen'] = pd.to_datetime(known['first_seen']).dt.strftime('%d-%m-%Y').to_numpy()
+        outlets['last_seen'] = pd.to_datetime(known['last_seen']).dt.strftime('%d-%m-%Y').to_numpy()
+    else:
+        outlets['total_visits'] = np.nan
+        outlets['first_seen'] = None
+        outlets['last_seen'] = None
+    return outlets[_located(outlets, bbox)], outlet_names, outlet_ids
+
+
+def compact_points(dataset, rows, bbox=None, outlet_master=None):
+    """
+    Columnar punch-in and visit points for the given dataset rows, deduplicated
+    the same way as the marker rendering: one punch-in marker per location and
+    day, and one visit marker per location, day and outlet. With an
+    outlet_master, visits are instead drawn as one marker per outlet (see
+    outlet_points). With a bbox, only the points inside it are included.
+    """
+    columns = dataset.columns
+    frame = dataset.frame
+    employee_index, employee_codes = pd.factorize(dataset.codes[rows])
+    employees = dataset.employees[employee_codes].tolist()
+    days = dataset.seconds[rows] // 86400
+
+    outlet_codes, outlets = _lookup(frame, columns.get('outlet_name_col'), rows)
+    outlet_id_codes, outlet_ids = _lookup(frame, columns.get('outlet_id_col'), rows)
+
+    punch = pd.DataFrame({
+        'lat': dataset.punch_lat[rows], 'lon': dataset.punch_lon[rows], 'day': days,
+        'emp': employee_index, 't': dataset.seconds[rows].astype(np.float64),
+    })
+    punch = punch[_located(punch, bbox)].drop_duplicates(['lat', 'lon', 'day'])
+    points = {
+        'employees': employees,
+        'outlets': outlets,
+        'outlet_ids': outlet_ids,
+        'punch': {
+            'lat': _nullable(punch['lat'], COORDINATE_DECIMALS),
+            'lon': _nullable(punch['lon'], COORDINATE_DECIMALS),
+            'emp': punch['emp'].tolist(),
+            't': _nullable(punch['t']),
+        },
+    }
+
+    if outlet_master is not None:
+        visit, _, _ = outlet_points(dataset, rows, outlet_master, bbox)
+        points['visit'] = {
+            'lat': _nullable(visit['lat'], COORDINATE_DECIMALS),
+            'lon': _nullable(visit['lon'], COORDINATE_DECIMALS),
+            'outlet': _nullable(visit['outlet']),
+            'outlet_id': _nullable(visit['outlet_id']),
+            'n': visit['visits'].tolist(),
+            'emps': visit['employees'].tolist(),
+            'first': _nullable(visit['first']),
+            'last': _nullable(visit['last']),
+            'total': _nullable(visit['total_visits']),
+            'first_seen': visit['first_seen'].tolist(),
+            'last_seen': visit['last_seen'].tolist(),
+        }
+        return points
+
+    if PARSED_VISIT_TIME_COL in frame.columns:
+        visit_seconds = _time_seconds(frame[PARSED_VISIT_TIME_COL].to_numpy()[rows])
+    else:
+        visit_seconds = np.full(len(rows), np.nan)
+    visit = pd.DataFrame({
+        'lat': dataset.visit_lat[rows], 'lon': dataset.visit_lon[rows], 'day': days,
+        'emp': employee_index, 't': visit_seconds, 'outlet': outlet_codes, 'outlet_id': outlet_id_codes,
+    })
+    visit = visit[_located(visit, bbox)].drop_duplicates(['lat', 'lon', 'day', 'outlet'])
+    points['visit'] = {
+        'lat': _nullable(visit['lat'], COORDINATE_DECIMALS),
+        'lon': _nullable(visit['lon'], COORDINATE_DECIMALS),
+        'emp': visit['emp'].tolist(),
+        't': _nullable(visit['t']),
+        'outlet': _nullable(visit['outlet']),
+        'outlet_id': _nullable(visit['outlet_id']),
+    }
+    return points
+
+
+def daily_route_parts(dataset, start_row, stop_row, tolerance_m=0):
+    """
+    One employee's punch-in track split at day boundaries, as a list of
+    ('YYYY-MM-DD', [[lat, lon], ...]) pairs. Points without coordinates are
+    skipped, and days with a single located point are left out, since a
+    single point cannot be drawn as a line. With a tolerance, each day is
+    simplified with simplify_route (its first and last points always stay).
+    """
+    lat = dataset.punch_lat[start_row:stop_row]
+    lon = dataset.punch_lon[start_row:stop_row]
+    days = dataset.seconds[start_row:stop_row] // 86400
+    keep = np.isfinite(lat) & np.isfinite(lon)
+    lat, lon, days = lat[keep], lon[keep], days[keep]
+    if not len(lat):
+        return []
+    if tolerance_m > 0:
+        keep = simplify_route(lat, lon, tolerance_m, days)
+        lat, lon, days = lat[keep], lon[keep], days[keep]
+
+    coords = np.round(np.column_stack([lat, lon]), COORDINATE_DECIMALS)
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    stops = np.r_[starts[1:], len(days)]
+    return [
+        (str(days[start].astype('datetime64[D]')), coords[start:stop].tolist())
+        for start, stop in zip(starts, stops)
+        if stop - start > 1
+    ]
+
+
+def route_detail_tolerances(dataset, selection, tolerance_m):
+    """Simplification tolerance in metres for each of ROUTE_DETAIL_ZOOMS."""
+    rows = dataset.row_index(selection)
+    lat = dataset.punch_lat[rows]
+    mean_lat = np.nanmean(lat) if np.isfinite(lat).any() else 0.0
+    metres_per_pixel = METRES_PER_PIXEL_ZOOM_0 * np.cos(np.radians(mean_lat))
+    return [max(tolerance_m, metres_per_pixel / 2 ** zoom) for zoom in ROUTE_DETAIL_ZOOMS]
+
+
+def add_route_layers(fmap, dataset, selection, employee_colors, day_layers=False, tolerance_m=0, zoom_levels=False):
+    """
+    Draw each employee's route, one polyline part per day, in a "Routes: <employee>"
+    group, so whole routes can be toggled in the LayerControl. With
+    day_layers, every day also gets its own sub-layer that can be toggled on
+    its own. All routes are shipped as one RouteLayer payload.
+
+    Routes are simplified to tolerance_m metres before they are serialized
+    (distances are always computed on the full track). With zoom_levels,
+    each day carries one level of detail per ROUTE_DETAIL_ZOOMS entry and
+    the browser switches between them as the map is zoomed.
+    """
+    tolerances = route_detail_tolerances(dataset, selection, tolerance_m) if zoom_levels else None
+    routes = []
+    for emp, start_row, stop_row in selection:
+        if tolerances:
+            # Every level keeps each day's first and last points, so all levels hold the same days
+            levels = [daily_route_parts(dataset, start_row, stop_row, tol) for tol in tolerances]
+            days = []
+            for i, (day, _) in enumerate(levels[-1]):
+                day_levels = []
+                for zoom, level in zip(ROUTE_DETAIL_ZOOMS, levels):
+                    # Short days are often identical at every level; ship them once
+                    if not day_levels or level[i][1] != day_levels[-1][1]:
+                        day_levels.append([zoom, level[i][1]])
+                days.append([day, day_levels])
+        else:
+            days = [list(part) for part in daily_route_parts(dataset, start_row, stop_row, tolerance_m)]
+        if days:
+            routes.append([str(emp), employee_colors[emp], days])
+    RouteLayer(routes, day_layers, bool(tolerances), weight=4, opacity=0.7).add_to(fmap)
+
+
+def add_compact_layers(fmap, dataset, selection, outlet_master):
+    """
+    Compact rendering: every punch-in point and one marker per visited outlet
+    in one browser-built marker cluster.
+    """
+    points = compact_points(dataset, dataset.row_index(selection), outlet_master=outlet_master)
+    CompactMarkerCluster(points, name="Locations").add_to(fmap)
+
+
+def add_clustered_layers(fmap, dataset, selection, street_zoom, max_markers, outlet_master):
+    """
+    Server-clustered rendering for very large selections: grid clusters
+    precomputed for every zoom level below street_zoom, and individual
+    markers from there on (see GridClusterLayer). Street level starts
+    earlier if a cluster level would barely merge any points.
+    """
+    points = compact_points(dataset, dataset.row_index(selection), outlet_master=outlet_master)
+    lat = np.array(points['punch']['lat'] + points['visit']['lat'], dtype=np.float64)
+    lon = np.array(points['punch']['lon'] + points['visit']['lon'], dtype=np.float64)
+    is_visit = np.r_[np.zeros(len(points['punch']['lat'])), np.ones(len(points['visit']['lat']))]
+
+    levels = cluster_pyramid(lat, lon, is_visit, street_zoom - 1) if len(lat) and street_zoom > 0 else []
+    for zoom, level in enumerate(levels):
+        if len(level['count']) > len(lat) * (1 - MIN_CLUSTER_REDUCTION):
+            levels = levels[:zoom]
+            break
+    GridClusterLayer(points, levels, len(levels), max_markers, name="Locations").add_to(fmap)
+
+
+class VerificationLayer(_InlineData, Layer):
+    """
+    Visit locations as circles coloured by their geofence status (see
+    verification.verify_visits), drawn on a canvas so that tens of
+    thousands of visits stay responsive. Popups are built when opened.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var v = {{ this.data_name() }};
+                var renderer = L.canvas({padding: 0.5}), layer = L.featureGroup();
+                function esc(value) {
+                    return value === null || value === undefined ? 'N/A' : String(value).replace(/[&<>"']/g, function(c) { return '&#' + c.charCodeAt(0) + ';'; });
+                }
+                v.lat.forEach(function(lat, i) {
+                    var status = v.statuses[v.status[i]];
+                    var circle = L.circleMarker([lat, v.lon[i]], {
+                        renderer: renderer, radius: 6, weight: 1, color: '#1f2937',
+                        fillColor: v.colors[v.status[i]], fillOpacity: 0.85
+                    });
+                    circle.bindPopup(function() {
+                        return '<strong>Employee:</strong> ' + esc(v.employees[v.emp[i]]) + '<br>' +
+                            '<strong>Outlet:</strong> ' + esc(v.outlets[v.outlet[i]]) + '<br>' +
+                            '<strong>Visit Time:</strong> ' + esc(v.time[i]) + '<br>' +
+                            '<strong>Distance to outlet:</strong> ' + (v.distance[i] === null ? 'N/A' : v.distance[i] + ' m') + '<br>' +
+                            '<strong>Status:</strong> ' + esc(status);
+                    });
+                    layer.addLayer(circle);
+                });
+                return layer;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, visits, name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'VerificationLayer'
+        self.visits = visits
+
+    def data(self):
+        return self.visits
+
+
+# Fill colour of each verification status on the map
+VERIFICATION_COLORS = {'within': '#16a34a', 'outside': '#dc2626', 'no_reference': '#9ca3af'}
+
+
+def add_verification_layer(fmap, verified):
+    """Geofence check of the selected visits as a colour-coded layer (see VerificationLayer)."""
+    statuses = list(VERIFICATION_COLORS)
+    emp_codes, employees = pd.factorize(verified['employee'])
+    outlet_labels = verified['outlet_name'].fillna('N/A').astype(str) + ' (ID: ' + verified['outlet_id'].fillna('N/A').astype(str) + ')'
+    outlet_codes, outlets = pd.factorize(outlet_labels)
+    visits = {
+        'statuses': statuses,
+        'colors': [VERIFICATION_COLORS[status] for status in statuses],
+        'employees': [str(emp) for emp in employees],
+        'outlets': [str(outlet) for outlet in outlets],
+        'lat': _nullable(verified['visit_lat'].to_numpy(), COORDINATE_DECIMALS),
+        'lon': _nullable(verified['visit_lon'].to_numpy(), COORDINATE_DECIMALS),
+        'status': pd.Categorical(verified['status'], categories=statuses).codes.tolist(),
+        'emp': emp_codes.tolist(),
+        'outlet': _nullable(outlet_codes),
+        'time': verified['visit_time'].tolist(),
+        'distance': _nullable(verified['distance_m'].to_numpy(), 1),
+    }
+    VerificationLayer(visits, name="Visit Verification").add_to(fmap)
@@ -0,0 +1,240 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from file_lock import locked, replace_file
+
+# Outlets seen across all uploads: canonical coordinates, visit counts and
+# first/last-seen dates per outlet ID. Set OUTLET_MASTER_PATH to an empty
+# string to disable it.
+OUTLET_MASTER_PATH = os.getenv(
+    'OUTLET_MASTER_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'outlet_master.csv')
+)
+
+MASTER_COLUMNS = ['outlet_id', 'outlet_name', 'lat', 'lon', 'located_visits', 'visits', 'first_seen', 'last_seen']
+
+# The master file starts with this comment line listing the sources (dataset
+# IDs) merged into it, so the master and its sources are replaced together
+SOURCES_PREFIX = '# merged sources:'
+
+# The second comment line names the file holding the keys (Dataset.visit_keys)
+# of the visits counted so far. Each update writes a new keys file before the
+# master that names it, so the two are replaced together as well.
+VISITS_PREFIX = '# merged visits:'
+
+# Last master read from disk, reused while the file is unchanged
+_loaded = {'version': None, 'master': None, 'sources': set()}
+
+
+def empty_master():
+    return pd.DataFrame({col: pd.Series(dtype=object if col in ('outlet_id', 'outlet_name') else np.float64)
+                         for col in MASTER_COLUMNS}).set_index('outlet_id')
+
+
+def outlet_master_version():
+    """Changes whenever the master file is rewritten (for cache keys)."""
+    try:
+        return os.stat(OUTLET_MASTER_PATH).st_mtime_ns
+    except (OSError, TypeError):
+        return 0
+
+
+def _read_master():
+    """
+    (master, merged sources, visit keys file name) as stored on disk.
+    Raises OSError or ValueError if the file cannot be read.
+    """
+    with open(OUTLET_MASTER_PATH, newline='') as f:
+        sources, visits_file = set(), None
+        line = f.readline()
+        if line.startswith(SOURCES_PREFIX):
+            sources = set(line[len(SOURCES_PREFIX):].split())
+            position = f.tell()
+            line = f.readline()
+            if line.startswith(VISITS_PREFIX):
+                visits_file = line[len(VISITS_PREFIX):].strip() or None
+            else:
+                f.seek(position)
+        else:
+            f.seek(0)
+        try:
+            master = pd.read_csv(f, dtype={'outlet_id': str, 'outlet_name': str},
+                                 parse_dates=['first_seen', 'last_seen'])
+            return master.set_index('outlet_id'), sources, visits_file
+        except KeyError as e:
+            raise ValueError(f"missing column {e}")
+
+
+def _visits_path(visits_file):
+    # Keys files always sit next to the master
+    return os.path.join(os.path.dirname(os.path.abspath(OUTLET_MASTER_PATH)), os.path.basename(visits_file))
+
+
+def _read_visit_keys(visits_file):
+    """The sorted keys of the visits already counted (empty without a keys file)."""
+    if not visits_file:
+        return np.empty(0, dtype=np.uint64)
+    return np.load(_visits_path(visits_file))
+
+
+def _write_visit_keys(keys):
+    """Write keys to a new, uniquely named file next to the master and return its name."""
+    directory = os.path.dirname(os.path.abspath(OUTLET_MASTER_PATH))
+    prefix = os.path.splitext(os.path.basename(OUTLET_MASTER_PATH))[0] + '.visits-'
+    fd, path = tempfile.mkstemp(dir=directory, prefix=prefix, suffix='.npy')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, keys)
+        os.chmod(path, 0o644)
+    except BaseException:
+        os.remove(path)
+        raise
+    return os.path.basename(path)
+
+
+def _write_master(f, master, sources, visits_file):
+    out = master.reset_index()[MASTER_COLUMNS]
+    for col in ('first_seen', 'last_seen'):
+        out[col] = pd.to_datetime(out[col]).dt.strftime('%Y-%m-%d')
+    f.write(f"{SOURCES_PREFIX} {' '.join(sorted(sources))}\n")
+    f.write(f"{VISITS_PREFIX} {visits_file}\n")
+    out.to_csv(f, index=False)
+
+
+def _load():
+    version = outlet_master_version()
+    if not version:
+        return empty_master(), set()
+    if _loaded['version'] != version:
+        try:
+            master, sources, _ = _read_master()
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable outlet master '{OUTLET_MASTER_PATH}': {e}")
+            return empty_master(), set()
+        _loaded.update(version=version, master=master, sources=sources)
+    return _loaded['master'], _loaded['sources']
+
+
+def load_outlet_master():
+    """The outlet master as a DataFrame indexed by outlet ID (empty if there is none yet)."""
+    return _load()[0]
+
+
+def merged_sources():
+    """IDs of the sources (datasets) already merged into the master."""
+    return set(_load()[1])
+
+
+def outlet_summary(dataset, rows=None):
+    """
+    Per-outlet totals of the visits in the given dataset rows (all rows by
+    default): the median visit location, the number of visits and of located
+    visits, and the first and last punch-in date. Rows without an outlet ID
+    are left out. Returns a DataFrame indexed by outlet ID.
+    """
+    id_col = dataset.columns.get('outlet_id_col')
+    if not id_col or id_col not in dataset.frame.columns:
+        return empty_master()
+    if rows is None:
+        rows = np.arange(len(dataset))
+    frame = dataset.frame
+    outlet_ids = frame[id_col].take(rows)
+    name_col = dataset.columns.get('outlet_name_col')
+    visits = pd.DataFrame({
+        'outlet_id': np.asarray(outlet_ids.astype(str), dtype=object),
+        'outlet_name': frame[name_col].take(rows).astype(str).to_numpy() if name_col else None,
+        'lat': dataset.visit_lat[rows],
+        'lon': dataset.visit_lon[rows],
+        'day': dataset.punch_time[rows].astype('datetime64[D]'),
+    })[outlet_ids.notna().to_numpy()]
+    summary = visits.groupby('outlet_id').agg(
+        outlet_name=('outlet_name', 'last'),
+        lat=('lat', 'median'),
+        lon=('lon', 'median'),
+        located_visits=('lat', 'count'),
+        visits=('day', 'size'),
+        first_seen=('day', 'min'),
+        last_seen=('day', 'max'),
+    )
+    return summary[MASTER_COLUMNS[1:]]
+
+
+def merge_outlet_summaries(master, summary):
+    """
+    Fold an upload's outlet summary into the master. Canonical coordinates
+    are the average of each upload's median location weighted by its located
+    visits, so one upload's GPS outliers barely move them and the master
+    never needs the earlier uploads' rows again.
+    """
+    if master.empty:
+        return summary.copy()
+    if summary.empty:
+        return master
+    old = master.reindex(summary.index)
+    seen = old['visits'].notna().to_numpy()
+    old_weight = old['located_visits'].fillna(0).to_numpy()
+    new_weight = summary['located_visits'].to_numpy(dtype=np.float64)
+    weight = old_weight + new_weight
+
+    merged = summary.copy()
+    for coord in ('lat', 'lon'):
+        old_sum = np.nan_to_num(old[coord].to_numpy(dtype=np.float64)) * old_weight
+        new_sum = np.nan_to_num(summary[coord].to_numpy(dtype=np.float64)) * new_weight
+        with np.errstate(invalid='ignore', divide='ignore'):
+            merged[coord] = np.where(weight > 0, (old_sum + new_sum) / weight, np.nan)
+    merged['located_visits'] = weight.astype(np.int64)
+    merged['visits'] = (old['visits'].fillna(0).to_numpy() + summary['visits'].to_numpy()).astype(np.int64)
+    merged['first_seen'] = np.where(seen, np.minimum(old['first_seen'], summary['first_seen']), summary['first_seen'])
+    merged['last_seen'] = np.where(seen, np.maximum(old['last_seen'], summary['last_seen']), summary['last_seen'])
+    merged['outlet_name'] = merged['outlet_name'].fillna(old['outlet_name'])
+
+    # Outlets this upload did not visit are kept as they are
+    return pd.concat([master[~master.index.isin(summary.index)], merged]).sort_index()
+
+
+def update_outlet_master(dataset, rows=None, source_id=None):
+    """
+    Merge the outlets of a dataset (or of some of its rows) into the
+    persistent master. Each source (the dataset ID by default) is merged only
+    once, and visits already counted from another source (e.g. a daily file
+    that is part of a later merged upload) are skipped by their visit keys,
+    so no visit is counted twice. The whole check, merge and write runs
+    under a file lock, so concurrent uploads (in any worker or thread) are
+    applied one after the other. An unreadable master is left as it is.
+    Returns (updated master, error_message).
+    """
+    if not OUTLET_MASTER_PATH:
+        return empty_master(), None
+    source_id = source_id or dataset.dataset_id
+    rows = np.arange(len(dataset)) if rows is None else np.asarray(rows)
+    keys, first = np.unique(dataset.visit_keys(rows), return_index=True)
+    with locked(OUTLET_MASTER_PATH):
+        # Read from disk, not the cache: another worker may have just written it
+        try:
+            if outlet_master_version():
+                master, sources, visits_file = _read_master()
+                seen = _read_visit_keys(visits_file)
+            else:
+                master, sources, visits_file, seen = empty_master(), set(), None, np.empty(0, dtype=np.uint64)
+        except (OSError, ValueError) as e:
+            print(f"Not updating unreadable outlet master '{OUTLET_MASTER_PATH}': {e}")
+            return None, f'The outlet master could not be read and was not updated: {e}'
+        if source_id and source_id in sources:
+            return master, None
+
+        new = ~np.isin(keys, seen, assume_unique=True)
+        master = merge_outlet_summaries(master, outlet_summary(dataset, np.sort(rows[first[new]])))
+        if source_id:
+            sources = sources | {source_id}
+        new_visits_file = _write_visit_keys(np.union1d(seen, keys[new]))
+        try:
+            replace_file(OUTLET_MASTER_PATH, lambda f: _write_master(f, master, sources, new_visits_file))
+        except BaseException:
+            os.remove(_visits_path(new_visits_file))
+            raise
+        if visits_file and os.path.exists(_visits_path(visits_file)):
+            os.remove(_visits_path(visits_file))
+    return master, None
@@ -0,0 +1,50 @@
+import os
+import threading
+
+from dataset_cache import load_cached_dataset
+from lru import SizedLRUCache
+
+# Datasets held in memory by one worker, in MB. Least recently used datasets
+# are dropped beyond this; they are reloaded (memory-mapped) from the dataset
+# cache directory on their next use.
+DATASET_MEMORY_BUDGET_MB = int(os.getenv('DATASET_MEMORY_BUDGET_MB', 2048))
+
+
+class DatasetRegistry:
+    """
+    Uploaded datasets keyed by dataset ID (the upload's content hash).
+
+    Each upload gets its own entry, so concurrent uploads no longer overwrite
+    each other. A worker that has not seen an ID yet (e.g. another gunicorn
+    worker handled the upload) loads it from the on-disk cache. Those files
+    are memory-mapped, so all workers share one copy through the page cache.
+    """
+
+    def __init__(self, max_bytes):
+        self._datasets = SizedLRUCache(max_bytes, sizeof=lambda dataset: dataset.nbytes)
+        self._lock = threading.Lock()
+
+    def add(self, dataset):
+        self._datasets.put(dataset.dataset_id, dataset)
+
+    def get(self, dataset_id):
+        """Return the dataset for dataset_id, or None if it is unknown."""
+        if not dataset_id:
+            return None
+        dataset = self._datasets.get(dataset_id)
+        if dataset is None:
+            # Serialize disk loads so concurrent requests for one ID load it once
+            with self._lock:
+                dataset = self._datasets.get(dataset_id)
+                if dataset is None:
+                    dataset = load_cached_dataset(dataset_id)
+                    if dataset is not None:
+                        self._datasets.put(dataset_id, dataset)
+        return dataset
+
+    def __len__(self):
+        return len(self._datasets)
+
+    @property
+    def total_bytes(self):
+        return self._datasets.total_bytes
@@ -0,0 +1,177 @@
+import os
+
+import numpy as np
+
+from distance import EARTH_RADIUS_KM, haversine_km
+
+# Side of a grid cell in degrees (0.01 is about 1.1 km of latitude). Smaller
+# cells mean fewer candidates per query but more cells to look up for large
+# boxes; at this size a city-sized box touches a few hundred cells.
+SPATIAL_CELL_DEG = float(os.getenv('SPATIAL_CELL_DEG', 0.01))
+
+METRES_PER_DEGREE = EARTH_RADIUS_KM * 1000 * np.pi / 180
+HALF_EARTH_CIRCUMFERENCE_M = EARTH_RADIUS_KM * 1000 * np.pi
+
+
+def _located(lat, lon):
+    """
+    Mask of the points with a valid location. Points off the globe (latitude
+    beyond +-90, longitude beyond +-180) are left out like missing ones: their
+    cell numbers would be negative or overflow, breaking the key order.
+    """
+    return np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90.0) & (np.abs(lon) <= 180.0)
+
+
+class GridIndex:
+    """
+    Spatial index over one pair of coordinate arrays (e.g. the punch-in
+    locations of a Dataset).
+
+    Located points are bucketed into square lat/lon cells and sorted by cell,
+    column by column, so the cells of one grid column that overlap a query
+    box form a single contiguous run found with two binary searches. Queries
+    only test the points of the overlapping cells, never the whole dataset.
+    All query methods return indexes into the original arrays. Points without
+    a valid location are not indexed, so no query returns them.
+    """
+
+    def __init__(self, lat, lon, cell_deg=SPATIAL_CELL_DEG):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        self.cell_deg = cell_deg
+        rows = np.flatnonzero(_located(lat, lon))
+        keys = self._keys(lat[rows], lon[rows])
+        order = np.argsort(keys, kind='stable')
+        self.rows = rows[order]
+        self.keys = keys[order]
+        # Coordinates in index order, so candidate tests read memory sequentially
+        self.lat = lat[self.rows]
+        self.lon = lon[self.rows]
+
+    def merge(self, lat, lon, rows, row_map):
+        """
+        A new index holding this index's points plus new ones, without
+        re-sorting the existing points: row_map maps every old row number to
+        its new one (increasing, e.g. after rows were inserted) and lat, lon
+        are the coordinates of the new points at row numbers rows. Only the
+        new points are sorted; they are then inserted by binary search.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        located = _located(lat, lon)
+        lat, lon, rows = lat[located], lon[located], np.asarray(rows)[located]
+        keys = self._keys(lat, lon)
+        order = np.argsort(keys, kind='stable')
+        keys, lat, lon, rows = keys[order], lat[order], lon[order], rows[order]
+
+        positions = np.searchsorted(self.keys, keys, side='right')
+        index = GridIndex.__new__(GridIndex)
+        index.cell_deg = self.cell_deg
+        index.rows = np.insert(row_map[self.rows], positions, rows)
+        index.keys = np.insert(self.keys, positions, keys)
+        index.lat = np.insert(self.lat, positions, lat)
+        index.lon = np.insert(self.lon, positions, lon)
+        return index
+
+    def _cells(self, lat, lon):
+        cx = np.floor((np.asarray(lon) + 180.0) / self.cell_deg).astype(np.int64)
+        cy = np.floor((np.asarray(lat) + 90.0) / self.cell_deg).astype(np.int64)
+        return cx, cy
+
+    def _keys(self, lat, lon):
+        cx, cy = self._cells(lat, lon)
+        return cx << 32 | cy
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes + self.keys.nbytes + self.lat.nbytes + self.lon.nbytes
+
+    def _candidates(self, west, south, east, north):
+        """Index positions of the points in all cells overlapping the box."""
+        # Boxes are clipped to the globe (radius splits circles that wrap around the antimeridian)
+        west, east = max(west, -180.0), min(east, 180.0)
+        south, north = max(south, -90.0), min(north, 90.0)
+        if west > east or south > north:
+            return np.empty(0, dtype=np.int64)
+        (cx0, cx1), (cy0, cy1) = self._cells([south, north], [west, east])
+        columns = np.arange(cx0, cx1 + 1, dtype=np.int64) << 32
+        starts = np.searchsorted(self.keys, columns | cy0, side='left')
+        stops = np.searchsorted(self.keys, columns | cy1, side='right')
+        lengths = stops - starts
+        total = int(lengths.sum())
+        if not total:
+            return np.empty(0, dtype=np.int64)
+        # Concatenate the runs starts[i]:stops[i] without a Python loop
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(total)
+
+    def bbox(self, west, south, east, north):
+        """Rows inside the box (edges included), in index order."""
+        positions = self._candidates(west, south, east, north)
+        lat, lon = self.lat[positions], self.lon[positions]
+        inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+        return self.rows[positions[inside]]
+
+    def radius(self, lat, lon, radius_m):
+        """
+        Rows within radius_m metres of (lat, lon) and their distances, nearest
+        first. Circles that cross the antimeridian wrap around to the other side.
+        """
+        dlat = radius_m / METRES_PER_DEGREE
+        cos_lat = np.cos(np.radians(min(abs(lat) + dlat, 90.0)))
+        dlon = 180.0 if cos_lat < 1e-9 else min(dlat / cos_lat, 180.0)
+        west, east = lon - dlon, lon + dlon
+        if dlon >= 180.0:
+            boxes = [(-180.0, 180.0)]
+        elif west < -180.0:
+            # The circle crosses the antimeridian: search the part beyond it at the other edge of the map
+            boxes = [(-180.0, east), (west + 360.0, 180.0)]
+        elif east > 180.0:
+            boxes = [(west, 180.0), (-180.0, east - 360.0)]
+        else:
+            boxes = [(west, east)]
+        positions = np.concatenate([self._candidates(w, lat - dlat, e, lat + dlat) for w, e in boxes])
+        distances = haversine_km(lat, lon, self.lat[positions], self.lon[positions]) * 1000
+        inside = distances <= radius_m
+        positions, distances = positions[inside], distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return self.rows[positions[order]], distances[order]
+
+    def nearest(self, lat, lon, k, max_radius_m=None, where=None):
+        """
+        The k rows nearest to (lat, lon) (within max_radius_m, if given) and
+        their distances in metres, nearest first. The search radius starts at
+        one cell and grows until k points are found. where, if given, maps an
+        array of rows to a mask of the rows that may be returned.
+        """
+        limit = HALF_EARTH_CIRCUMFERENCE_M if max_radius_m is None else min(max_radius_m, HALF_EARTH_CIRCUMFERENCE_M)
+        search_m = min(self.cell_deg * METRES_PER_DEGREE, limit)
+        while True:
+            rows, distances = self.radius(lat, lon, search_m)
+            if where is not None:
+                allowed = where(rows)
+                rows, distances = rows[allowed], distances[allowed]
+            if len(rows) >= k or search_m >= limit:
+                return rows[:k], distances[:k]
+            search_m = min(search_m * 4, limit)
+
+    def polygon(self, vertices):
+        """
+        Rows inside a polygon given as [[lat, lon], ...] (even-odd rule,
+        points on an edge may fall either way), in index order.
+        """
+        vertices = np.asarray(vertices, dtype=np.float64)
+        vy, vx = vertices[:, 0], vertices[:, 1]
+        positions = self._candidates(vx.min(), vy.min(), vx.max(), vy.max())
+        y, x = self.lat[positions], self.lon[positions]
+        inside = np.zeros(len(positions), dtype=bool)
+        # Ray casting, one polygon edge at a time over all candidates
+        for x1, y1, x2, y2 in zip(vx, vy, np.roll(vx, -1), np.roll(vy, -1)):
+            if y1 == y2:
+                continue
+            crosses = (y1 > y) != (y2 > y)
+            inside ^= crosses & (x < (x2 - x1) * (y - y1) / (y2 - y1) + x1)
+        return self.rows[positions[inside]]
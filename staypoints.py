@@ -0,0 +1,176 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset import format_datetimes
+from distance import SECONDS_PER_DAY, haversine_km
+
+# A stay is a run of consecutive punches that all lie within STAY_RADIUS_M
+# metres of the run's first punch and span at least STAY_MIN_MINUTES
+STAY_RADIUS_M = float(os.getenv('STAY_RADIUS_M', 100))
+STAY_MIN_MINUTES = float(os.getenv('STAY_MIN_MINUTES', 10))
+
+# Runs are followed this many points ahead for every stay candidate at once;
+# longer runs are scanned one by one, only where a stay actually starts
+_RUN_SCAN_OFFSETS = 64
+
+
+def _stay_starts(lat, lon, seconds, group_ids, radius_m, min_duration_s):
+    """
+    Whether each point i starts a run of at least min_duration_s: every
+    point up to the first one min_duration_s after it lies within radius_m
+    of it and in the same group. Checked one offset at a time for the points
+    still undecided, so the work per point is bounded by the points in one
+    min_duration_s window, however long its run lasts.
+    """
+    n = len(lat)
+    is_start = np.zeros(n, dtype=bool)
+    open_points = np.arange(n)
+    offset = 0
+    while len(open_points):
+        later = open_points + offset
+        # Points whose window runs past the end of the track are never stays
+        in_range = later < n
+        open_points, later = open_points[in_range], later[in_range]
+        left = (group_ids[later] != group_ids[open_points]) | (
+            haversine_km(lat[open_points], lon[open_points], lat[later], lon[later]) * 1000 > radius_m
+        )
+        long_enough = ~left & (seconds[later] - seconds[open_points] >= min_duration_s)
+        is_start[open_points[long_enough]] = True
+        open_points = open_points[~left & ~long_enough]
+        offset += 1
+    return is_start
+
+
+def _run_ends(lat, lon, group_ids, radius_m, points, max_offset):
+    """
+    For each of the given points, the index of the first later point that is
+    farther than radius_m from it or belongs to another group, computed one
+    offset at a time for all of them. Runs longer than max_offset points are
+    left undecided (-1), so long runs cost at most max_offset passes.
+    """
+    n = len(lat)
+    ends = np.full(len(points), -1)
+    open_points = np.arange(len(points))
+    for offset in range(1, max_offset + 1):
+        if not len(open_points):
+            break
+        anchors = points[open_points]
+        later = anchors + offset
+        # Runs that reach the end of the track end there
+        past_end = later >= n
+        ends[open_points[past_end]] = n
+        open_points, anchors, later = open_points[~past_end], anchors[~past_end], later[~past_end]
+        left = (group_ids[later] != group_ids[anchors]) | (
+            haversine_km(lat[anchors], lon[anchors], lat[later], lon[later]) * 1000 > radius_m
+        )
+        ends[open_points[left]] = later[left]
+        open_points = open_points[~left]
+    return ends
+
+
+def _run_end(lat, lon, group_ids, radius_m, start):
+    """
+    The end of one run (as in _run_ends), scanning forward in doubling
+    blocks, so a long run costs time proportional to its length.
+    """
+    n = len(lat)
+    lo, size = start + 1, 64
+    while lo < n:
+        hi = min(n, lo + size)
+        left = (group_ids[lo:hi] != group_ids[start]) | (
+            haversine_km(lat[start], lon[start], lat[lo:hi], lon[lo:hi]) * 1000 > radius_m
+        )
+        hits = np.flatnonzero(left)
+        if len(hits):
+            return lo + int(hits[0])
+        lo, size = hi, size * 2
+    return n
+
+
+def detect_stays(lat, lon, seconds, group_ids, radius_m=STAY_RADIUS_M, min_duration_s=STAY_MIN_MINUTES * 60):
+    """
+    Stay points of a time-sorted track (the classic anchor-based algorithm).
+
+    Starting from a punch, the run of following punches within radius_m of
+    it is a stay if it spans at least min_duration_s; the next stay is then
+    searched after the run, otherwise from the next punch. Runs never cross
+    a change of group id (a new employee or day). Points with missing
+    coordinates must be removed beforehand. Returns (starts, stops): the
+    index ranges [start, stop) of the stays.
+    """
+    n = len(lat)
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    is_stay = _stay_starts(lat, lon, seconds, group_ids, radius_m, min_duration_s)
+
+    # next_candidate[i]: the first point at or after i that starts a stay (n if none)
+    candidates = np.where(is_stay, np.arange(n), n)
+    next_candidate = np.append(np.minimum.accumulate(candidates[::-1])[::-1], n)
+
+    # Ends of the candidates' runs, except for long runs: those are scanned only
+    # for the stays actually visited below (stays never overlap, so together
+    # that is one pass), as each point of a long run would otherwise rescan it
+    ends = np.full(n + 1, -1)
+    ends[candidates[is_stay]] = _run_ends(lat, lon, group_ids, radius_m, candidates[is_stay], _RUN_SCAN_OFFSETS)
+
+    # Only the stays themselves are visited; everything between them is skipped at once
+    starts, stops = [], []
+    i = next_candidate[0]
+    while i < n:
+        end = ends[i] if ends[i] >= 0 else _run_end(lat, lon, group_ids, radius_m, i)
+        starts.append(i)
+        stops.append(end)
+        i = next_candidate[end]
+    return np.asarray(starts, dtype=np.int64), np.asarray(stops, dtype=np.int64)
+
+
+def selection_stays(dataset, selection, radius_m=STAY_RADIUS_M, min_duration_s=STAY_MIN_MINUTES * 60):
+    """
+    Stays of every employee in a Dataset selection, from the punch-in track
+    split per employee and day. Returns a DataFrame with one row per stay:
+    employee, start, end, duration in minutes, centroid, number of punches
+    and the outlet visited most often during the stay.
+    """
+    rows = dataset.row_index(selection)
+    lat, lon = dataset.punch_lat[rows], dataset.punch_lon[rows]
+    located = np.isfinite(lat) & np.isfinite(lon)
+    rows, lat, lon = rows[located], lat[located].astype(np.float64), lon[located].astype(np.float64)
+    seconds = dataset.seconds[rows]
+    codes = dataset.codes[rows]
+    # One group id per (employee, day), so stays end at midnight
+    group_ids = codes * (1 << 20) + seconds // SECONDS_PER_DAY
+
+    starts, stops = detect_stays(lat, lon, seconds, group_ids, radius_m, min_duration_s)
+    lengths = stops - starts
+    # Centroids from prefix sums, without materialising each stay's points
+    lat_sum = np.r_[0, np.cumsum(lat)]
+    lon_sum = np.r_[0, np.cumsum(lon)]
+
+    stays = pd.DataFrame({
+        'employee': dataset.employees[codes[starts]],
+        'start': format_datetimes(seconds[starts].astype('datetime64[s]')),
+        'end': format_datetimes(seconds[stops - 1].astype('datetime64[s]')),
+        'duration_min': np.round((seconds[stops - 1] - seconds[starts]) / 60, 1),
+        'lat': np.round((lat_sum[stops] - lat_sum[starts]) / np.maximum(lengths, 1), 6),
+        'lon': np.round((lon_sum[stops] - lon_sum[starts]) / np.maximum(lengths, 1), 6),
+        'points': lengths,
+    })
+
+    outlet_col = dataset.columns.get('outlet_id_col')
+    if outlet_col and outlet_col in dataset.frame.columns and len(starts):
+        # Positions of all points of all stays, concatenated without a Python loop
+        stay_ids = np.repeat(np.arange(len(starts)), lengths)
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(int(lengths.sum()))
+        outlet_ids = dataset.frame[outlet_col].take(rows[positions])
+        outlets = pd.DataFrame({
+            'stay': stay_ids,
+            'outlet_id': np.asarray(outlet_ids.astype(str), dtype=object),
+        })[outlet_ids.notna().to_numpy()]
+        counts = outlets.groupby(['stay', 'outlet_id']).size().reset_index(name='n')
+        top = counts.sort_values(['stay', 'n'], ascending=[True, False]).drop_duplicates('stay')
+        stays['outlet_id'] = top.set_index('stay')['outlet_id'].reindex(np.arange(len(starts))).to_numpy()
+    else:
+        stays['outlet_id'] = None
+    return stays
@@ -0,0 +1,64 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live at the repository root and read their configuration from
+# the environment when imported, so point every on-disk store at a scratch
+# directory before any of them is imported
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix='lat-long-tests-')
+os.environ['DATASET_CACHE_DIR'] = os.path.join(SCRATCH_DIR, 'dataset_cache')
+os.environ['OUTLET_MASTER_PATH'] = os.path.join(SCRATCH_DIR, 'outlet_master.csv')
+os.environ['OUTLET_LOCATIONS_PATH'] = os.path.join(SCRATCH_DIR, 'outlet_locations.csv')
+
+
+@pytest.fixture(scope='session', autouse=True)
+def scratch_dir():
+    yield SCRATCH_DIR
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+
+@pytest.fixture
+def make_visits():
+    """
+    Factory for punch/visit exports in the layout of the real files: a few
+    employees, each punching in several times a day around a home location,
+    with a visit to a numbered outlet five minutes after each punch.
+    """
+    def make(employees=4, days=3, per_day=6, seed=0, first_day='2025-07-01'):
+        rng = np.random.default_rng(seed)
+        rows = []
+        for e in range(employees):
+            home_lat, home_lon = 12.9 + e * 0.1, 77.5 + e * 0.1
+            for d in range(days):
+                day = pd.Timestamp(first_day) + pd.Timedelta(days=d)
+                minutes = np.sort(rng.choice(np.arange(9 * 60, 18 * 60), per_day, replace=False))
+                for m in minutes:
+                    punch = day + pd.Timedelta(minutes=int(m))
+                    visit = punch + pd.Timedelta(minutes=5)
+                    outlet = int(rng.integers(0, 20))
+                    lat = home_lat + rng.normal(0, 0.01)
+                    lon = home_lon + rng.normal(0, 0.01)
+                    rows.append({
+                        'Employee Name': f'Emp {e}',
+                        'Punch In Date': punch.strftime('%d-%m-%Y'),
+                        'Punch In Time': punch.strftime('%H:%M:%S'),
+                        'Punch In Lat': lat,
+                        'Punch In Long': lon,
+                        'Outlet Name': f'Outlet {outlet}',
+                        'Outlet ID': f'OUT{outlet:04d}',
+                        'Visit Date': visit.strftime('%d-%m-%Y'),
+                        'Visit Time': visit.strftime('%H:%M:%S'),
+                        'Visit Lat': lat + rng.normal(0, 0.001),
+                        'Visit Long': lon + rng.normal(0, 0.001),
+                    })
+        # Exports are not sorted by employee or time
+        return pd.DataFrame(rows).sample(frac=1, random_state=seed).reset_index(drop=True)
+    return make
@@ -0,0 +1,156 @@
+import io
+import time
+
+import pandas as pd
+import pytest
+
+import app as app_module
+import outlet_master
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # Each test starts from its own outlet master
+    monkeypatch.setattr(outlet_master, 'OUTLET_MASTER_PATH', str(tmp_path / 'outlet_master.csv'))
+    return app_module.app.test_client()
+
+
+def csv_file(data, name='visits.csv'):
+    return io.BytesIO(data.to_csv(index=False).encode('utf-8')), name
+
+
+def upload(client, data, name='visits.csv', **form):
+    response = client.post('/upload_data', data={'file': csv_file(data, name), **form})
+    return response.status_code, response.get_json()
+
+
+def wait(client, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['status'] in ('done', 'failed', 'cancelled'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+def test_upload_lists_employees_by_name(client, make_visits):
+    status, payload = upload(client, make_visits(employees=12, days=2, per_day=3))
+    assert status == 200
+    assert payload['employees'] == sorted(payload['employees'])
+    assert payload['employee_rows'] == [6] * 12
+    assert payload['version'] == 0
+    # The same file again is the same dataset
+    assert upload(client, make_visits(employees=12, days=2, per_day=3))[1]['dataset_id'] == payload['dataset_id']
+
+
+def test_upload_rejects_missing_columns_and_files(client, make_visits):
+    status, payload = upload(client, make_visits().drop(columns=['Outlet ID']))
+    assert status == 400 and 'error' in payload
+    assert client.post('/upload_data', data={}).status_code == 400
+
+
+def test_append_skips_duplicates_and_counts_outlet_visits_once(client, make_visits):
+    data = make_visits(employees=3, days=3, per_day=4, seed=3)
+    base = data[data['Punch In Date'] != '03-07-2025']
+    _, payload = upload(client, base, 'base.csv')
+
+    status, appended = upload(client, data, 'all.csv', mode='append', dataset_id=payload['dataset_id'])
+    assert status == 200
+    assert appended['message'].startswith(f'Appended {len(data) - len(base)} new rows ({len(base)} duplicates skipped).')
+    assert appended['version'] == 1 and appended['dataset_id'] != payload['dataset_id']
+    assert sum(appended['employee_rows']) == len(data)
+
+    # The outlet master counts every visit once, however often it was uploaded
+    master = outlet_master.load_outlet_master()
+    assert master['visits'].sum() == len(data)
+    upload(client, data, 'all.csv', mode='append', dataset_id=appended['dataset_id'])
+    assert outlet_master.load_outlet_master()['visits'].sum() == len(data)
+
+    # Appending needs a dataset to append to
+    status, error = upload(client, data, 'all.csv', mode='append')
+    assert status == 400 and 'dataset_id' in error['error']
+
+
+def test_requests_need_a_known_dataset_id(client, make_visits):
+    response = client.post('/get_map', json={'start_date': '', 'end_date': ''})
+    assert response.status_code == 400 and 'dataset_id' in response.get_json()['error']
+    response = client.post('/get_map', json={'dataset_id': 'f' * 64})
+    assert response.status_code == 400
+    assert client.get('/api/distances').status_code == 400
+
+
+def test_map_is_cached_and_revalidated_with_its_etag(client, make_visits):
+    _, payload = upload(client, make_visits(employees=2, days=2, per_day=4))
+    body = {'dataset_id': payload['dataset_id'], 'start_date': '2025-07-01', 'end_date': '2025-07-02',
+            'render_mode': 'compact'}
+    response = client.post('/get_map', json=body)
+    assert response.status_code == 200 and 'map_html' in response.get_json()
+    etag = response.headers['ETag']
+    assert client.post('/get_map', json=body, headers={'If-None-Match': etag}).status_code == 304
+    # Other filters are another map
+    other = client.post('/get_map', json={**body, 'employee_name': 'Emp 1'}, headers={'If-None-Match': etag})
+    assert other.status_code == 200 and other.headers['ETag'] != etag
+    # Filters that match nothing
+    empty = client.post('/get_map', json={**body, 'start_date': '2030-01-01', 'end_date': '2030-01-02'})
+    assert empty.get_json() == {'error': 'No data found for the selected filters.'}
+
+
+def test_distances_are_reported_per_day(client, make_visits):
+    _, payload = upload(client, make_visits(employees=2, days=3, per_day=4))
+    response = client.get('/api/distances', query_string={'dataset_id': payload['dataset_id']})
+    report = response.get_json()
+    assert len(report['days']) == 6
+    assert set(report['days'][0]) == {'employee', 'date', 'points', 'day_km'}
+    day_km = pd.DataFrame(report['days']).groupby('employee')['day_km'].sum()
+    for total in report['totals']:
+        assert total['sum_of_day_km'] == pytest.approx(day_km[total['employee']], abs=1e-3)
+
+    response = client.get('/api/distances', query_string={'dataset_id': payload['dataset_id'], 'format': 'csv',
+                                                         'employee_name': 'Emp 0'})
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0] == 'employee,date,points,day_km' and len(lines) == 4
+    response = client.get('/api/distances', query_string={'dataset_id': payload['dataset_id'], 'start_date': 'July'})
+    assert response.status_code == 400
+
+
+def test_background_upload_and_render_jobs(client, make_visits):
+    data = make_visits(employees=3, days=2, per_day=4, seed=5)
+    response = client.post('/upload_data', data={'file': csv_file(data), 'background': '1'})
+    assert response.status_code == 202
+    job = wait(client, response.get_json()['job_id'])
+    assert job['status'] == 'done' and job['result']['employees'] == ['Emp 0', 'Emp 1', 'Emp 2']
+
+    body = {'dataset_id': job['result']['dataset_id'], 'render_mode': 'markers', 'background': True}
+    response = client.post('/get_map', json=body)
+    assert response.status_code == 202
+    job = wait(client, response.get_json()['job_id'])
+    assert job['status'] == 'done' and 'map_html' in job['result']
+    # Once rendered, the map is served at once
+    assert client.post('/get_map', json=body).status_code == 200
+
+    response = client.post('/upload_data', data={'file': csv_file(data, 'visits.txt'), 'background': '1'})
+    job = wait(client, response.get_json()['job_id'])
+    assert job['status'] == 'failed' and 'Unsupported file type' in job['error']
+    assert client.get('/api/jobs/' + '0' * 32).status_code == 404
+    assert client.post('/api/jobs/nope/cancel').status_code == 404
+
+
+def test_spatial_queries(client, make_visits):
+    _, payload = upload(client, make_visits(employees=2, days=2, per_day=5))
+    params = {'dataset_id': payload['dataset_id'], 'kind': 'punch'}
+    result = client.get('/api/spatial/bbox', query_string={**params, 'bbox': '77,12,78.5,14'}).get_json()
+    assert result['total'] == 20
+    assert result['employees'] == [{'employee': 'Emp 0', 'count': 10}, {'employee': 'Emp 1', 'count': 10}]
+    # Filters narrow the results to the selected rows
+    result = client.get('/api/spatial/bbox', query_string={**params, 'bbox': '77,12,78.5,14', 'employee_name': 'Emp 1',
+                                                          'start_date': '2025-07-02'}).get_json()
+    assert result['total'] == 5 and {point['employee'] for point in result['points']} == {'Emp 1'}
+
+    result = client.get('/api/spatial/radius', query_string={**params, 'lat': 12.9, 'lon': 77.5, 'radius_m': 5000}).get_json()
+    distances = [point['distance_m'] for point in result['points']]
+    assert result['total'] > 0 and distances == sorted(distances) and max(distances) <= 5000
+    response = client.get('/api/spatial/radius', query_string={**params, 'lat': 12.9, 'lon': 77.5})
+    assert response.status_code == 400
+    response = client.get('/api/spatial/bbox', query_string={**params, 'kind': 'office'})
+    assert response.status_code == 400
@@ -0,0 +1,172 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import build_dataset
+from dataset import Dataset
+
+
+def build(data):
+    dataset, error_message = build_dataset(data.copy())
+    assert error_message is None
+    return dataset
+
+
+def canonical_rows(dataset):
+    """The rows of a dataset by content, in an order that does not depend on employee codes."""
+    rows = pd.DataFrame({
+        'employee': dataset.employees[dataset.codes].astype(str),
+        'seconds': dataset.seconds,
+        'outlet': dataset.frame[dataset.columns['outlet_id_col']].astype(str).to_numpy(),
+        'punch_lat': dataset.punch_lat,
+        'visit_lat': dataset.visit_lat,
+    })
+    return rows.sort_values(list(rows.columns)).reset_index(drop=True)
+
+
+def canonical_daily(dataset):
+    daily = dataset.daily.drop(columns=['employee_code', 'row_start', 'row_stop'])
+    daily.insert(0, 'employee', dataset.employees[dataset.daily['employee_code'].to_numpy()].astype(str))
+    return daily.sort_values(['employee', 'date']).reset_index(drop=True)
+
+
+def assert_consistent(dataset):
+    """The index invariants every Dataset must hold, however it was built."""
+    assert (np.diff(dataset.keys) >= 0).all()
+    assert dataset.offsets[-1] == len(dataset)
+    daily = dataset.daily
+    assert daily['row_start'].iloc[0] == 0 and daily['row_stop'].iloc[-1] == len(dataset)
+    assert (daily['row_stop'].to_numpy()[:-1] == daily['row_start'].to_numpy()[1:]).all()
+    assert (dataset.codes[daily['row_start'].to_numpy()] == daily['employee_code'].to_numpy()).all()
+    for kind, lat in (('punch', dataset.punch_lat), ('visit', dataset.visit_lat)):
+        index = dataset.spatial[kind]
+        assert (np.diff(index.keys) >= 0).all()
+        np.testing.assert_array_equal(index.lat, lat[index.rows])
+
+
+def test_rows_are_sorted_and_summarised_per_day(make_visits):
+    data = make_visits(employees=3, days=2, per_day=5)
+    dataset = build(data)
+    assert_consistent(dataset)
+    assert dataset.employees.tolist() == ['Emp 0', 'Emp 1', 'Emp 2']
+    assert dataset.employee_rows().tolist() == [10, 10, 10]
+    assert len(dataset.daily) == 6
+    assert (dataset.daily['punches'] == 5).all() and (dataset.daily['visits'] == 5).all()
+    assert dataset.dates['value'].tolist() == ['2025-07-01', '2025-07-02']
+
+
+def test_select_by_employee_and_dates(make_visits):
+    dataset = build(make_visits(employees=3, days=4, per_day=5))
+    selection = dataset.select(datetime.date(2025, 7, 2), datetime.date(2025, 7, 3), 'Emp 1')
+    assert [emp for emp, _, _ in selection] == ['Emp 1']
+    rows = Dataset.row_index(selection)
+    days = dataset.punch_time[rows].astype('datetime64[D]')
+    assert len(rows) == 10 and set(days.astype(str)) == {'2025-07-02', '2025-07-03'}
+    assert (dataset.employees[dataset.codes[rows]] == 'Emp 1').all()
+    assert dataset.select(employee_name='Nobody') == []
+    assert len(Dataset.row_index(dataset.select(employee_name=['Emp 0', 'Nobody', 'Emp 2']))) == 40
+    # Dates far outside the sort key's range select everything or nothing
+    assert len(Dataset.row_index(dataset.select(datetime.date(1900, 1, 1), datetime.date(2600, 1, 1)))) == len(dataset)
+    assert dataset.select(datetime.date(2600, 1, 1)) == []
+
+
+def test_rows_outside_the_sort_key_range_are_dropped(make_visits):
+    data = make_visits(employees=2, days=1, per_day=5)
+    data.loc[0, 'Punch In Date'] = '31-12-1969'
+    data.loc[1, 'Employee Name'] = None
+    dataset = build(data)
+    assert len(dataset) == 8
+    assert (dataset.seconds >= 0).all()
+
+
+def test_append_matches_a_full_rebuild(make_visits):
+    data = make_visits(employees=4, days=4, per_day=6)
+    base_rows = data['Punch In Date'] != '03-07-2025'
+    base = data[base_rows]
+    # The next export: the missing day, rows already in the base, a new
+    # employee, and rows repeated within the file itself
+    extra = data[~base_rows]
+    overlap = base.sample(20, random_state=1)
+    new_employee = extra.head(5).assign(**{'Employee Name': 'Aaa New'})
+    appended = pd.concat([extra, overlap, new_employee, extra.head(3)])
+
+    merged, new_rows, error_message = build(base).append(build(appended))
+    assert error_message is None
+    assert merged.version == 1
+    assert len(new_rows) == len(extra) + len(new_employee)
+    assert_consistent(merged)
+
+    rebuilt = build(pd.concat([base, extra, new_employee]))
+    assert len(merged) == len(rebuilt)
+    pd.testing.assert_frame_equal(canonical_rows(merged), canonical_rows(rebuilt))
+    pd.testing.assert_frame_equal(canonical_daily(merged), canonical_daily(rebuilt), check_dtype=False)
+    assert merged.dates.equals(rebuilt.dates)
+    # Existing employees keep their codes; new ones come last
+    assert merged.employees.tolist() == ['Emp 0', 'Emp 1', 'Emp 2', 'Emp 3', 'Aaa New']
+    assert sorted(merged.spatial['punch'].bbox(77.0, 12.0, 78.5, 14.0).tolist()) == np.flatnonzero(
+        np.isfinite(merged.punch_lat)).tolist()
+
+
+def test_append_keeps_repeated_visits_within_one_punch_in(make_visits):
+    data = make_visits(employees=2, days=1, per_day=3)
+    base = build(data)
+    # Same employee and punch-in time, another outlet: a separate visit
+    second_visit = data.head(2).assign(**{'Outlet ID': 'OUT9999', 'Outlet Name': 'Outlet 9999'})
+    merged, new_rows, error_message = base.append(build(second_visit))
+    assert error_message is None and len(new_rows) == 2 and len(merged) == len(base) + 2
+    assert_consistent(merged)
+
+
+def test_append_of_only_duplicates_returns_the_dataset(make_visits):
+    data = make_visits(employees=2, days=2, per_day=4)
+    base = build(data)
+    merged, new_rows, error_message = base.append(build(data.head(5)))
+    assert merged is base and len(new_rows) == 0 and error_message is None
+
+
+def test_append_requires_the_same_columns(make_visits):
+    data = make_visits(employees=2, days=1, per_day=3)
+    merged, _, error_message = build(data).append(build(data.drop(columns=['Visit Time'])))
+    assert merged is None and 'same columns' in error_message
+
+
+def test_visit_keys_identify_the_same_visit_across_uploads(make_visits):
+    data = make_visits(employees=3, days=2, per_day=4)
+    whole, part = build(data), build(data.head(7))
+    assert len(np.unique(whole.visit_keys())) == len(whole)
+    assert np.isin(part.visit_keys(), whole.visit_keys()).all()
+    other = build(data.head(7).assign(**{'Visit Time': '23:59:00'}))
+    assert not np.isin(other.visit_keys(), whole.visit_keys()).any()
+
+
+def test_save_and_load_round_trip(make_visits, tmp_path):
+    dataset = build(make_visits(employees=3, days=2, per_day=4))
+    dataset.save(str(tmp_path))
+    loaded = Dataset.load(str(tmp_path))
+    assert loaded is not None
+    assert (loaded.keys == dataset.keys).all()
+    pd.testing.assert_frame_equal(canonical_rows(loaded), canonical_rows(dataset))
+    pd.testing.assert_frame_equal(loaded.daily, dataset.daily, check_dtype=False)
+    assert_consistent(loaded)
+
+
+def test_load_rejects_other_storage_formats(make_visits, tmp_path):
+    build(make_visits(employees=1, days=1, per_day=2)).save(str(tmp_path))
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(manifest.read_text().replace('"format": ', '"format": -'))
+    assert Dataset.load(str(tmp_path)) is None
+    assert Dataset.load(str(tmp_path / 'missing')) is None
+
+
+@pytest.mark.parametrize('employee', [None, 'Emp 1'])
+def test_employee_dates_and_daily_selection_agree(make_visits, employee):
+    dataset = build(make_visits(employees=3, days=3, per_day=4))
+    selection = dataset.select(employee_name=employee)
+    daily = dataset.daily_in_selection(selection)
+    assert daily['punches'].sum() == len(Dataset.row_index(selection))
+    if employee:
+        dates = dataset.employee_dates(employee)
+        assert dates['rows'].tolist() == [4, 4, 4]
+    assert dataset.employee_dates('Nobody') is None
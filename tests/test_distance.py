@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from distance import EARTH_RADIUS_KM, daily_route_totals, haversine_km, simplify_route
+
+
+def test_haversine_known_distances():
+    # One degree of latitude, and a quarter of the equator
+    assert haversine_km(0, 0, 1, 0) == pytest.approx(EARTH_RADIUS_KM * np.pi / 180)
+    assert haversine_km(0, 0, 0, 90) == pytest.approx(EARTH_RADIUS_KM * np.pi / 2)
+    assert haversine_km(12.97, 77.59, 12.97, 77.59) == 0
+    # Across the antimeridian the short way round
+    assert haversine_km(0, 179.5, 0, -179.5) == pytest.approx(EARTH_RADIUS_KM * np.pi / 180)
+
+
+def test_haversine_is_elementwise():
+    lat1 = np.array([0.0, 10.0, -45.0])
+    lon1 = np.array([0.0, 20.0, 170.0])
+    lat2 = np.array([1.0, 10.5, -44.0])
+    lon2 = np.array([0.0, 21.0, -175.0])
+    expected = [haversine_km(*point) for point in zip(lat1, lon1, lat2, lon2)]
+    np.testing.assert_allclose(haversine_km(lat1, lon1, lat2, lon2), expected)
+    # Antipodal points do not produce NaN from rounding
+    assert haversine_km(0, 0, 0, 180) == pytest.approx(EARTH_RADIUS_KM * np.pi)
+
+
+def test_daily_route_totals_split_at_days_and_skip_missing_points():
+    day = 86400
+    lat = np.array([0.0, 0.1, np.nan, 0.2, 5.0, 5.1])
+    lon = np.zeros(6)
+    codes = np.array([0, 0, 0, 0, 0, 1])
+    seconds = np.array([0, 60, 120, 180, day + 60, 60])
+    totals = daily_route_totals(lat, lon, codes, seconds)
+    assert totals['employee_code'].tolist() == [0, 0, 1]
+    assert totals['points'].tolist() == [3, 1, 1]
+    # The missing point is skipped and the jump to the next day not counted
+    np.testing.assert_allclose(totals['km'], [haversine_km(0, 0, 0.2, 0), 0, 0])
+
+
+def perpendicular_distance_m(lat, lon, keep):
+    """Largest distance in metres from a dropped point to the simplified line, on the local plane."""
+    scale = np.radians(1) * EARTH_RADIUS_KM * 1000
+    x, y = lon * np.cos(np.radians(np.nanmean(lat))) * scale, lat * scale
+    kept = np.flatnonzero(keep)
+    worst = 0.0
+    for start, end in zip(kept[:-1], kept[1:]):
+        for i in range(start + 1, end):
+            dx, dy = x[end] - x[start], y[end] - y[start]
+            t = np.clip(((x[i] - x[start]) * dx + (y[i] - y[start]) * dy) / (dx * dx + dy * dy), 0, 1)
+            worst = max(worst, np.hypot(x[i] - x[start] - t * dx, y[i] - y[start] - t * dy))
+    return worst
+
+
+def test_simplify_route_drops_points_on_a_straight_line():
+    lat = np.linspace(12.0, 12.1, 50)
+    lon = np.linspace(77.0, 77.1, 50)
+    keep = simplify_route(lat, lon, 1)
+    assert np.flatnonzero(keep).tolist() == [0, 49]
+
+
+def test_simplify_route_keeps_corners_and_stays_within_tolerance():
+    rng = np.random.default_rng(1)
+    lat = 12.9 + np.cumsum(rng.normal(0, 0.001, 500))
+    lon = 77.5 + np.cumsum(rng.normal(0, 0.001, 500))
+    keep = simplify_route(lat, lon, 20)
+    assert keep[0] and keep[-1]
+    assert 2 < keep.sum() < len(lat)
+    assert perpendicular_distance_m(lat, lon, keep) <= 20
+    # A larger tolerance keeps fewer points
+    assert simplify_route(lat, lon, 200).sum() < keep.sum()
+    # No tolerance keeps everything
+    assert simplify_route(lat, lon, 0).all()
+
+
+def test_simplify_route_keeps_group_ends():
+    lat = np.linspace(12.0, 12.1, 30)
+    lon = np.linspace(77.0, 77.1, 30)
+    groups = np.repeat([0, 1, 2], 10)
+    keep = simplify_route(lat, lon, 1, groups)
+    assert np.flatnonzero(keep).tolist() == [0, 9, 10, 19, 20, 29]
+    assert not simplify_route(np.empty(0), np.empty(0), 1).any()
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import CANCELLED, DONE, FAILED, JobQueue
+
+
+def wait(queue, job_id, timeout=10):
+    """Poll a job like a client does until it finishes; returns its final state."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        state = queue.status(job_id)
+        if state['status'] in jobs.FINISHED_STATES:
+            return state
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} did not finish')
+
+
+def blocking_work(started, release):
+    """Work that reports progress until released, so it can be cancelled while running."""
+    def work(job):
+        started.set()
+        while not release.wait(0.01):
+            job.report(stage='working')
+        job.report(stage='finishing')
+        return {'ok': True}, None
+    return work
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(workers=2, ttl=600, state_dir=str(tmp_path))
+    yield queue
+    queue._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def test_job_runs_to_done_with_its_result(queue, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_STATE_INTERVAL', 0)
+
+    def work(job, rows):
+        job.report(stage='parsing', rows=rows)
+        return {'rows': rows}, None
+
+    job = queue.submit('upload', work, 42)
+    assert job.to_dict()['status'] in ('queued', 'running', 'done')
+    state = wait(queue, job.id)
+    assert state['status'] == DONE
+    assert state['result'] == {'rows': 42}
+    assert state['progress'] == {'stage': 'parsing', 'rows': 42}
+    # Other processes read the same state from the job's file
+    other = JobQueue(workers=1, state_dir=queue.state_dir)
+    assert other.status(job.id) == state
+
+
+def test_errors_and_exceptions_fail_the_job(queue):
+    failed = wait(queue, queue.submit('upload', lambda job: (None, 'No data rows.')).id)
+    assert failed['status'] == FAILED and failed['error'] == 'No data rows.' and 'result' not in failed
+
+    def crash(job):
+        raise ValueError('bad file')
+    crashed = wait(queue, queue.submit('upload', crash).id)
+    assert crashed['status'] == FAILED and crashed['error'] == 'bad file'
+
+
+def test_cancelling_a_running_job_stops_it_at_its_next_report(queue):
+    started, release = threading.Event(), threading.Event()
+    job = queue.submit('render', blocking_work(started, release))
+    assert started.wait(5)
+    assert queue.cancel(job.id)['cancel_requested'] is True
+    state = wait(queue, job.id)
+    assert state['status'] == CANCELLED and 'result' not in state
+    release.set()
+    # A finished job cannot be cancelled again
+    assert job.cancel() is False
+
+
+def test_cancelling_a_queued_job_cancels_it_at_once(tmp_path):
+    queue = JobQueue(workers=1, state_dir=str(tmp_path))
+    started, release = threading.Event(), threading.Event()
+    running = queue.submit('render', blocking_work(started, release))
+    assert started.wait(5)
+    waiting = queue.submit('render', blocking_work(threading.Event(), release))
+    assert queue.cancel(waiting.id)['status'] == CANCELLED
+    release.set()
+    assert wait(queue, running.id)['status'] == DONE
+    queue._executor.shutdown(wait=True)
+
+
+def test_another_process_can_poll_and_cancel_through_the_state_files(queue):
+    started, release = threading.Event(), threading.Event()
+    job = queue.submit('render', blocking_work(started, release))
+    assert started.wait(5)
+    # A queue sharing only the state directory stands in for another worker process
+    other = JobQueue(workers=1, state_dir=queue.state_dir)
+    assert other.get(job.id) is None
+    assert other.status(job.id)['status'] == 'running'
+    assert other.cancel(job.id)['cancel_requested'] is True
+    assert os.path.exists(os.path.join(queue.state_dir, job.id + '.cancel'))
+    assert wait(other, job.id)['status'] == CANCELLED
+    release.set()
+    # Finished jobs are not cancelled again
+    assert other.cancel(job.id)['status'] == CANCELLED
+
+
+def test_unknown_and_malformed_job_ids(queue, tmp_path):
+    assert queue.status('0' * 32) is None
+    assert queue.cancel('0' * 32) is None
+    # IDs are never used as paths unless they are hex UUIDs
+    (tmp_path / 'secret.json').write_text('{"status": "done"}')
+    assert queue.status('secret') is None
+    assert queue.status('../' + os.path.basename(str(tmp_path)) + '/secret') is None
+
+
+def test_finished_jobs_expire_with_their_files(tmp_path):
+    queue = JobQueue(workers=1, ttl=0, state_dir=str(tmp_path))
+    first = queue.submit('upload', lambda job: ({}, None))
+    wait(queue, first.id)
+    time.sleep(0.01)
+    second = queue.submit('upload', lambda job: ({}, None))
+    assert queue.get(first.id) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), first.id + '.json'))
+    assert wait(queue, second.id)['status'] == DONE
+    queue._executor.shutdown(wait=True)
+
+
+def test_without_a_state_dir_jobs_are_only_known_in_process():
+    queue = JobQueue(workers=1, state_dir='')
+    job = queue.submit('upload', lambda job: ({'n': 1}, None))
+    assert wait(queue, job.id)['result'] == {'n': 1}
+    assert JobQueue(workers=1, state_dir='').status(job.id) is None
+    queue._executor.shutdown(wait=True)
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from distance import haversine_km
+from spatial_index import GridIndex
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    lat = rng.uniform(12.0, 13.0, 5000)
+    lon = rng.uniform(77.0, 78.0, 5000)
+    # Missing and off-the-globe locations are never returned
+    lat[:10] = np.nan
+    lon[10:20] = 200.0
+    return lat, lon
+
+
+def located(lat, lon):
+    return np.isfinite(lat) & np.isfinite(lon) & (np.abs(lon) <= 180)
+
+
+def test_bbox_matches_brute_force(points):
+    lat, lon = points
+    index = GridIndex(lat, lon)
+    assert len(index) == 4980
+    for west, south, east, north in [(77.2, 12.3, 77.25, 12.31), (76.0, 11.0, 79.0, 14.0), (77.5, 12.5, 77.5, 12.5)]:
+        expected = np.flatnonzero(located(lat, lon) & (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east))
+        assert np.sort(index.bbox(west, south, east, north)).tolist() == expected.tolist()
+
+
+def test_radius_matches_brute_force(points):
+    lat, lon = points
+    index = GridIndex(lat, lon)
+    distances = np.where(located(lat, lon), haversine_km(12.5, 77.5, lat, lon) * 1000, np.inf)
+    rows, found = index.radius(12.5, 77.5, 3000)
+    assert sorted(rows.tolist()) == np.flatnonzero(distances <= 3000).tolist()
+    # Nearest first, with the distances of the rows returned
+    assert (np.diff(found) >= 0).all()
+    np.testing.assert_allclose(found, distances[rows])
+
+
+def test_nearest_matches_brute_force(points):
+    lat, lon = points
+    index = GridIndex(lat, lon)
+    distances = np.where(located(lat, lon), haversine_km(12.01, 77.99, lat, lon) * 1000, np.inf)
+    rows, found = index.nearest(12.01, 77.99, 25)
+    np.testing.assert_allclose(found, np.sort(distances)[:25])
+    # Within max_radius_m and among the allowed rows only
+    rows, found = index.nearest(12.5, 77.5, 10, max_radius_m=500, where=lambda r: r % 2 == 0)
+    assert (found <= 500).all() and (rows % 2 == 0).all()
+
+
+def test_queries_wrap_across_the_antimeridian():
+    rng = np.random.default_rng(1)
+    lat = rng.uniform(-60.0, -50.0, 3000)
+    lon = rng.uniform(-180.0, 180.0, 3000)
+    lon[:1500] = rng.uniform(179.0, 180.0, 1500)
+    lon[1500:2500] = rng.uniform(-180.0, -179.0, 1000)
+    index = GridIndex(lat, lon)
+    for centre_lon in (179.9, -179.9):
+        distances = haversine_km(-55.0, centre_lon, lat, lon) * 1000
+        rows, _ = index.radius(-55.0, centre_lon, 100000)
+        expected = np.flatnonzero(distances <= 100000)
+        assert sorted(rows.tolist()) == expected.tolist()
+        # Points on both sides of the antimeridian are found
+        assert (lon[rows] > 0).any() and (lon[rows] < 0).any()
+        _, found = index.nearest(-55.0, centre_lon, 50)
+        np.testing.assert_allclose(found, np.sort(distances)[:50])
+
+
+def test_radius_around_a_pole_covers_every_longitude():
+    lat = np.array([89.9, 89.9, 89.9, 80.0])
+    lon = np.array([-170.0, 0.0, 170.0, 0.0])
+    rows, _ = GridIndex(lat, lon).radius(90.0, 0.0, 50000)
+    assert sorted(rows.tolist()) == [0, 1, 2]
+
+
+def test_polygon_matches_brute_force(points):
+    lat, lon = points
+    index = GridIndex(lat, lon)
+    # A triangle: inside when below the diagonal of the unit box
+    triangle = [[12.2, 77.2], [12.2, 77.8], [12.8, 77.8]]
+    rows = np.sort(index.polygon(triangle))
+    inside = located(lat, lon) & (lat > 12.2) & (lon < 77.8) & (lat - 12.2 < lon - 77.2)
+    near_edge = np.abs((lat - 12.2) - (lon - 77.2)) < 1e-9
+    assert set(np.flatnonzero(inside & ~near_edge)) <= set(rows.tolist()) <= set(np.flatnonzero(inside | near_edge))
+
+
+def test_merge_matches_a_rebuilt_index(points):
+    lat, lon = points
+    rng = np.random.default_rng(2)
+    new_rows = np.sort(rng.choice(len(lat), 1000, replace=False))
+    old_rows = np.setdiff1d(np.arange(len(lat)), new_rows)
+    merged = GridIndex(lat[old_rows], lon[old_rows]).merge(lat[new_rows], lon[new_rows], new_rows, old_rows)
+    rebuilt = GridIndex(lat, lon)
+    assert (np.diff(merged.keys) >= 0).all()
+    assert merged.keys.tolist() == rebuilt.keys.tolist()
+    assert sorted(merged.rows.tolist()) == sorted(rebuilt.rows.tolist())
+    np.testing.assert_array_equal(merged.lat, lat[merged.rows])
+    assert sorted(merged.bbox(77.2, 12.2, 77.4, 12.4).tolist()) == sorted(rebuilt.bbox(77.2, 12.2, 77.4, 12.4).tolist())
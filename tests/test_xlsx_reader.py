@@ -0,0 +1,89 @@
+import datetime
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from xlsx_reader import XlsxReader
+
+HEADER = ['Employee Name', 'Punch In Date', 'Punch In Lat', 'Visits', 'Outlet ID', 'Remarks', 'Checked']
+
+
+def write_workbook(path, rows, write_only):
+    """A sheet with text, dates, floats, integers, mixed and blank cells, behind another sheet."""
+    workbook = openpyxl.Workbook(write_only=write_only)
+    sheet = workbook.create_sheet('Data', 0) if write_only else workbook.active
+    sheet.append(HEADER)
+    for i in range(rows):
+        sheet.append([
+            f'Emp {i % 7}',
+            datetime.datetime(2025, 7, 1, 9) + datetime.timedelta(minutes=37 * i),
+            12.5 + i / 1000,
+            i,
+            f'OUT{i:04d}' if i % 3 else i,
+            None if i % 4 else f'note {i}',
+            i % 2 == 0,
+        ])
+    workbook.create_sheet('Other').append(['not', 'this', 'sheet'])
+    workbook.save(path)
+
+
+def read_all(path, columns, chunk_rows):
+    reader = XlsxReader(str(path))
+    try:
+        chunks = list(reader.chunks(columns, chunk_rows))
+    finally:
+        reader.close()
+    assert all(len(chunk) <= chunk_rows for chunk in chunks)
+    return pd.concat(chunks, ignore_index=True)
+
+
+@pytest.mark.parametrize('write_only', [False, True])
+@pytest.mark.parametrize('chunk_rows', [7, 1000])
+def test_chunks_match_read_excel(tmp_path, write_only, chunk_rows):
+    path = tmp_path / 'visits.xlsx'
+    write_workbook(path, 100, write_only)
+    expected = pd.read_excel(path)
+    assert XlsxReader(str(path)).header == HEADER
+
+    # Only the requested columns, in the requested order
+    columns = ['Outlet ID', 'Punch In Date', 'Employee Name', 'Punch In Lat', 'Visits', 'Remarks', 'Checked']
+    actual = read_all(path, columns, chunk_rows)
+    assert list(actual.columns) == columns
+    assert len(actual) == len(expected)
+    for col in columns:
+        if col == 'Punch In Date':
+            assert (actual[col].to_numpy() == expected[col].to_numpy()).all()
+        elif col == 'Remarks':
+            assert actual[col].isna().tolist() == expected[col].isna().tolist()
+            assert actual[col].dropna().tolist() == expected[col].dropna().tolist()
+        else:
+            assert actual[col].tolist() == expected[col].tolist()
+
+
+def test_missing_cells_are_blanks(tmp_path):
+    path = tmp_path / 'sparse.xlsx'
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['A', 'B', 'C'])
+    sheet['A2'], sheet['C2'] = 'x', 1.5
+    sheet['B3'] = 'y'
+    sheet['C5'] = 2.5
+    workbook.save(path)
+    actual = read_all(path, ['A', 'B', 'C'], 2)
+    expected = pd.read_excel(path)
+    assert len(actual) == len(expected) == 4
+    for col in 'ABC':
+        assert actual[col].isna().tolist() == expected[col].isna().tolist()
+        assert actual[col].dropna().tolist() == expected[col].dropna().tolist()
+
+
+def test_header_only_sheet_has_no_chunks(tmp_path):
+    path = tmp_path / 'empty.xlsx'
+    workbook = openpyxl.Workbook()
+    workbook.active.append(HEADER)
+    workbook.save(path)
+    reader = XlsxReader(str(path))
+    assert reader.header == HEADER
+    assert list(reader.chunks(['Employee Name'], 10)) == []
+    reader.close()
@@ -0,0 +1,190 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset import PARSED_VISIT_TIME_COL, format_datetimes, normalize_outlet_ids
+from distance import haversine_km
+from file_lock import locked, replace_file
+from lru import SizedLRUCache
+
+# Visits farther than this from their outlet's reference location are flagged
+GEOFENCE_RADIUS_M = float(os.getenv('GEOFENCE_RADIUS_M', 200))
+
+# Uploaded outlet reference locations (outlet_id, lat, lon). Outlets without
+# an entry fall back to their outlet master location, then to the median
+# location of their visits in the dataset.
+OUTLET_LOCATIONS_PATH = os.getenv(
+    'OUTLET_LOCATIONS_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'outlet_locations.csv')
+)
+
+# Per-dataset outlet codes and median visit locations, in MB, reused by every
+# verification of the same dataset version
+OUTLET_MEDIANS_CACHE_MB = int(os.getenv('OUTLET_MEDIANS_CACHE_MB', 64))
+
+# Verification status of a visit
+WITHIN = 'within'
+OUTSIDE = 'outside'
+NO_REFERENCE = 'no_reference'
+
+
+def load_outlet_locations():
+    """The uploaded outlet reference locations as a DataFrame indexed by outlet ID, or None."""
+    if not OUTLET_LOCATIONS_PATH or not os.path.exists(OUTLET_LOCATIONS_PATH):
+        return None
+    try:
+        locations = pd.read_csv(OUTLET_LOCATIONS_PATH, dtype={'outlet_id': str})
+        locations['outlet_id'] = normalize_outlet_ids(locations['outlet_id'])
+        return locations.drop_duplicates('outlet_id', keep='last').set_index('outlet_id')
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable outlet locations file '{OUTLET_LOCATIONS_PATH}': {e}")
+        return None
+
+
+def outlet_locations_version():
+    """Changes whenever the outlet locations file is replaced (for cache keys)."""
+    try:
+        return os.stat(OUTLET_LOCATIONS_PATH).st_mtime_ns
+    except (OSError, TypeError):
+        return 0
+
+
+def save_outlet_locations(locations):
+    """
+    Replace the outlet reference locations with a DataFrame of outlet_id,
+    lat, lon, atomically and under the file's lock (see file_lock), so
+    concurrent uploads never interleave.
+    """
+    locations = locations[['outlet_id', 'lat', 'lon']].assign(outlet_id=normalize_outlet_ids(locations['outlet_id']))
+    with locked(OUTLET_LOCATIONS_PATH):
+        replace_file(OUTLET_LOCATIONS_PATH, lambda f: locations.to_csv(f, index=False))
+
+
+def outlet_codes(dataset):
+    """Per-row outlet codes (-1 where missing) and the outlet IDs they refer to, as strings."""
+    return _outlet_medians(dataset)[:2]
+
+
+def _compute_outlet_medians(dataset):
+    col = dataset.columns.get('outlet_id_col')
+    if not col or col not in dataset.frame.columns:
+        codes, outlet_ids = np.full(len(dataset), -1), np.empty(0, dtype=object)
+    else:
+        codes, outlet_ids = pd.factorize(normalize_outlet_ids(dataset.frame[col]))
+        outlet_ids = np.asarray(outlet_ids, dtype=object)
+    located = (codes >= 0) & np.isfinite(dataset.visit_lat) & np.isfinite(dataset.visit_lon)
+    medians = pd.DataFrame({
+        'code': codes[located], 'lat': dataset.visit_lat[located], 'lon': dataset.visit_lon[located],
+    }).groupby('code').agg(lat=('lat', 'median'), lon=('lon', 'median'), visits=('lat', 'size'))
+    return codes, outlet_ids, medians
+
+
+_medians_cache = SizedLRUCache(
+    OUTLET_MEDIANS_CACHE_MB * 1024 * 1024,
+    sizeof=lambda value: value[0].nbytes + 64 * len(value[1]) + 24 * len(value[2]),
+)
+
+
+def _outlet_medians(dataset):
+    """
+    (outlet codes, outlet IDs, median visit location per code) of a dataset.
+    These scan every row, so they are cached per dataset ID and version.
+    """
+    if not dataset.dataset_id:
+        return _compute_outlet_medians(dataset)
+    key = (dataset.dataset_id, dataset.version)
+    value = _medians_cache.get(key)
+    if value is None:
+        value = _compute_outlet_medians(dataset)
+        _medians_cache.put(key, value)
+    return value
+
+
+def reference_locations(dataset, outlet_locations=None, outlet_master=None):
+    """
+    Reference location of every outlet of the dataset, indexed like the outlet
+    codes from outlet_codes: the uploaded location when there is one, else
+    the canonical location in the outlet master, else the median of all of
+    the outlet's visit locations in the dataset. Returns a DataFrame with lat,
+    lon, visits (located visits in the dataset) and source ('master' for
+    uploaded locations, 'outlet_master', 'median' or None when the outlet has
+    no location at all).
+    """
+    _, outlet_ids, medians = _outlet_medians(dataset)
+    reference = medians.reindex(np.arange(len(outlet_ids)))
+    reference['visits'] = reference['visits'].fillna(0).astype(np.int64)
+    reference['source'] = np.where(reference['lat'].notna(), 'median', None)
+    reference.insert(0, 'outlet_id', outlet_ids)
+
+    # Later sources take precedence
+    for locations, source in ((outlet_master, 'outlet_master'), (outlet_locations, 'master')):
+        if locations is None or not len(outlet_ids):
+            continue
+        known_locations = locations.reindex(outlet_ids)
+        known = (known_locations['lat'].notna() & known_locations['lon'].notna()).to_numpy()
+        reference.loc[known, 'lat'] = known_locations['lat'].to_numpy()[known]
+        reference.loc[known, 'lon'] = known_locations['lon'].to_numpy()[known]
+        reference.loc[known, 'source'] = source
+    return reference
+
+
+def verify_visits(dataset, rows, radius_m=GEOFENCE_RADIUS_M, outlet_locations=None, outlet_master=None):
+    """
+    Check the visits in the given dataset rows against their outlets'
+    reference locations (see reference_locations) in one vectorized pass. Returns a DataFrame with one
+    row per visit that has a location: employee, visit time, outlet, the visit
+    and reference coordinates, the distance between them in metres and the
+    status (WITHIN or OUTSIDE the geofence radius, or NO_REFERENCE).
+    """
+    rows = rows[np.isfinite(dataset.visit_lat[rows]) & np.isfinite(dataset.visit_lon[rows])]
+    codes, _ = outlet_codes(dataset)
+    reference = reference_locations(dataset, outlet_locations, outlet_master)
+    # Code -1 (no outlet ID) picks the trailing missing entry
+    row_codes = codes[rows]
+    ref_lat = np.append(reference['lat'].to_numpy(dtype=np.float64), np.nan)[row_codes]
+    ref_lon = np.append(reference['lon'].to_numpy(dtype=np.float64), np.nan)[row_codes]
+    ref_source = np.append(reference['source'].to_numpy(dtype=object), None)[row_codes]
+    outlet_ids = np.append(reference['outlet_id'].to_numpy(dtype=object), None)[row_codes]
+
+    visit_lat, visit_lon = dataset.visit_lat[rows], dataset.visit_lon[rows]
+    distance_m = haversine_km(visit_lat, visit_lon, ref_lat, ref_lon) * 1000
+    status = np.where(np.isnan(distance_m), NO_REFERENCE, np.where(distance_m <= radius_m, WITHIN, OUTSIDE))
+
+    frame = dataset.frame
+    if PARSED_VISIT_TIME_COL in frame.columns:
+        visit_time = format_datetimes(frame[PARSED_VISIT_TIME_COL].to_numpy()[rows], missing='N/A')
+    else:
+        visit_time = np.full(len(rows), 'N/A', dtype=object)
+    outlet_name_col = dataset.columns.get('outlet_name_col')
+    return pd.DataFrame({
+        'row': rows,
+        'employee': dataset.employees[dataset.codes[rows]],
+        'visit_time': visit_time,
+        'outlet_id': outlet_ids,
+        'outlet_name': frame[outlet_name_col].take(rows).astype(str).to_numpy() if outlet_name_col else None,
+        'visit_lat': visit_lat,
+        'visit_lon': visit_lon,
+        'reference_lat': ref_lat,
+        'reference_lon': ref_lon,
+        'reference_source': ref_source,
+        'distance_m': distance_m.round(1),
+        'status': status,
+    })
+
+
+def verification_summary(verified):
+    """Visit counts per status, overall and per employee."""
+    counts = verified.groupby(['employee', 'status']).size().unstack(fill_value=0)
+    for status in (WITHIN, OUTSIDE, NO_REFERENCE):
+        if status not in counts.columns:
+            counts[status] = 0
+    counts = counts[[WITHIN, OUTSIDE, NO_REFERENCE]]
+    return {
+        'visits': int(len(verified)),
+        **{status: int(counts[status].sum()) for status in counts.columns},
+        'employees': [
+            {'employee': emp, **{status: int(n) for status, n in row.items()}}
+            for emp, row in counts.iterrows()
+        ],
+    }
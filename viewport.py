@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+
+from clustering import MAX_ZOOM, grid_clusters
+from map_layers import compact_points
+
+# Viewport queries (/api/points) return individual points only from this
+# zoom up and only while the viewport holds at most VIEWPORT_MAX_POINTS of
+# them; otherwise the points are aggregated into grid clusters.
+VIEWPORT_CLUSTER_MAX_ZOOM = int(os.getenv('VIEWPORT_CLUSTER_MAX_ZOOM', 15))
+VIEWPORT_MAX_POINTS = int(os.getenv('VIEWPORT_MAX_POINTS', 2000))
+
+WORLD_BBOX = (-180.0, -90.0, 180.0, 90.0)
+
+
+def parse_bbox(value):
+    """
+    Parse 'west,south,east,north' (degrees, or a list of the four numbers)
+    into a tuple of floats. Returns (bbox, error_message); an empty value
+    means the whole world.
+    """
+    if not value:
+        return WORLD_BBOX, None
+    parts = value if isinstance(value, (list, tuple)) else str(value).split(',')
+    try:
+        west, south, east, north = (float(part) for part in parts)
+    except (TypeError, ValueError):
+        return None, "Invalid bbox. Use 'west,south,east,north' in degrees."
+    if not (west <= east and south <= north):
+        return None, "Invalid bbox. West must not exceed east, nor south exceed north."
+    return (west, south, east, north), None
+
+
+def parse_zoom(value, default=5):
+    """Parse a Leaflet zoom level. Returns (zoom, error_message)."""
+    if value in (None, ''):
+        return default, None
+    try:
+        zoom = int(float(value))
+    except (TypeError, ValueError):
+        return None, 'Invalid zoom. Use a number between 0 and 22.'
+    return min(max(zoom, 0), MAX_ZOOM), None
+
+
+def selection_bounds(dataset, rows):
+    """[[south, west], [north, east]] of the punch-in points in rows, or None."""
+    lat, lon = dataset.punch_lat[rows], dataset.punch_lon[rows]
+    located = np.isfinite(lat) & np.isfinite(lon)
+    if not located.any():
+        return None
+    lat, lon = lat[located], lon[located]
+    return [[round(float(lat.min()), 5), round(float(lon.min()), 5)], [round(float(lat.max()), 5), round(float(lon.max()), 5)]]
+
+
+def viewport_points(dataset, selection, bbox, zoom):
+    """
+    Points of a Dataset selection inside bbox for a map at the given zoom.
+    Returns the points themselves (in the compact_points layout) when zoomed
+    in close enough and there are few enough of them, and grid clusters
+    otherwise, together with the bounds of the whole selection.
+    """
+    rows = dataset.row_index(selection)
+    punch_rows = np.sort(dataset.spatial['punch'].bbox(*bbox))
+    punch_rows = punch_rows[dataset.in_selection(punch_rows, selection)]
+    visit_rows = np.sort(dataset.spatial['visit'].bbox(*bbox))
+    visit_rows = visit_rows[dataset.in_selection(visit_rows, selection)]
+    total = len(punch_rows) + len(visit_rows)
+    result = {'zoom': zoom, 'total': total, 'bounds': selection_bounds(dataset, rows)}
+
+    if zoom >= VIEWPORT_CLUSTER_MAX_ZOOM and total <= VIEWPORT_MAX_POINTS:
+        result['clustered'] = False
+        result['points'] = compact_points(dataset, np.union1d(punch_rows, visit_rows), bbox)
+        return result
+
+    lat = np.concatenate([dataset.punch_lat[punch_rows], dataset.visit_lat[visit_rows]])
+    lon = np.concatenate([dataset.punch_lon[punch_rows], dataset.visit_lon[visit_rows]])
+    is_visit = np.r_[np.zeros(len(punch_rows)), np.ones(len(visit_rows))]
+    result['clustered'] = True
+    result['clusters'] = grid_clusters(lat, lon, is_visit, zoom)
+    return result
@@ -0,0 +1,274 @@
+import posixpath
+import zipfile
+from xml.etree.ElementTree import iterparse
+from xml.parsers import expat
+
+import numpy as np
+import pandas as pd
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+# Element names as reported by the expat parser (namespace URI, '}', local name)
+_CELL = _MAIN_NS + '}c'
+_ROW = _MAIN_NS + '}row'
+_VALUE = _MAIN_NS + '}v'
+_TEXT = _MAIN_NS + '}t'
+
+# Excel stores dates as days since 1899-12-30 (1900 date system)
+_EXCEL_EPOCH = np.datetime64('1899-12-30', 'ns')
+_MS_PER_DAY = 86400 * 1000
+
+# Compressed sheet XML is decompressed and parsed this many bytes at a time
+_BLOCK_SIZE = 1 << 20
+
+# Cell type for numbers whose style has a date or time format
+_DATE = 'date'
+
+
+def _column_index(letters):
+    """Zero-based column index of the column letters of a cell reference ('AB' for 'AB12')."""
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+
+class XlsxReader:
+    """
+    Streaming reader for the first worksheet of an .xlsx file (path or
+    binary file object), for files too large for pd.read_excel.
+
+    The sheet XML is fed to an expat parser block by block. Only the raw text
+    of the cells in the requested columns is kept: no cell objects are built
+    (openpyxl builds one per cell) and the other columns never reach Python.
+    Values are converted one column at a time when a chunk is complete. The
+    first row is the header; numeric cells with a date format become
+    datetime64 values.
+    """
+
+    def __init__(self, file):
+        self.zip = zipfile.ZipFile(file)
+        self.shared_strings = np.asarray(self._read_shared_strings(), dtype=object)
+        self.date_styles = self._read_date_styles()
+        self._sheet = self.zip.open(self._first_sheet_path())
+        self._parser = expat.ParserCreate(namespace_separator='}')
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._characters
+        self._done = False
+
+        # Parse state: the columns to keep (None for all), their raw cell
+        # texts and types per position, the number of complete rows buffered,
+        # the sheet row number of the last row, and the cell being read
+        self._wanted = None
+        self._texts = {}
+        self._kinds = {}
+        self._rows = 0
+        self._row_number = 0
+        self._positions = {}
+        self._position = -1
+        self._cell = None
+        self._text = []
+        self._in_text = False
+
+        while self._rows < 1 and self._feed():
+            pass
+        header = self._take(min(self._rows, 1))
+        width = max(header, default=-1) + 1
+        self.header = [
+            '' if i not in header or pd.isna(header[i].iloc[0]) else str(header[i].iloc[0])
+            for i in range(width)
+        ]
+
+    def close(self):
+        self._sheet.close()
+        self.zip.close()
+
+    def _read_xml(self, name, events=('end',)):
+        if name not in self.zip.namelist():
+            return ()
+        return iterparse(self.zip.open(name), events=events)
+
+    def _first_sheet_path(self):
+        """Path of the first worksheet in workbook order (what pd.read_excel reads by default)."""
+        sheet_id = None
+        for _, element in self._read_xml('xl/workbook.xml'):
+            if element.tag == '{%s}sheet' % _MAIN_NS:
+                sheet_id = element.get('{%s}id' % _REL_NS)
+                break
+        for _, element in self._read_xml('xl/_rels/workbook.xml.rels'):
+            if element.tag == '{%s}Relationship' % _PKG_REL_NS and element.get('Id') == sheet_id:
+                target = element.get('Target')
+                return target.lstrip('/') if target.startswith('/') else posixpath.normpath('xl/' + target)
+        return 'xl/worksheets/sheet1.xml'
+
+    def _read_shared_strings(self):
+        strings = []
+        text, run = '{%s}t' % _MAIN_NS, '{%s}r' % _MAIN_NS
+        for _, element in self._read_xml('xl/sharedStrings.xml'):
+            if element.tag == '{%s}si' % _MAIN_NS:
+                # Plain text, or rich text runs (phonetic runs are left out)
+                plain = element.find(text)
+                strings.append(plain.text or '' if plain is not None else
+                               ''.join(r.findtext(text) or '' for r in element.iterfind(run)))
+                element.clear()
+        return strings
+
+    def _read_date_styles(self):
+        """Indexes (as attribute strings) of the cell styles whose number format is a date or time."""
+        formats = {}
+        styles = []
+        in_cell_xfs = False
+        for event, element in self._read_xml('xl/styles.xml', events=('start', 'end')):
+            if element.tag == '{%s}cellXfs' % _MAIN_NS:
+                in_cell_xfs = event == 'start'
+            elif event == 'end' and element.tag == '{%s}numFmt' % _MAIN_NS:
+                formats[int(element.get('numFmtId'))] = element.get('formatCode', '')
+            elif event == 'end' and in_cell_xfs and element.tag == '{%s}xf' % _MAIN_NS:
+                styles.append(int(element.get('numFmtId', 0)))
+        return {
+            str(i) for i, fmt_id in enumerate(styles)
+            if is_date_format(formats.get(fmt_id, BUILTIN_FORMATS.get(fmt_id, 'General')))
+        }
+
+    def _start(self, name, attrs):
+        if name == _CELL:
+            ref = attrs.get('r')
+            if ref:
+                letters = ref.rstrip('0123456789')
+                position = self._positions.get(letters)
+                if position is None:
+                    position = self._positions[letters] = _column_index(letters)
+            else:
+                position = self._position + 1
+            self._position = position
+            if self._wanted is None or position in self._wanted:
+                kind = attrs.get('t', 'n')
+                if kind == 'n' and attrs.get('s') in self.date_styles:
+                    kind = _DATE
+                self._cell = (position, kind)
+                self._text = []
+        elif name == _VALUE or name == _TEXT:
+            self._in_text = self._cell is not None
+        elif name == _ROW:
+            self._position = -1
+            # Rows left out of the sheet between two rows are blank rows, which
+            # pd.read_excel keeps too
+            number = int(attrs['r']) if attrs.get('r') else self._row_number + 1
+            if self._row_number and number > self._row_number + 1:
+                self._rows += number - self._row_number - 1
+                for position, texts in self._texts.items():
+                    texts.extend([None] * (self._rows - len(texts)))
+                    self._kinds[position].extend([None] * (self._rows - len(self._kinds[position])))
+            self._row_number = number
+
+    def _end(self, name):
+        if name == _CELL:
+            if self._cell is not None and self._text:
+                position, kind = self._cell
+                texts = self._texts.get(position)
+                if texts is None:
+                    texts = self._texts[position] = [None] * self._rows
+                    self._kinds[position] = [None] * self._rows
+                texts.append(''.join(self._text))
+                self._kinds[position].append(kind)
+            self._cell = None
+        elif name == _VALUE or name == _TEXT:
+            self._in_text = False
+        elif name == _ROW:
+            self._rows += 1
+            # Cells missing from the row are blanks
+            for position, texts in self._texts.items():
+                if len(texts) < self._rows:
+                    texts.append(None)
+                    self._kinds[position].append(None)
+
+    def _characters(self, data):
+        if self._in_text:
+            self._text.append(data)
+
+    def _feed(self):
+        """Parse the next block of the sheet; False once the sheet is exhausted."""
+        if self._done:
+            return False
+        block = self._sheet.read(_BLOCK_SIZE)
+        self._done = not block
+        self._parser.Parse(block, self._done)
+        return not self._done
+
+    def _take(self, n):
+        """Remove the first n buffered rows and return them as {position: Series}."""
+        columns = {}
+        for position in list(self._texts):
+            texts, kinds = self._texts[position], self._kinds[position]
+            columns[position] = _column(texts[:n], kinds[:n], self.shared_strings)
+            del texts[:n], kinds[:n]
+        self._rows -= n
+        return columns
+
+    def chunks(self, columns, chunk_rows):
+        """
+        Yield the data rows in DataFrames of up to chunk_rows rows holding only
+        the given header names, in that order.
+        """
+        positions = [self.header.index(col) for col in columns]
+        self._wanted = set(positions)
+        # Rows read along with the header still hold every column
+        for position in list(self._texts):
+            if position not in self._wanted:
+                del self._texts[position], self._kinds[position]
+        for position in positions:
+            self._texts.setdefault(position, [None] * self._rows)
+            self._kinds.setdefault(position, [None] * self._rows)
+
+        while True:
+            more = self._feed()
+            while self._rows >= chunk_rows or (not more and self._rows):
+                taken = self._take(min(chunk_rows, self._rows))
+                yield pd.DataFrame({col: taken[position] for col, position in zip(columns, positions)})
+            if not more:
+                return
+
+
+def _convert(kind, texts, shared_strings):
+    """Values of cells of one type from their raw texts (None for error cells)."""
+    if kind == 's':
+        return shared_strings[texts.astype(np.int64)]
+    if kind == 'n':
+        return pd.to_numeric(texts)
+    if kind == _DATE:
+        # Rounded to the millisecond, as serials carry float noise below that
+        serials = pd.to_numeric(texts).astype(np.float64)
+        return _EXCEL_EPOCH + np.round(serials * _MS_PER_DAY).astype('timedelta64[ms]')
+    if kind == 'b':
+        return texts == '1'
+    if kind == 'd':
+        return pd.to_datetime(texts).to_numpy()
+    if kind == 'e':
+        return None
+    return texts  # inline strings and formula strings
+
+
+def _column(texts, kinds, shared_strings):
+    """
+    A typed Series for one column of a chunk: numeric, datetime64 or text
+    when all cells share a type, object when types are mixed; blanks are
+    NaN/NaT.
+    """
+    n = len(texts)
+    texts = np.asarray(texts, dtype=object)
+    kinds = np.asarray(kinds, dtype=object)
+    parts = []
+    for kind in pd.unique(kinds[kinds != None]):  # noqa: E711 (element-wise comparison)
+        rows = np.flatnonzero(kinds == kind)
+        values = _convert(kind, texts[rows], shared_strings)
+        if values is not None:
+            parts.append(pd.Series(values, index=rows))
+    if not parts:
+        return pd.Series(np.full(n, np.nan))
+    column = parts[0] if len(parts) == 1 else pd.concat([part.astype(object) for part in parts])
+    return column.reindex(np.arange(n))